@@ -0,0 +1,88 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Times the radiometric conversion of every landsat band of a METRIC workspace through its
+DN lookup table and through the per pixel arithmetic of function_bank.Num10 and
+L8_Thermal_Radiance that it replaces.
+
+    python -m benchmarks.bench_dn_lut config_file [precision]
+
+Each band is read once, the conversions run on the whole band in memory.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from metric import function_bank as fnbank
+from metric import radiometry
+from metric.metric_py import MetricModel
+
+
+def _best_of(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        seconds.append(time.time() - start)
+    return result, min(seconds)
+
+
+def run(config_filepath, precision="float32", repeat=3):
+    """
+    returns a list of dicts, one per band, with the time of both conversions and their difference
+
+    the arithmetic uses the landsat 8 constants of function_bank, the tables the gains of
+    the MTL file, max_error also shows any difference between the two
+    """
+
+    mike = MetricModel(config_filepath, precision=precision)
+    results = []
+    for number, band in zip([2, 3, 4, 5, 6, 7, 10, 11], mike.landsat_bands):
+        dn = band.read()
+        lut = mike.dn_luts[number]
+        if number in radiometry.THERMAL_BANDS:
+            convert = lambda: fnbank.L8_Thermal_Radiance(dn, lut.dtype)
+        else:
+            convert = lambda: fnbank.Num10(dn, 1., lut.dtype)
+
+        # the first call builds the table, it is timed on its own
+        start = time.time()
+        lut(dn[:1, :1])
+        build = time.time() - start
+
+        arithmetic, arithmetic_seconds = _best_of(convert, repeat)
+        tabulated, lut_seconds = _best_of(lambda: lut(dn), repeat)
+
+        valid = np.isfinite(arithmetic)
+        results.append({"band": number, "pixels": dn.size, "build": build, "arithmetic": arithmetic_seconds,
+                        "lut": lut_seconds, "speedup": arithmetic_seconds / max(lut_seconds, 1e-9),
+                        "max_error": float(np.abs(arithmetic[valid] - tabulated[valid]).max()) if valid.any() else 0.,
+                        "nan_mismatch": int((np.isnan(arithmetic) != np.isnan(tabulated)).sum())})
+        band.release()
+    return results
+
+
+if __name__ == '__main__':
+    config = sys.argv[1]
+    dtype = sys.argv[2] if len(sys.argv) > 2 else "float32"
+    for row in run(config, dtype):
+        print("band {band:<3} {pixels:>10} px  arithmetic {arithmetic:7.3f} s  lut {lut:7.3f} s  "
+              "(build {build:.4f} s)  x{speedup:5.1f}  max diff {max_error:.2e}  "
+              "nan mismatch {nan_mismatch}".format(**row))
+
+# ===============================================================================
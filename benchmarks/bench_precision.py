@@ -0,0 +1,94 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Runs a METRIC workspace in float64 and in float32 and compares the daily ET, the peak
+memory and the wall time of the two precisions.
+
+    python -m benchmarks.bench_precision config_file [tile_size]
+
+Without a tile_size the whole scene is held in memory as a single tile. Each precision
+runs in its own process so that peak memory is measured separately, the outputs in the
+workspace are those of the last precision.
+"""
+
+import multiprocessing
+import resource
+import sys
+import time
+
+import numpy as np
+
+from metric.metric_py import MetricModel, get_scene_constants
+from metric.tiled import run_tiled, product_path
+from utils import raster_tools as ras
+
+
+def run_precision(config_filepath, precision, constants=None, tile_size=None):
+    """ runs the model in one precision, returns (ET_24hr, seconds, peak resident memory in MB)"""
+
+    start = time.time()
+    mike = MetricModel(config_filepath, tile_size=tile_size or 2 ** 30, precision=precision)
+    if constants is None:
+        constants = get_scene_constants(mike)
+    run_tiled(mike, constants)
+    seconds = time.time() - start
+
+    et_day = ras.raster_to_array(product_path(mike, "ET_24hr"))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    return et_day, seconds, peak
+
+
+def _run_precision(args):
+    return run_precision(*args)
+
+
+def run(config_filepath, constants=None, tile_size=None, precisions=("float64", "float32")):
+    """
+    returns a list of dicts, one per precision, comparing its ET_24hr to that of the first
+
+    constants defaults to metric_py.get_scene_constants of the workspace.
+    """
+
+    results = []
+    reference = None
+    for precision in precisions:
+        pool = multiprocessing.Pool(1)
+        try:
+            et_day, seconds, peak = pool.apply(_run_precision, ((config_filepath, precision, constants, tile_size),))
+        finally:
+            pool.close()
+            pool.join()
+
+        if reference is None:
+            reference = et_day
+        valid = np.isfinite(reference) & np.isfinite(et_day)
+        error = np.abs(et_day[valid] - reference[valid])
+        results.append({"precision": precision, "seconds": seconds, "peak_mb": peak,
+                        "max_error": error.max() if error.size else 0.,
+                        "mean_error": error.mean() if error.size else 0.,
+                        "mean_et": et_day[valid].mean() if error.size else np.nan,
+                        "nan_mismatch": int((np.isnan(reference) != np.isnan(et_day)).sum())})
+    return results
+
+
+if __name__ == '__main__':
+    config = sys.argv[1]
+    tile = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    for row in run(config, tile_size=tile):
+        print("{precision:<8} {seconds:8.2f} s  peak {peak_mb:8.1f} MB  mean ET {mean_et:.4f} mm  "
+              "|dET| max {max_error:.2e} mean {mean_error:.2e} mm  nan mismatch {nan_mismatch}".format(**row))
+
+# ===============================================================================
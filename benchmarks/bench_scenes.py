@@ -0,0 +1,142 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Runs metric_py.run on synthetic scenes of increasing size and keeps the time and peak
+memory of every stage.
+
+    python -m benchmarks.bench_scenes root [results.json] [size ...]
+
+Each size gets a workspace under root, see benchmarks.synthetic_scene, and every engine
+of ENGINES runs on it in its own process so that peak memory is measured separately. The
+stages come from the run report of metric.profiler. Results are appended to a JSON file,
+one entry per invocation, so that runs can be compared across changes. Everything runs
+offline.
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_scene import make_scene
+from metric import metric_py
+from metric.profiler import REPORT_FILE
+
+SIZES = (512, 1024, 2048, 4096, 8000)
+
+# engine name: keyword arguments of metric_py.run
+ENGINES = {"memory": {},
+           "compressed": {"compressed": True},
+           "tiled": {"tile_size": 1024},
+           "tiled_workers": {"tile_size": 1024, "workers": 4}}
+
+# stages kept in the results, the slowest of the run report
+STAGES = 15
+
+
+def run_engine(config_filepath, options):
+    """ runs the model in this process, returns a dict of its time, peak memory and stages"""
+
+    workspace = os.path.dirname(config_filepath)
+    start = time.time()
+    mike = metric_py.run(config_filepath, **options)
+    seconds = time.time() - start
+
+    with open(os.path.join(workspace, REPORT_FILE)) as f:
+        report = json.load(f)
+    et_day = mike.products.get("ET_24hr") if mike.tile_size is None else None
+    return {"seconds": seconds,
+            "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+            "solver_iterations": report["solver_iterations"],
+            "mean_et": float(np.nanmean(et_day)) if et_day is not None else None,
+            "stages": report["summary"][:STAGES]}
+
+
+def _run_engine(args):
+    return run_engine(*args)
+
+
+def run(root, sizes=SIZES, engines=("memory", "tiled"), seed=0, keep=False):
+    """
+    returns a list of dicts, one per size and engine
+
+    a scene already under root is reused, those made here are deleted afterwards unless keep
+    """
+
+    root = os.path.abspath(root)
+    results = []
+    for size in sizes:
+        workspace = os.path.join(root, "scene_{0}".format(size))
+        made = not os.path.exists(workspace)
+        start = time.time()
+        config_filepath = make_scene(workspace, size, seed) if made else os.path.join(workspace, "config.txt")
+        make_seconds = time.time() - start
+
+        try:
+            for engine in engines:
+                pool = multiprocessing.Pool(1)
+                try:
+                    result = pool.apply(_run_engine, ((config_filepath, ENGINES[engine]),))
+                finally:
+                    pool.close()
+                    pool.join()
+                result.update({"size": size, "engine": engine, "pixels": size * size, "make_seconds": make_seconds})
+                results.append(result)
+        finally:
+            if made and not keep:
+                shutil.rmtree(workspace)
+    return results
+
+
+def append_results(path, results):
+    """ adds this invocation, with its platform, to the JSON history at path"""
+
+    history = []
+    if os.path.exists(path):
+        with open(path) as f:
+            history = json.load(f)
+
+    history.append({"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "cpus": multiprocessing.cpu_count(),
+                    "results": results})
+    with open(path, "w") as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+    return path
+
+
+if __name__ == '__main__':
+    root_dir = sys.argv[1]
+    results_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(root_dir, "bench_scenes.json")
+    scene_sizes = [int(s) for s in sys.argv[3:]] or SIZES
+
+    rows = run(root_dir, scene_sizes)
+    append_results(results_path, rows)
+    for row in rows:
+        print("{size:>5} px  {engine:<14} {seconds:8.2f} s  peak {peak_mb:8.1f} MB  "
+              "{solver_iterations:>3} iterations".format(**row))
+        for stage in row["stages"][:3]:
+            print("        {name:<40} {wall_seconds:8.2f} s".format(**stage))
+
+# ===============================================================================
@@ -0,0 +1,77 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Times the fused stability correction kernel against the original composition of
+Num41 - Num45b merged with three where calls.
+
+    python -m benchmarks.bench_stability [size] [repeats]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from metric import function_bank as fnbank
+from metric import sensible_heat as shf
+
+
+def composed(L, out=None):
+    """ the stability corrections as get_sensible_heat_flux used to compute them"""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unstable = L < 0
+        psi200 = np.where(unstable, fnbank.Num41(L), fnbank.Num44(L))
+        psi2 = np.where(unstable, fnbank.Num42a(L), fnbank.Num45a(L))
+        psi01 = np.where(unstable, fnbank.Num42b(L), fnbank.Num45b(L))
+    return psi200, psi2, psi01
+
+
+def best_time(func, L, out, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.time()
+        func(L, out=out)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def run(size=2000, repeats=5, unstable_fractions=(0.1, 0.5, 0.9)):
+    """ returns a list of dicts with the best wall time of each kernel, in seconds"""
+
+    rs = np.random.RandomState(0)
+    out = np.empty((size, size)), np.empty((size, size)), np.empty((size, size))
+    kernels = [("composed", composed),
+               ("fused numpy", lambda L, out: shf.stability_corrections(L, out=out, use_numba=False))]
+    if shf.numba is not None:
+        kernels.append(("fused numba", lambda L, out: shf.stability_corrections(L, out=out, use_numba=True)))
+
+    results = []
+    for fraction in unstable_fractions:
+        L = np.where(rs.uniform(0, 1, (size, size)) < fraction, -1., 1.) * rs.uniform(1., 500., (size, size))
+        for name, func in kernels:
+            func(L, out)  # warm up, compiles the numba loop
+            results.append({"kernel": name, "size": size, "unstable": fraction,
+                            "seconds": best_time(func, L, out, repeats)})
+    return results
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    for row in run(*args):
+        print("{kernel:<12} {size}x{size} unstable {unstable:.0%}  {seconds:.4f} s".format(**row))
+
+# ===============================================================================
@@ -0,0 +1,327 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Synthetic, physically plausible METRIC workspaces for benchmarks.
+
+    python -m benchmarks.synthetic_scene workspace size [seed]
+
+make_scene writes everything MetricModel reads: the eight landsat 8 bands and their MTL
+file, a DEM, a DS3505 weather file, the hot and cold reference
+pixel shapefiles and the config.txt tying them together. Nothing is downloaded.
+
+The scene is center pivots, irrigated or fallow, on dry range land over rolling terrain.
+The bands hold the reflectance and brightness temperature of a mix of soil and vegetation,
+turned back into DN with the gains of the MTL file, so the model sees realistic albedo,
+NDVI and surface temperatures. The cold pixels sit in an irrigated pivot, the hot pixels
+in a bare one. Every pixel is a function of its coordinates only, the rasters are written
+a block of rows at a time and memory stays flat up to full 8000 pixel scenes.
+"""
+
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from metric import radiometry
+from metric.textio import IoConfig
+from utils import raster_tools as ras
+from utils.vector_tools import points_to_ogr_polygon
+
+SCENE_TIME = datetime(2014, 7, 10, 18, 0, 0)
+
+# UTM zone 12N, the upper left corner is near 46 N 112.3 W
+EPSG = 32612
+UPPER_LEFT = (399960., 5100000.)
+UPPER_LEFT_LAT_LON = (46.04, -112.30)
+PIXEL_SIZE = 30.
+
+# rows computed and written at a time
+BLOCK_ROWS = 256
+
+# reflectance of bare soil and of full vegetation, landsat 8 bands 2 to 7
+SOIL = (0.12, 0.16, 0.20, 0.28, 0.34, 0.28)
+VEGETATION = (0.03, 0.07, 0.04, 0.45, 0.20, 0.09)
+COS_SOLAR_ZENITH = 0.87
+
+# K1 and K2 of the landsat 8 thermal bands
+THERMAL_CONSTANTS = {10: (774.8853, 1321.0789), 11: (480.8883, 1201.1442)}
+
+# terrain, (amplitude m, wavelength east m, wavelength south m) of each undulation
+BASE_ELEVATION = 1300.
+TERRAIN = ((150., 24000., 18000.), (60., 7000., 9000.), (15., 1500., 2100.))
+
+PIVOT_SPACING = 1600.
+PIVOT_RADIUS = 380.
+COLD_PIVOT = (1, 1)
+HOT_PIVOT = (1, 2)
+
+# landsat scenes are rotated in their grid, a wedge of fill along the left edge
+FILL_SLOPE = 0.05
+
+LANDSAT_BANDS = (2, 3, 4, 5, 6, 7, 10, 11)
+
+
+def _hash(x, y):
+    """ pseudo random values in [0, 1) of the coordinates, the same whatever the block"""
+
+    value = np.sin(x * 12.9898 + y * 78.233) * 43758.5453
+    return value - np.floor(value)
+
+
+class SyntheticLandscape(object):
+    def __init__(self, rows, cols, seed=0):
+        self.rows = rows
+        self.cols = cols
+        rng = np.random.RandomState(seed)
+        self.phases = rng.uniform(0., 2 * math.pi, len(TERRAIN) + 2)
+
+        # vegetation fraction of every pivot, irrigated or fallow
+        shape = (int(rows * PIXEL_SIZE // PIVOT_SPACING) + 1, int(cols * PIXEL_SIZE // PIVOT_SPACING) + 1)
+        irrigated = rng.uniform(size=shape) < 0.6
+        self.pivots = np.where(irrigated, rng.uniform(0.75, 0.95, shape), rng.uniform(0.03, 0.10, shape))
+        self.pivots[COLD_PIVOT] = 0.95
+        self.pivots[HOT_PIVOT] = 0.02
+
+    def coordinates(self, row0, row1):
+        """ meters east and south of the upper left corner, at the pixel centers"""
+
+        y, x = np.mgrid[row0:row1, 0:self.cols].astype(float)
+        return (x + 0.5) * PIXEL_SIZE, (y + 0.5) * PIXEL_SIZE
+
+    def terrain(self, x, y):
+        """ elevation at x, y, the model derives slope and aspect from it, see metric.terrain"""
+
+        z = np.full(x.shape, BASE_ELEVATION)
+        for (amplitude, east, south), phase in zip(TERRAIN, self.phases):
+            z += amplitude * np.sin(2 * math.pi * (x / east + y / south) + phase)
+        return z
+
+    def vegetation(self, x, y):
+        """ fraction of the pixel covered by vegetation"""
+
+        i = np.minimum((y // PIVOT_SPACING).astype(int), self.pivots.shape[0] - 1)
+        j = np.minimum((x // PIVOT_SPACING).astype(int), self.pivots.shape[1] - 1)
+        distance = np.hypot(x - (j + 0.5) * PIVOT_SPACING, y - (i + 0.5) * PIVOT_SPACING)
+        range_land = 0.12 + 0.06 * np.sin(x / 3100. + self.phases[-2]) * np.sin(y / 2300. + self.phases[-1])
+        fraction = np.where(distance < PIVOT_RADIUS, self.pivots[i, j], range_land)
+        return np.clip(fraction + 0.02 * (_hash(x, y) - 0.5), 0., 1.)
+
+    def block(self, row0, row1):
+        """ dict of the rasters of rows row0 to row1, the landsat bands as DN"""
+
+        x, y = self.coordinates(row0, row1)
+        elevation = self.terrain(x, y)
+        fraction = self.vegetation(x, y)
+        fill = x < FILL_SLOPE * y
+
+        rasters = {"dem": elevation}
+        mult, add = radiometry.DEFAULT_REFLECTANCE_RESCALING
+        for band, soil, vegetation in zip(LANDSAT_BANDS, SOIL, VEGETATION):
+            reflectance = fraction * vegetation + (1. - fraction) * soil
+            rasters[band] = (reflectance * COS_SOLAR_ZENITH - add) / mult
+
+        # wet pivots are cooler than dry range land, the air cools with elevation
+        temperature = 316. - 22. * fraction - 0.0065 * (elevation - BASE_ELEVATION)
+        mult, add = radiometry.DEFAULT_RADIANCE_RESCALING
+        for band, (k1, k2) in THERMAL_CONSTANTS.items():
+            radiance = k1 / (np.exp(k2 / temperature) - 1.)
+            rasters[band] = (radiance - add) / mult
+
+        for band in LANDSAT_BANDS:
+            dn = np.clip(np.round(rasters[band]), 1, radiometry.DN_RANGE - 1).astype(np.uint16)
+            dn[fill] = 0
+            rasters[band] = dn
+        return rasters
+
+
+def _lat_lon(x, y):
+    lat0, lon0 = UPPER_LEFT_LAT_LON
+    return lat0 - y / 111000., lon0 + x / (111000. * math.cos(math.radians(lat0)))
+
+
+def write_mtl(path, rows, cols):
+    """ landsat 8 MTL file of the scene, with the rescaling of metric.radiometry"""
+
+    corners = {"UL": (0., 0.), "UR": (cols * PIXEL_SIZE, 0.), "LL": (0., rows * PIXEL_SIZE),
+               "LR": (cols * PIXEL_SIZE, rows * PIXEL_SIZE)}
+    doy = SCENE_TIME.timetuple().tm_yday
+    earth_sun_distance = 1.000002610 * (1 - 0.01671123 ** 2) / (1 + 0.01671123 * math.cos(doy * 2 * math.pi / 369.7))
+
+    lines = ["GROUP = L1_METADATA_FILE",
+             '    LANDSAT_SCENE_ID = "LC80390282014{0:03d}LGN00"'.format(doy),
+             '    SPACECRAFT_ID = "LANDSAT_8"',
+             "    DATE_ACQUIRED = {0}".format(SCENE_TIME.strftime("%Y-%m-%d")),
+             '    SCENE_CENTER_TIME = "{0}.0000000Z"'.format(SCENE_TIME.strftime("%H:%M:%S")),
+             "    CLOUD_COVER = 0.00",
+             "    SUN_ELEVATION = {0:.8f}".format(math.degrees(math.asin(COS_SOLAR_ZENITH))),
+             "    EARTH_SUN_DISTANCE = {0:.7f}".format(earth_sun_distance)]
+    for corner in ("UL", "UR", "LL", "LR"):
+        lat, lon = _lat_lon(*corners[corner])
+        lines += ["    CORNER_{0}_LAT_PRODUCT = {1:.5f}".format(corner, lat),
+                  "    CORNER_{0}_LON_PRODUCT = {1:.5f}".format(corner, lon)]
+    for band in LANDSAT_BANDS:
+        if band in radiometry.THERMAL_BANDS:
+            mult, add = radiometry.DEFAULT_RADIANCE_RESCALING
+            lines += ["    RADIANCE_MULT_BAND_{0} = {1:.4E}".format(band, mult),
+                      "    RADIANCE_ADD_BAND_{0} = {1:.5f}".format(band, add),
+                      "    K1_CONSTANT_BAND_{0} = {1:.4f}".format(band, THERMAL_CONSTANTS[band][0]),
+                      "    K2_CONSTANT_BAND_{0} = {1:.4f}".format(band, THERMAL_CONSTANTS[band][1])]
+        else:
+            mult, add = radiometry.DEFAULT_REFLECTANCE_RESCALING
+            lines += ["    REFLECTANCE_MULT_BAND_{0} = {1:.4E}".format(band, mult),
+                      "    REFLECTANCE_ADD_BAND_{0} = {1:.6f}".format(band, add)]
+    lines += ["END_GROUP = L1_METADATA_FILE", "END"]
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_weather(path, days=1):
+    """ hourly DS3505 observations from days before to days after the overpass"""
+
+    header = ("  USAF  WBAN YR--MODAHRMN DIR SPD GUS CLG SKC L M H  VSB MW MW MW MW AW AW AW AW W TEMP DEWP"
+              "    SLP   ALT    STP MAX MIN PCP01 PCP06 PCP24 PCPXX SD")
+    row = ("726770 24137 {time} 270 {speed:>3} *** 722 CLR * * * 10.0 ** ** ** ** ** ** ** ** * {temp:>4} {dewp:>4}"
+           " 1013.2 29.92 {pressure:>6.1f} *** ***  0.00 ***** ***** ***** ** ")
+
+    start = datetime(SCENE_TIME.year, SCENE_TIME.month, SCENE_TIME.day) - timedelta(days=days)
+    with open(path, "w") as f:
+        f.write(header + "\n")
+        for hour in range(24 * (2 * days + 1)):
+            time = start + timedelta(hours=hour, minutes=53)
+            # temperatures in F peak mid afternoon, local time is UTC - 7
+            temp = 70. + 16. * math.sin(2 * math.pi * (time.hour - 15) / 24.)
+            f.write(row.format(time=time.strftime("%Y%m%d%H%M"), speed=8 + hour % 3, temp=int(round(temp)),
+                               dewp=45, pressure=871.5) + "\n")
+
+
+def write_box_shapefile(path, x0, y0, x1, y1, srs):
+    """ shapefile of one rectangle, in meters east and south of the upper left corner"""
+
+    left, top = UPPER_LEFT
+    corners = [(left + x0, top - y0), (left + x1, top - y0), (left + x1, top - y1), (left + x0, top - y1),
+               (left + x0, top - y0)]
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    data_source = driver.CreateDataSource(path)
+    layer = data_source.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, ogr.wkbPolygon)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(points_to_ogr_polygon(corners))
+    layer.CreateFeature(feature)
+    feature = None
+    data_source = None
+
+
+def _reference_box(pivot):
+    """ a 3 by 3 pixel box at the center of a pivot"""
+
+    i, j = pivot
+    x, y = (j + 0.5) * PIVOT_SPACING, (i + 0.5) * PIVOT_SPACING
+    half = 1.5 * PIXEL_SIZE
+    return x - half, y - half, x + half, y + half
+
+
+def make_scene(workspace, size=512, seed=0, testflag="LIMITED", compress=None, tiled=False):
+    """
+    writes a synthetic METRIC workspace and returns the path of its config file
+
+    size is the edge of a square scene in pixels, or (rows, cols). The rasters are written
+    uncompressed in strips by default, like the USGS level 1 products, compress and tiled
+    are those of raster_tools.geotiff_options.
+    """
+
+    workspace = os.path.abspath(workspace)
+    rows, cols = (size, size) if isinstance(size, int) else size
+    if rows * PIXEL_SIZE < (HOT_PIVOT[0] + 1) * PIVOT_SPACING or cols * PIXEL_SIZE < (HOT_PIVOT[1] + 1) * PIVOT_SPACING:
+        raise ValueError("a scene needs at least {0} pixels a side".format(int(3 * PIVOT_SPACING / PIXEL_SIZE)))
+    if os.path.exists(workspace):
+        raise Exception("{0} already exists!".format(workspace))
+
+    for directory in ("output", "intermediate_calculations", "input_ref_pixels", "input_landsat", "input_weather",
+                      "input_dem", "scratch"):
+        os.makedirs(os.path.join(workspace, directory))
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    geotransform = (UPPER_LEFT[0], PIXEL_SIZE, 0., UPPER_LEFT[1], 0., -PIXEL_SIZE)
+
+    paths = {"dem": os.path.join("input_dem", "dem.tif")}
+    for band in LANDSAT_BANDS:
+        paths[band] = os.path.join("input_landsat", "LC8_B{0}.tif".format(band))
+
+    data_sets = {}
+    driver = gdal.GetDriverByName("GTiff")
+    for name, path in paths.items():
+        data_type = gdal.GDT_Float32 if name == "dem" else gdal.GDT_UInt16
+        data_set = driver.Create(os.path.join(workspace, path), cols, rows, 1, data_type,
+                                 ras.geotiff_options(data_type, compress, tiled))
+        data_set.SetGeoTransform(geotransform)
+        data_set.SetProjection(srs.ExportToWkt())
+        data_sets[name] = data_set
+
+    landscape = SyntheticLandscape(rows, cols, seed)
+    for row0 in xrange(0, rows, BLOCK_ROWS):
+        rasters = landscape.block(row0, min(rows, row0 + BLOCK_ROWS))
+        for name, data_set in data_sets.items():
+            data_set.GetRasterBand(1).WriteArray(rasters[name], 0, row0)
+    for name in list(data_sets):
+        data_sets[name].FlushCache()
+        data_sets[name] = None
+
+    mtl_path = os.path.join("input_landsat", "LC8_MTL.txt")
+    weather_path = os.path.join("input_weather", "wx_data.txt")
+    hot_path = os.path.join("input_ref_pixels", "hot.shp")
+    cold_path = os.path.join("input_ref_pixels", "cold.shp")
+    write_mtl(os.path.join(workspace, mtl_path), rows, cols)
+    write_weather(os.path.join(workspace, weather_path))
+    write_box_shapefile(os.path.join(workspace, hot_path), *(_reference_box(HOT_PIVOT) + (srs,)))
+    write_box_shapefile(os.path.join(workspace, cold_path), *(_reference_box(COLD_PIVOT) + (srs,)))
+
+    cdict = {"metric_workspace": workspace,
+             "landsat_meta": mtl_path,
+             "dem_path": paths["dem"],
+             "vrt_path": paths["dem"],
+             "hot_shp_path": hot_path,
+             "cold_shp_path": cold_path,
+             "weather_path": weather_path,
+             "crop_type": "alfalfa",
+             "timezone": 0,
+             "wx_elev": BASE_ELEVATION,
+             "wx_zom": 0.010,
+             "LE_ref": 1.05,
+             "mountains": False,
+             "L_green_fac": 0.5,
+             "testflag": testflag,
+             "recalc": True,
+             "cache_max_gb": 0}
+    for band in LANDSAT_BANDS:
+        cdict["landsat_band{0}".format(band)] = paths[band]
+
+    config_path = os.path.join(workspace, "config.txt")
+    config = IoConfig()
+    config.add_param(cdict)
+    config.write(config_path)
+    return config_path
+
+
+if __name__ == '__main__':
+    scene_size = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    scene_seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print("Wrote {0}".format(make_scene(sys.argv[1], scene_size, scene_seed)))
+
+# ===============================================================================
@@ -0,0 +1,133 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Equations 10 to 15 over the six reflective bands at once.
+
+The per band products (reflectance, the two narrowband transmittances, path reflectance
+and at surface reflectance) are held as a single (band, row, col) cube, and the per band
+constants c1 - c5 and Cb as (band, 1, 1) vectors that broadcast against it. Each product
+is one vectorized expression evaluated in place in its output cube, instead of six
+passes over six separately allocated rasters. Indexing a cube by band gives the same 2-D
+rasters function_bank.Num10 - Num14 return. The pixels may also be a 1-D vector, as in a
+compressed MetricModel, the cubes are then (band, pixel).
+"""
+
+import numpy as np
+
+# c1 - c5 of equations 12 and 13 for each of the six reflective bands (2 - 7)
+NARROWBAND_TRANSMITTANCE_CONSTANTS = [[0.987, -0.00071, 0.000036, 0.0880, 0.0789],
+                                      [2.319, -0.00016, 0.000105, 0.0437, -1.2697],
+                                      [0.951, -0.00033, 0.000280, 0.0875, 0.1014],
+                                      [0.375, -0.00048, 0.005018, 0.1355, 0.6621],
+                                      [0.234, -0.00101, 0.004336, 0.0560, 0.7757],
+                                      [0.365, -0.00097, 0.004296, 0.0155, 0.6390]]
+
+# Cb weights of equation 14 for each of the six reflective bands (2 - 7), also the
+# weights of the broadband albedo of equation 15
+PATH_REFLECTANCE_WEIGHTS = [0.254, 0.149, 0.147, 0.311, 0.103, 0.036]
+
+# landsat 8 reflectance rescaling of equation 10
+M_RHO = 0.00002
+A_RHO = -0.1
+
+
+def _band_vector(values, dtype, ndim=2):
+    """ per band constants as a (band, 1, 1) array that broadcasts against a cube of ndim pixel axes"""
+
+    return np.asarray(values, dtype=dtype).reshape((-1,) + (1,) * ndim)
+
+
+def _float_type(*arrays):
+    return np.result_type(np.float32, *arrays)
+
+
+def reflectance(dn_bands, cos_sia, dtype=float, luts=None):
+    """
+    equation 10, top of atmosphere reflectance cube of a sequence of landsat DN bands
+
+    DN below 1 (fill) is nan. The bands are copied once into the cube, which is then
+    rescaled in place. With luts, one radiometry.DNLookupTable per band, each band is
+    rescaled by its table on the way into the cube.
+    """
+
+    cube = np.empty((len(dn_bands),) + np.shape(cos_sia), dtype=dtype)
+    if luts is not None:
+        for lut, dn, out in zip(luts, dn_bands, cube):
+            lut(dn, out=out)
+    else:
+        for i, dn in enumerate(dn_bands):
+            cube[i] = dn
+        np.copyto(cube, np.nan, where=cube < 1)
+        cube *= M_RHO
+        cube += A_RHO
+    cube /= cos_sia
+    return cube
+
+
+def narrowband_transmittance(p, w, cth, kt=1.0, constants=NARROWBAND_TRANSMITTANCE_CONSTANTS):
+    """
+    equations 12 and 13, effective narrowband transmittance cube
+
+    cth is the cosine of the solar incidence angle for incoming radiation (equation 12)
+    or of the view angle, 1, for radiation reflected from the surface (equation 13).
+    """
+
+    dtype = _float_type(p, w, cth)
+    ndim = max(np.ndim(p), np.ndim(w), np.ndim(cth))
+    c1, c2, c3, c4, c5 = [_band_vector(c, dtype, ndim) for c in zip(*constants)]
+
+    out = np.multiply(c2, p / (kt * cth), dtype=dtype)
+    np.exp(out, out=out)
+
+    # (c3 * w + c4) / cth, in a second cube the size of the output
+    scratch = np.multiply(c3, w, dtype=dtype)
+    scratch += c4
+    scratch /= cth
+    out -= scratch
+    del scratch
+
+    out *= c1
+    out += c5
+    return out
+
+
+def path_reflectance(entisr, weights=PATH_REFLECTANCE_WEIGHTS):
+    """ equation 14, per band path reflectance cube from the incoming transmittance cube"""
+
+    out = np.subtract(1, entisr)
+    out *= _band_vector(weights, out.dtype, out.ndim - 1)
+    return out
+
+
+def at_surface_reflectance(refl, entisr, entsrrs, pr):
+    """ equation 11, at surface reflectance cube"""
+
+    out = np.subtract(refl, pr)
+    scratch = np.multiply(entisr, entsrrs)
+    out /= scratch
+    return out
+
+
+def broadband_albedo(asr, weights=PATH_REFLECTANCE_WEIGHTS):
+    """ equation 15, the weighted sum of the at surface reflectance cube over its bands"""
+
+    return np.tensordot(np.asarray(weights, dtype=asr.dtype), asr, axes=1)
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
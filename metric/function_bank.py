@@ -1,60 +1,147 @@
+import collections
+import contextlib
 import math
+
 import numpy as np
 
 
-# quick function used to print status updates to the screen (including arcpy messages)
-def print_stats(variable, name):
-    """ prints heads up stats for some variable, either raster or scalar"""
+# pixels summed at a time by raster_stats, small enough for each chunk to stay in cache
+STATS_CHUNK = 2 ** 16
+
+# heads up statistics of a variable, see raster_stats
+RasterStats = collections.namedtuple("RasterStats", "name count nan_count minimum maximum mean std stride")
+
+# callable given each record of print_stats instead of printing it, see collect_stats
+STATS_SINK = None
+
+
+def raster_stats(variable, name="", stride=None):
+    """
+    count, nan count, min, max, mean and std of a raster or scalar, in a single pass
+
+    The raster is walked in chunks of STATS_CHUNK pixels that are reduced while in cache,
+    the mean and variance of the chunks are merged as they go. nan are counted and left out
+    of the other statistics. With a stride only every stride-th pixel along each axis is
+    read, a sample for heads up checks of large rasters.
+    """
+
+    values = np.asarray(variable)
+    if stride > 1 and values.ndim:
+        values = values[(slice(None, None, stride),) * values.ndim]
+    else:
+        stride = 1
+    flat = values.reshape(-1)
+    floating = flat.dtype.kind == "f"
+
+    count = nan_count = 0
+    minimum, maximum, mean, m2 = np.inf, -np.inf, 0., 0.
+    for start in xrange(0, flat.size, STATS_CHUNK):
+        chunk = flat[start:start + STATS_CHUNK]
+        if floating:
+            nan = np.isnan(chunk)
+            nans = np.count_nonzero(nan)
+            if nans:
+                nan_count += nans
+                chunk = chunk[~nan]
+        if not chunk.size:
+            continue
+
+        chunk_mean = chunk.mean(dtype=np.float64)
+        deviation = chunk - chunk_mean
+        chunk_m2 = np.dot(deviation, deviation)
+        total = count + chunk.size
+        delta = chunk_mean - mean
+        mean += delta * chunk.size / total
+        m2 += chunk_m2 + delta * delta * count * chunk.size / total
+        count = total
+        minimum = min(minimum, chunk.min())
+        maximum = max(maximum, chunk.max())
+
+    if not count:
+        return RasterStats(name, 0, nan_count, np.nan, np.nan, np.nan, np.nan, stride)
+    return RasterStats(name, count, nan_count, float(minimum), float(maximum), float(mean),
+                       math.sqrt(m2 / count), stride)
+
+
+@contextlib.contextmanager
+def collect_stats():
+    """ gathers the records of print_stats in the list yielded, instead of printing them"""
+
+    global STATS_SINK
+    records, sink = [], STATS_SINK
+    STATS_SINK = records.append
+    try:
+        yield records
+    finally:
+        STATS_SINK = sink
+
+
+def print_stats(variable, name, stride=None):
+    """
+    prints heads up stats for some variable, either raster or scalar
+
+    returns the RasterStats record, a list of them for a list of variables. Inside
+    collect_stats the records are gathered instead of printed.
+    """
 
     if isinstance(variable, list):
-        for i, var in enumerate(variable):
-            print_stats(var, name + str(i))
+        return [print_stats(var, name + str(i), stride) for i, var in enumerate(variable)]
+    if np.asarray(variable).dtype.kind not in "biuf":
+        return None
+
+    stats = raster_stats(variable, name, stride)
+    if STATS_SINK is not None:
+        STATS_SINK(stats)
+    elif np.ndim(variable):
+        print 'message: {0} mean({1.mean:4.6f})  min({1.minimum:4.6f})  max({1.maximum:4.6f})  ' \
+              'std({1.std:4.6f})  nan({1.nan_count}/{2})'.format(name.ljust(70, "."), stats,
+                                                               stats.count + stats.nan_count)
+    else:
+        print 'message: {0} val({1.mean:4.6f})'.format(name.ljust(70, "."), stats)
+    return stats
 
-    if isinstance(variable, np.ndarray):
 
-        # sanitize nonetypes
-        if not variable.maximum:
-            maximum = 0
-        else:
-            maximum = variable.maximum
+def _or_nodata(condition, raster):
+    """
+    condition, also true where raster is NaN
 
-        if not variable.minimum:
-            minimum = 0
-        else:
-            minimum = variable.minimum
+    np.where takes its else branch where a comparison with NaN is false, arcpy Con kept
+    NoData as NoData. Taking the first branch there instead carries the NaN through.
+    """
 
-        if not variable.mean:
-            mean = 0
-        else:
-            mean = variable.mean
+    return condition | np.isnan(raster)
 
-        message = "{0} mean({1:4.6f})  min({2:4.6f})  max({3:4.6f})".format(name.ljust(70, "."), mean, minimum, maximum)
-        # print(message)
-        del mean, minimum, maximum
-        print 'message: {}'.format(message)
 
-    if isinstance(variable, float) or isinstance(variable, int):
-        message = "{0} val({1:4.6f})".format(name.ljust(70, "."), variable)
-        # print(message)
-        print 'message: {}'.format(message)
+def _as_float(raster):
+    """ raster as a floating point array, floating point rasters keep their precision"""
 
+    raster = np.asarray(raster)
+    if raster.dtype.kind == 'f':
+        return raster
+    return raster.astype(float)
 
-    return
 
+def ref_pix_values(inraster, index):
+    """
+    values of "inraster" at the flat pixel indices "index", scalars are repeated for each pixel
 
-def ref_pix_mean(inraster, inshape, output_dbf):
-    """ finds the average value of pixels in "inraster" within "inshape" """
+    the values are returned in float64 whatever the type of inraster, as they feed the calibration
+    """
 
-    inraster.describe(inshape, "FID", inraster, output_dbf, "DATA", "MEAN")
+    inraster = np.asarray(inraster)
+    if inraster.ndim == 0:
+        return np.full(len(index), float(inraster))
+    return np.asarray(inraster.reshape(-1)[index], dtype=float)
 
-    try:
-        row = arcpy.SearchCursor(output_dbf)
-        row = row.next()
-        mean = row.getValue("MEAN")
-        return mean
-    except:
-        print("WARNING! statistics went awry!")
-        return 0
+
+def ref_pix_mean(inraster, index):
+    """
+    finds the average value of pixels in "inraster" at the flat pixel indices "index"
+
+    index comes from rasterizing a reference pixel shapefile, see MetricModel.get_ref_pixel_index
+    """
+
+    return ref_pix_values(inraster, index).mean()
 
 
 def date_to_jd(year, month, day):
@@ -295,12 +382,12 @@ def Latent_Heat_Flux_PM(Del, R_n, G_shf, gam, e_s, e_a, rho_air, r_s, r_a):
     return lamda_ET
 
 
-def L8_Thermal_Radiance(L8Bnd):
+def L8_Thermal_Radiance(L8Bnd, dtype=float):
     # Assign variables
     M_L = float(0.0003342)
     A_L = float(0.1)
-    # Set inactive areas to null
-    conBnd = Con(L8Bnd, L8Bnd, "", "VALUE >= 1")
+    # Set inactive areas to null, DN to the floating point type dtype
+    conBnd = np.where(L8Bnd >= 1, np.asarray(L8Bnd, dtype=dtype), np.nan)
     # Calculate radiance
     thermRad = (conBnd * M_L) + A_L
     return thermRad
@@ -380,13 +467,6 @@ def Slope_Saturation_Vapor_Pressure(T_Celsius):
     return Delta_svp
 
 
-def meanFromRasterBySingleZone(valRaster, polyShp, storeTbl):
-    rows = arcpy.SearchCursor(storeTbl)
-    row = rows.next()
-    meanVal = row.getValue("MEAN")
-    return meanVal
-
-
 # Equation Number 1- Latent Energy Consumed by ET
 def Num1(netRad, G, H):
     outMath = netRad - G - H
@@ -410,7 +490,7 @@ def Num3(sia, bbat, d):
 def Num4(p, w, cth, kt):
     outMath1 = 0.075 * (w / cth) ** 0.4
     outMath2 = (-0.00146 * p) / (kt * cth)
-    outMath3 = 0.35 + 0.627 * arcpy.sa.Exp(outMath2 - outMath1)
+    outMath3 = 0.35 + 0.627 * np.exp(outMath2 - outMath1)
     return outMath3
 
 
@@ -435,11 +515,11 @@ def Num7(delta, phi, s, gamma, omega):
     # + ( math.cos(delta) * math.sin(phi) * arcpy.sa.Sin(s) * arcpy.sa.Cos(gamma) * math.cos(omega) )
     # + ( math.cos(delta) * arcpy.sa.Sin(gamma) * arcpy.sa.Sin(s) * math.sin(omega) )
     # ===========================================================================
-    cos_theta1 = math.sin(delta) * math.sin(phi) * arcpy.sa.Cos(s)
-    cos_theta2 = -(math.sin(delta) * math.cos(phi) * arcpy.sa.Sin(s) * arcpy.sa.Cos(gamma))
-    cos_theta3 = math.cos(delta) * math.cos(phi) * arcpy.sa.Cos(s) * math.cos(omega)
-    cos_theta4 = math.cos(delta) * math.sin(phi) * arcpy.sa.Sin(s) * arcpy.sa.Cos(gamma) * math.cos(omega)
-    cos_theta5 = math.cos(delta) * arcpy.sa.Sin(gamma) * arcpy.sa.Sin(s) * math.sin(omega)
+    cos_theta1 = math.sin(delta) * math.sin(phi) * np.cos(s)
+    cos_theta2 = -(math.sin(delta) * math.cos(phi) * np.sin(s) * np.cos(gamma))
+    cos_theta3 = math.cos(delta) * math.cos(phi) * np.cos(s) * math.cos(omega)
+    cos_theta4 = math.cos(delta) * math.sin(phi) * np.sin(s) * np.cos(gamma) * math.cos(omega)
+    cos_theta5 = math.cos(delta) * np.sin(gamma) * np.sin(s) * math.sin(omega)
     cos_theta_rel = cos_theta1 + cos_theta2 + cos_theta3 + cos_theta4 + cos_theta5
 
     return (cos_theta_rel, cos_theta1, cos_theta2, cos_theta3, cos_theta4, cos_theta5)
@@ -452,12 +532,12 @@ def Num8(delta, phi, omega):
 
 
 # Equation Number 10- Per Band "Top of Atmosphere" Bidirectional Reflectance
-def Num10(l8raster, Num7):
+def Num10(l8raster, Num7, dtype=float):
     M_rho = float(0.00002)
     A_rho = float(-0.1)
 
-    # Part one of calculation.
-    outCon = arcpy.sa.Con(l8raster, l8raster, "", "VALUE >= 1")
+    # Part one of calculation, DN to the floating point type dtype.
+    outCon = np.where(l8raster >= 1, np.asarray(l8raster, dtype=dtype), np.nan)
     outTimes = (outCon * M_rho) + A_rho
 
     # Divide Part 2 from Part 1
@@ -473,13 +553,13 @@ def Num11(refl_toa, trans_in, trans_out, refl_path):
 
 # Equation Number 12- Effective Narrowband Transmittance For Incoming Solar Radiation
 def Num12(p, w, cth, kt, c1, c2, c3, c4, c5):
-    outMath = c1 * ((arcpy.sa.Exp((c2 * p) / (kt * cth))) - (((c3 * w) + c4) / cth)) + c5
+    outMath = c1 * ((np.exp((c2 * p) / (kt * cth))) - (((c3 * w) + c4) / cth)) + c5
     return outMath
 
 
 # Equation Number 13- Effective Narrowband Transmittance For Shortwave Radiation Reflected From Surface
 def Num13(p, w, cos_n, kt, c1, c2, c3, c4, c5):
-    outMath = c1 * ((arcpy.sa.Exp((c2 * p) / (kt * cos_n))) - (((c3 * w) + c4) / cos_n)) + c5
+    outMath = c1 * ((np.exp((c2 * p) / (kt * cos_n))) - (((c3 * w) + c4) / cos_n)) + c5
     return outMath
 
 
@@ -508,34 +588,36 @@ def Num16(eps_bb, sfcTemp):
 
 # Equation Number 17- Broad Band Surface Emissivity
 def Num17(Num18):
-    outCon1 = Con(Num18, Num18, 9999, "VALUE <= 3")
+    outCon1 = np.where(_or_nodata(Num18 <= 3, Num18), Num18, 9999)
     outMath = 0.95 + (0.01 * outCon1)
-    outCon2 = Con(outMath, outMath, .98, "Value <= 50")
+    outCon2 = np.where(_or_nodata(outMath <= 50, outMath), outMath, .98)
     return outCon2
 
 
 # Equation Number 18- Leaf Area Index
 def Num18(Num19):
-    # assigns LAI for 0.1 <= SAVI <= 0.687
-    outMath = ((arcpy.sa.Ln((0.69 - Num19) / 0.59)) / (-0.91))
+    # assigns LAI for 0.1 <= SAVI <= 0.687, the log is undefined above SAVI 0.69
+    # but those pixels are replaced below
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outMath = ((np.log((0.69 - Num19) / 0.59)) / (-0.91))
     # assigns LAI for SAVI >= 0.687
-    outCon1 = Con(Num19, outMath, 6, "VALUE <= 0.687")
+    outCon1 = np.where(_or_nodata(Num19 <= 0.687, Num19), outMath, 6)
     # assigns LAI for SAVI <= 0.1
-    outCon2 = Con(Num19, outCon1, 0, "VALUE >= 0.1")
+    outCon2 = np.where(_or_nodata(Num19 >= 0.1, Num19), outCon1, 0)
     return outCon2
 
 
 # Equation Number 19- Soil Adjusted Vegetation Index
 def Num19(Band5, Band4, L):
-    outFloat5 = Float(Band5)
-    outFloat4 = Float(Band4)
-    outMath = ((1 + L) * (outFloat5 - outFloat4)) / (L + (Plus(outFloat5, outFloat4)))
+    outFloat5 = _as_float(Band5)
+    outFloat4 = _as_float(Band4)
+    outMath = ((1 + L) * (outFloat5 - outFloat4)) / (L + (outFloat5 + outFloat4))
     return outMath
 
 
 # Equation 20 - Surface Temperature, Landsat 8, Band 10
 def Num20(corrRad10, nbe, K1, K2):
-    sfcTemp = (K2 / (arcpy.sa.Ln(((nbe * K1) / corrRad10) + 1)))
+    sfcTemp = (K2 / (np.log(((nbe * K1) / corrRad10) + 1)))
     return sfcTemp
 
 
@@ -547,16 +629,16 @@ def Num21(thermRad, pathRad, nbt, nbe, skyRad):
 
 # Equation Number 22- Narrow Band Emissivity
 def Num22(Num18):
-    outCon = Con(Num18, 0.97 + (0.0033 * Num18), 0.98, "VALUE <= 3")
+    outCon = np.where(_or_nodata(Num18 <= 3, Num18), 0.97 + (0.0033 * Num18), 0.98)
     return outCon
 
 
 # Equation Number 23- Normalized Difference Vegetation Index
 def Num23(Band5, Band4):
     # Float rasters to make sure we get a range of values between -1 and 1
-    outFloat5 = Float(Band5)
-    outFloat4 = Float(Band4)
-    outMath = (outFloat5 - outFloat4) / (Plus(outFloat5, outFloat4))
+    outFloat5 = _as_float(Band5)
+    outFloat4 = _as_float(Band4)
+    outMath = (outFloat5 - outFloat4) / (outFloat5 + outFloat4)
     return outMath
 
 
@@ -572,7 +654,7 @@ def Num24(eps_a, temp):
 
 # Equation Number 25- Effective Atmospheric Emissivity
 def Num25(t_sw):
-    eps_a = 0.85 * ((- arcpy.sa.Ln(t_sw)) ** 0.09)
+    eps_a = 0.85 * ((- np.log(t_sw)) ** 0.09)
     return eps_a
 
 
@@ -613,27 +695,27 @@ def Num29(a, b, T_s_datum):
 def Num30(ustar):
     z_2 = 2.0
     z_1 = 0.1
-    rah = Ln(z_2 / z_1) / (ustar * 0.41)
+    rah = np.log(z_2 / z_1) / (ustar * 0.41)
     return rah
 
 
 # Equation 31- Friction Velocity (first guess)
 def Num31(u200, zom):
-    ustar = (0.41 * u200) / (Ln(200.0 / zom))
+    ustar = (0.41 * u200) / (np.log(200.0 / zom))
     return ustar
 
 
 # Equation 32- Wind Speed at an Assumed Blending Height (200m) above Weather Station
 def Num32(uw, zom_wx, z_wx=0):
     """ added default wx station elevation of 0 meters"""
-    u200 = (uw * Ln(200 / zom_wx)) / (Ln(z_wx / zom_wx))
+    u200 = (uw * np.log(200 / zom_wx)) / (np.log(z_wx / zom_wx))
     return u200
 
 
 # Equation 33- Momentum Roughness Length, Option A
 def Num33(lai):
     zom0 = 0.018 * lai
-    zom = Con(zom0, zom0, 0.005, "VALUE >= 0.005")
+    zom = np.where(_or_nodata(zom0 >= 0.005, zom0), zom0, 0.005)
     return zom
 
 
@@ -661,13 +743,13 @@ def Num37(p, Ts, dT):
 
 # Equation 38- Friction Velocity (corrected)
 def Num38(u200, zom, psi200):
-    ustar = (u200 * .041) / (arcpy.sa.Ln(200 / zom) - psi200)
+    ustar = (u200 * .041) / (np.log(200 / zom) - psi200)
     return ustar
 
 
 # Equation 39- Aerodynamic Resistance (corrected)
 def Num39(psi2, psi01, ustar):
-    rah = (arcpy.sa.Ln(2.0 / 0.1) - psi2 + psi01) / (ustar * 0.41)
+    rah = (np.log(2.0 / 0.1) - psi2 + psi01) / (ustar * 0.41)
     return rah
 
 
@@ -683,22 +765,25 @@ def Num40(rho_air, ustar, surface_temp, H):
 
 # Equation 41- Stability Correction for Momentum Transport at 200m when L<0
 def Num41(L):
-    x200 = (1 - 16 * (200 / L)) ** 0.25
-    psi200u = 2 * arcpy.sa.Ln((1 + x200) / 2) + arcpy.sa.Ln((1 + x200 ** 2) / 2) - 2 * ATan(x200) + 0.5 * math.pi
+    with np.errstate(invalid='ignore'):
+        x200 = (1 - 16 * (200 / L)) ** 0.25
+    psi200u = 2 * np.log((1 + x200) / 2) + np.log((1 + x200 ** 2) / 2) - 2 * np.arctan(x200) + 0.5 * math.pi
     return psi200u
 
 
 # Equation 42a- Stability Correction for Heat Transport at 2m when L<0
 def Num42a(L):
-    x2 = (1 - 16 * (2 / L)) ** 0.25
-    psi2u = 2 * arcpy.sa.Ln((1 + x2 ** 2) / 2)
+    with np.errstate(invalid='ignore'):
+        x2 = (1 - 16 * (2 / L)) ** 0.25
+    psi2u = 2 * np.log((1 + x2 ** 2) / 2)
     return psi2u
 
 
 # Equation 42b- Stability Correction for Heat Transport at 0.1m when L<0
 def Num42b(L):
-    x01 = (1 - 16 * (0.1 / L)) ** 0.25
-    psi01u = 2 * arcpy.sa.Ln((1 + x01 ** 2) / 2)
+    with np.errstate(invalid='ignore'):
+        x01 = (1 - 16 * (0.1 / L)) ** 0.25
+    psi01u = 2 * np.log((1 + x01 ** 2) / 2)
     return psi01u
 
 
@@ -0,0 +1,158 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Record of the input files of a METRIC workspace.
+
+prepare_metric_env used to copy every input into the workspace so that a run could always
+be traced back to the data it was made from. An input can now also be hard linked, or only
+referenced by its absolute path, and the manifest keeps that guarantee instead: it holds
+the source, size and modification time of every input, and the sha1 of its contents once
+the model has hashed it. MetricModel checks the inputs against the manifest before a run
+and refuses to run on an input that changed since the workspace was prepared. Only the
+size and modification time are checked up front, the contents are hashed when they moved
+or when the product cache needs the key of the input anyway.
+"""
+
+import json
+import os
+import shutil
+
+# written to the workspace by prepare_metric_env, next to config.txt
+MANIFEST_FILE = "inputs.json"
+
+# how an input gets into the workspace
+COPY = "copy"
+LINK = "link"
+REFERENCE = "reference"
+MODES = (COPY, LINK, REFERENCE)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+class InputManifest(object):
+    def __init__(self, workspace):
+        """ the manifest of the workspace, empty if it has none yet"""
+
+        self.workspace = workspace
+        self.path = os.path.join(workspace, MANIFEST_FILE)
+        self.inputs = {}
+        self._file_key = None
+        self._dirty = False
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.inputs = json.load(f)
+
+    def add(self, source, dest_dir, mode=COPY):
+        """
+        brings the file at source into dest_dir of the workspace, returns the path to record
+
+        mode COPY copies the file, LINK hard links it and falls back on REFERENCE when the
+        workspace is on another file system, REFERENCE records its absolute path only. The
+        path returned is relative to the workspace unless the file stays where it is.
+        """
+
+        if mode not in MODES:
+            raise ValueError("mode must be one of {0}".format(", ".join(MODES)))
+
+        source = os.path.abspath(source)
+        destination = os.path.join(self.workspace, dest_dir, os.path.basename(source))
+        if mode == LINK:
+            try:
+                if not os.path.exists(destination):
+                    os.link(source, destination)
+            except OSError:
+                mode = REFERENCE
+        elif mode == COPY and not os.path.exists(destination):
+            shutil.copy(source, destination)
+
+        # the signature is that of the file verify() checks, a copy has a modification time of its own
+        if mode == REFERENCE:
+            recorded, signature = source, _signature(source)
+        else:
+            recorded, signature = os.path.relpath(destination, self.workspace), _signature(destination)
+        self.inputs[recorded] = {"source": source, "mode": mode, "signature": signature, "sha1": None}
+        return recorded
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.inputs, f, indent=1, sort_keys=True)
+        self._dirty = False
+        return self.path
+
+    def flush(self):
+        """ writes the sha1 and signatures recorded since the manifest was read, if any"""
+
+        if self._dirty:
+            self.write()
+        return None
+
+    def verify(self, file_key):
+        """
+        raises an Exception naming the inputs that changed since they were recorded
+
+        file_key(path) is the sha1 of the contents of a file, ProductCache.file_key. An input
+        of the recorded size and modification time is accepted without reading it. One whose
+        signature moved is hashed and only accepted if its sha1 was recorded and did not
+        change, an input never hashed cannot be told apart from one that changed.
+        """
+
+        self._file_key = file_key
+        changed = []
+        for recorded, entry in sorted(self.inputs.items()):
+            path = os.path.join(self.workspace, recorded)
+            if not os.path.isfile(path):
+                changed.append(recorded)
+                continue
+
+            signature = _signature(path)
+            if signature == entry["signature"]:
+                continue
+            if entry["sha1"] is None or file_key(path) != entry["sha1"]:
+                changed.append(recorded)
+                continue
+            entry["signature"] = signature
+            self._dirty = True
+
+        self.flush()
+        if changed:
+            raise Exception("inputs changed since the workspace was prepared: {0}".format(", ".join(changed)))
+        return None
+
+    def file_key(self, path):
+        """
+        sha1 of the file at path with the file_key given to verify
+
+        the sha1 of an input of the manifest not hashed yet is recorded, written by flush
+        """
+
+        sha1 = self._file_key(path)
+        path = os.path.abspath(path)
+        for recorded, entry in self.inputs.items():
+            if entry["sha1"] is None and os.path.abspath(os.path.join(self.workspace, recorded)) == path:
+                if _signature(path) == entry["signature"]:
+                    entry["sha1"] = sha1
+                    self._dirty = True
+                break
+        return sha1
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -14,6 +14,7 @@
 # limitations under the License.
 # ===============================================================================
 
+from grab_meta import grab_meta
 
 if __name__ == '__main__':
     pass
@@ -1,22 +1,85 @@
 # standard imports
 import math
 import os
+import time
 from datetime import datetime
 
-from numpy import where
+from numpy import array, where, empty, flatnonzero
+from osgeo import gdal
 
 import utils.spatial_reference_tools
 from utils import raster_tools as ras
-from metric import function_bank as fnbank, landsat
+from metric import band_cube, function_bank as fnbank, landsat, radiometry
+from metric import sensible_heat as shf, terrain
+from metric.band_cube import NARROWBAND_TRANSMITTANCE_CONSTANTS, PATH_REFLECTANCE_WEIGHTS
 from metric.extract_wx_data import extract_wx_data
 from metric.function_bank import print_stats
+from metric.input_manifest import InputManifest
+from metric.product_cache import ProductCache
+from metric.product_graph import ProductGraph
+from metric.profiler import REPORT_FILE, TRACE_FILE, RunProfiler
+from metric.precision import PrecisionPolicy
+from metric.scene_store import STORE_FILE, SceneStore
+from metric.snapshots import IterationSnapshots, SnapshotPolicy
 from metric.textio import IoConfig
 
+# iteration log of the sensible heat calibration, written to the output directory
+SOLVER_LOG = "sensible_heat_convergence.txt"
+
+# rasters waiting on the background writer before save_raster blocks the model
+WRITE_QUEUE = 4
+
+# input rasters read on first use by MetricModel and released after their last consumer,
+# attribute name: attribute holding the path
+LAZY_INPUTS = {"dem_file": "dem_path"}
+
 
 class MetricModel:
-    def __init__(self, config_file_path):
+    def __init__(self, config_file_path, tile_size=None, workers=None, executor="thread", sensible_heat_mode="scene",
+                 solver=None, precision="float32", compressed=False, mask_path=None, mask_bits=None,
+                 snapshots=None, terrain_cache=None, clip_path=None, store=False):
         """
         Loads all needed attributes from a workspace created with "prepare_metric_env" function
+
+        If tile_size is given the rasters are not read here, the model is streamed through
+        windows of roughly tile_size pixels on a side by metric.tiled.run_tiled instead.
+        workers spreads those tiles over a pool of threads, or of processes with
+        executor="process", and implies a tile_size of 512 when none is given.
+
+        sensible_heat_mode "scene" iterates the stability correction over the whole scene
+        until a and b converge, "reference" iterates on the hot and cold pixels only and
+        then solves every pixel once with the converged coefficients.
+
+        solver drives the a and b iteration, a name from sensible_heat.SOLVERS or a
+        FixedPointSolver carrying its own tolerance and max_iter. The default is the original
+        damped iteration, the accelerated solvers always calibrate on the reference pixels.
+
+        precision is the floating point type of the intermediate products, see metric.precision.
+        The landsat bands are held in their native integer type until they are converted.
+
+        compressed runs every product on the valid pixels of the scene only, held as 1-D
+        vectors, and scatters them back onto the grid when they are written, see pixel_grid.
+        Pixels where a landsat band holds the fill value are dropped, and those where the
+        raster at mask_path is 0, or with mask_bits where it has any of those bits set (to
+        drop cloud and water with a landsat QA band for instance).
+
+        snapshots is the SnapshotPolicy choosing which iterations of the sensible heat loop
+        are saved when the save flag asks for them, see metric.snapshots. By default the
+        first two, the last two and every tenth.
+
+        terrain_cache is the directory of the slope and solar incidence terms of the DEM, see
+        metric.terrain.TerrainCache, by default the terrain_cache_dir of the workspace if any.
+        Scenes sharing a DEM, the dates of a path/row, build them once when given the same
+        directory. Without one the terms are computed in memory by every run.
+
+        clip_path is a polygon shapefile of the study area, on the grid of the scene, by default
+        the clip_extent of the workspace if any. Only the window of the scene covering its
+        polygons is read and the products are written on the grid of that window. The model is
+        then compressed to the pixels inside the polygons.
+
+        store writes every product as a variable of a single chunked and compressed file,
+        output/scene_store.mst, instead of a GeoTIFF per product, see metric.scene_store.
+        Products still go by the name of the file they would have been written to.
         """
 
         # build a config file with these inputs
@@ -27,6 +90,24 @@ class MetricModel:
         self.work_dir = config["metric_workspace"]
         self.saveflag = config["testflag"]
         self.recalc = config["recalc"]
+        self.tile_size = tile_size
+        self.workers = workers
+        self.executor = executor
+        self.sensible_heat_mode = sensible_heat_mode
+        self.solver = shf.get_solver(solver)
+        self.precision = PrecisionPolicy(precision)
+        self.mask_path = mask_path
+        self.mask_bits = mask_bits
+        self.clip_path = clip_path or config.conf_dict.get("clip_extent")
+        if self.clip_path is not None:
+            self.clip_path = os.path.join(self.work_dir, self.clip_path)
+            compressed = True
+        self.compressed = compressed
+        self.snapshots = snapshots if snapshots is not None else SnapshotPolicy()
+        if not compressed:
+            self.grid = None
+        if workers is not None and tile_size is None:
+            self.tile_size = 512
 
         # set other inferred attributes of the working directory structure
         self.out_dir = os.path.join(self.work_dir, "output")
@@ -37,6 +118,25 @@ class MetricModel:
         self.dem_dir = os.path.join(self.work_dir, "input_dem")
         self.geodatabase = os.path.join(self.work_dir, "scratch")
 
+        # intermediate products keyed by their inputs, bounded to cache_max_gb on disk. Only
+        # kept with a cache_max_gb, the cache otherwise only hashes the inputs
+        cache_max_gb = config.conf_dict.get("cache_max_gb") or 0
+        self.cache_products = cache_max_gb > 0
+        self.cache = ProductCache(os.path.join(self.middle_dir, "cache"), max_bytes=int(cache_max_gb * 2 ** 30))
+
+        # the inputs recorded by prepare_metric_env are checked, and hashed once the cache needs
+        # their key, see metric.input_manifest
+        self.inputs = InputManifest(self.work_dir)
+        self.inputs.verify(self.cache.file_key)
+        terrain_cache = terrain_cache or config.conf_dict.get("terrain_cache_dir")
+        self.terrain_cache = None
+        if terrain_cache is not None:
+            self.terrain_cache = terrain.TerrainCache(os.path.join(self.work_dir, terrain_cache))
+
+        # time and memory of every getter, written to the run report, see metric.profiler
+        self.profiler = RunProfiler()
+        self.profiler.instrument(self)
+
         # anciliary data and calibration information
         self.wx_elev = config["wx_elev"]
         self.wx_zom = config["wx_zom"]
@@ -49,6 +149,22 @@ class MetricModel:
         self.raster_geo = utils.spatial_reference_tools.get_raster_geo_attributes(
             os.path.join(self.work_dir, config["dem_path"]))
 
+        # window of the scene read by the model, the study area if there is one
+        self.window = None
+        if self.clip_path is not None:
+            self.window = ras.shapefile_window(self.clip_path, self.raster_geo)
+            self.raster_geo = ras.window_geo(self.raster_geo, self.window)
+            print("Clipped the scene to a window of {2} x {3} pixels at ({0}, {1})".format(*self.window))
+
+        # saved rasters are compressed and written on a background thread, see save_raster, into
+        # the store of the scene if asked for, see metric.scene_store
+        self.store = None
+        write_function = ras.array_to_raster
+        if store:
+            self.store = SceneStore(os.path.join(self.out_dir, STORE_FILE), self.raster_geo)
+            write_function = self.store.write_raster
+        self.writer = ras.RasterWriter(max_queue=WRITE_QUEUE, write_function=write_function)
+
         # Landsat stuff woooo
         self.metadata_path = os.path.join(self.work_dir, config["landsat_meta"])
         self.landsat_meta = landsat.grab_meta(self.metadata_path)
@@ -65,17 +181,10 @@ class MetricModel:
         # dem info
         self.vrt_path = os.path.join(self.work_dir, config["vrt_path"])
         self.dem_path = os.path.join(self.work_dir, config["dem_path"])
-        self.aspect_path = os.path.join(self.work_dir, config["aspect_path"])
-        self.slope_path = os.path.join(self.work_dir, config["slope_path"])
-
-        self.dem_file = ras.raster_to_array(self.dem_path)
-        self.aspect_file = ras.raster_to_array(self.aspect_path)
-        self.slope_file = ras.raster_to_array(self.slope_path)
 
         self.hot_shape_path = os.path.join(self.work_dir, config["hot_shp_path"])
         self.cold_shape_path = os.path.join(self.work_dir, config["cold_shp_path"])
-        self.hot_pixel_table = os.path.join(self.ref_pixel_dir, "pixel_hot_stats.dbf")
-        self.cold_pixel_table = os.path.join(self.ref_pixel_dir, "pixel_cold_stats.dbf")
+        self.ref_pixel_index = {}
 
         self.crop = config["crop_type"]
         self.timezone = config["timezone"]
@@ -97,6 +206,7 @@ class MetricModel:
         # arcpy.env.scratchWorkspace  = self.geodatabase
         # arcpy.env.overwriteOutput   = True
 
+        self.products = {}
         self.net_radiation = 0
         self.soil_heat_flux = 0
         self.sensible_heat_flux = 0
@@ -111,22 +221,189 @@ class MetricModel:
 
         The list of filepaths in band_filepaths MUST contain filepaths to each
         of the following bands in ascending order. [2,3,4,5,6,7,10,11].
+        The bands are not read here, B2_rast ... B11_rast are lazy raster_tools.RasterProxy
+        objects that read (or memory map) the file when a getter first needs the band.
+        dn_luts holds, by band number, the radiometry.DNLookupTable converting the band to
+        reflectance (2 - 7) or radiance (10, 11) with the gains of the MTL file.
         """
 
         band_names = [2, 3, 4, 5, 6, 7, 10, 11]
 
         self.landsat_bands = []  # legacy. list of landsat band objects
+        self.dn_luts = {}
 
         for i, band_filepath in enumerate(band_filepaths):
             path_attr_name = 'B{0}_path'.format(band_names[i])
             rast_attr_name = 'B{0}_rast'.format(band_names[i])
 
             setattr(self, path_attr_name, band_filepath)
-            setattr(self, rast_attr_name, ras.raster_to_array(getattr(self, path_attr_name)))
-
-            self.landsat_bands.append(getattr(self, rast_attr_name))
+            band = ras.RasterProxy(band_filepath, window=self.window)
+            self.cache.register(band, lambda path=band_filepath: self.input_key(path))
+            setattr(self, rast_attr_name, band)
+            self.landsat_bands.append(band)
+            self.dn_luts[band_names[i]] = radiometry.band_lookup_table(self.landsat_meta, band_names[i],
+                                                                       self.precision.dtype)
         return None
 
+    def __getattr__(self, name):
+        """
+        reads the DEM the first time it is used, see LAZY_INPUTS
+
+        the grid of valid pixels of a compressed model is also only built on first use
+        """
+
+        if name == "grid":
+            grid = self.pixel_grid()
+            print("Compressed the scene to {0} of {1} pixels".format(grid.size, grid.shape[0] * grid.shape[1]))
+            # products of a compressed model are only valid for this set of pixels
+            self.cache.register(grid.index, self.cache.key_of(grid.index))
+            self.grid = grid
+            return grid
+
+        if name not in LAZY_INPUTS:
+            raise AttributeError(name)
+        value = self.read_input(getattr(self, LAZY_INPUTS[name]), self.precision.dtype)
+        setattr(self, name, value)
+        return value
+
+    def pixel_grid(self, window=None):
+        """
+        raster_tools.CompressedGrid of the valid pixels of the scene, or of a window of it
+
+        built from the fill value of the landsat bands, the mask raster and the clip polygons, if any
+        """
+
+        mask = None
+        if self.mask_path is not None:
+            mask = ras.raster_to_array(self.mask_path, window=self.scene_window(window), dtype=None)
+        bands = [band.read(window) for band in self.landsat_bands]
+        if self.clip_path is not None:
+            # 0 outside the polygons, dropped like the fill value of the bands
+            bands.append(self.clip_mask(window))
+        return ras.CompressedGrid.from_bands(bands, mask, self.mask_bits)
+
+    def scene_window(self, window=None):
+        """ the window of the scene rasters for a window of the grid of the model, None for all of it"""
+
+        return ras.offset_window(window, self.window)
+
+    def clip_mask(self, window=None):
+        """ 1 inside the polygons of clip_path and 0 elsewhere, on the grid of the model or a window of it"""
+
+        if "_clip_mask" not in self.__dict__:
+            self._clip_mask = ras.rasterize_shapefile(self.clip_path, self.raster_geo)
+        if window is None:
+            return self._clip_mask
+        xoff, yoff, xsize, ysize = window
+        return self._clip_mask[yoff:yoff + ysize, xoff:xoff + xsize]
+
+    def compress(self, array):
+        """ the valid pixels of a grid shaped array when the model is compressed, otherwise array"""
+
+        if self.grid is None:
+            return array
+        return self.grid.compress(array)
+
+    def release_input(self, name):
+        """ drops one of the LAZY_INPUTS once its last consumer has run, it is read again if needed"""
+
+        self.__dict__.pop(name, None)
+
+    def input_key(self, path):
+        """ key of the product cache for the window of the input raster at path read by the model"""
+
+        if self.window is None:
+            return self.inputs.file_key(path)
+        return [self.inputs.file_key(path), list(self.window)]
+
+    def read_input(self, path, dtype=None):
+        """
+        reads an input raster, known to the product cache by the contents of its file
+
+        dtype None keeps the data type of the file, as for the landsat bands
+        """
+
+        array = ras.raster_to_array(path, window=self.scene_window(), dtype=dtype)
+        return self.cache.register(self.compress(array), self.input_key(path))
+
+    def get_product(self, name, path, compute, inputs=(), saveflag=None):
+        """
+        Returns the intermediate product name, from the product cache when possible
+
+        The product is looked up under a key built from name and inputs, which holds every
+        array (input raster or upstream product) and scalar the product depends on. On a
+        miss, or with recalc set, compute() is called, the result cast to the precision of
+        the product, stored in the cache and written to path if the save flag (saveflag,
+        defaulting to name) asks for it. A (band, row, col) product is written to a list
+        of paths, one per band. Without a cache_max_gb in the config the product is always
+        computed and not cached.
+        """
+
+        if not self.cache_products:
+            product = self.precision.cast(saveflag or name, compute())
+            if self.check_saveflag(saveflag or name):
+                self.save_raster(product, path)
+            return product
+
+        dtype = self.precision.dtype_for(saveflag or name)
+        inputs = list(inputs) + [dtype.str]
+        if self.grid is not None:
+            inputs.append(self.grid.index)
+        key = self.cache.product_key(name, inputs)
+        if not self.recalc:
+            product = self.cache.load(key)
+            if product is not None:
+                print "Reading previously estimated {0}... ".format(name)
+                return product
+
+        product = self.precision.cast(saveflag or name, compute())
+        self.cache.store(name, key, product, inputs)
+
+        if self.check_saveflag(saveflag or name):
+            self.save_raster(product, path)
+        return product
+
+    def save_raster(self, array, path, copy=False):
+        """
+        writes a numpy array to a float32 GeoTIFF on the grid of the DEM
+
+        a (band, row, col) cube is written band by band to the list of paths path, the
+        arrays of a compressed model are scattered back onto the grid first.
+
+        The array is queued on the background writer and written while the model goes on,
+        pass copy=True if it is modified in place afterwards. Call writer.flush() before
+        reading the file back. A model with a store writes the variable named by the file
+        name of path instead, see metric.scene_store.
+        """
+
+        if isinstance(path, list):
+            return [self.save_raster(band, band_path, copy) for band, band_path in zip(array, path)]
+        if self.grid is not None:
+            array, copy = self.grid.expand(array), False
+
+        geo = dict(self.raster_geo, bands=1, data_type=gdal.GDT_Float32)
+        return self.writer.write(array, path, geo, copy)
+
+    def close_store(self):
+        """ writes the index of the store of the model, if it has one, once its products are written"""
+
+        if self.store is not None:
+            self.store.close()
+            print("Wrote {0} products to {1}".format(len(self.store.names()), self.store.path))
+
+    def band_paths(self, template, first=1):
+        """ paths in middle_dir of the six reflective band files of a cube product"""
+
+        return [os.path.join(self.middle_dir, template.format(first + i)) for i in xrange(6)]
+
+    def save_snapshot(self, snapshots, name, i, array, flag=None):
+        """ offers iteration i of name to snapshots if the save flag asks for flag, name by default"""
+
+        if self.check_saveflag(flag or name):
+            if self.grid is not None:
+                array = self.grid.expand(array)
+            snapshots.add(name, i, array)
+
     def check_saveflag(self, object_name):
         """
         Central function for managing saving of intermediate data products
@@ -263,58 +540,43 @@ class MetricModel:
                                                                                     sunset_hour_angle)))
         return self.xterr_rad
 
-    def get_slope(self):
-        """ calculates a slope raster from the DEM"""
-
-        sfname = "slope.tif"
-        sfpath = os.path.join(self.middle_dir, sfname)
+    def terrain_planes(self):
+        """
+        slope and solar incidence terms of the whole DEM, see terrain.PLANES
 
-        if os.path.isfile(sfpath) and not self.recalc:
-            print "Reading previously estimated slopes... "
-            print "Reading previously estimated slopes... "
-            slope = ras.raster_to_array(sfpath)
-        else:
-            print "Calculating elevation derivatives... "
-            print "Calculating elevation derivatives... "
-            slope = ras.raster_to_array(self.slope_file)
+        memory mapped from the terrain cache if the model has one, otherwise computed once
+        per run and held in memory
+        """
 
-            # cap slopes at 30 degrees to reduce DEM artifacts
-            # slope = arcpy.sa.Con(slope, slope, 30, "VALUE < 30")
-            slope = where(slope > 30., 30., slope)
+        if self.terrain_cache is None:
+            if "_terrain_planes" not in self.__dict__:
+                self._terrain_planes = terrain.scene_planes(self.dem_path, self.raster_geo, self.precision.dtype,
+                                                            self.window)
+            return self._terrain_planes
+        return self.terrain_cache.planes(self.dem_path, self.inputs.file_key(self.dem_path), self.raster_geo,
+                                         self.precision.dtype, self.window)
 
-            # convert degrees to radians
-            slope = slope * math.pi / 180
+    def get_slope(self):
+        """ calculates a slope raster from the DEM"""
 
-            if self.check_saveflag("slope"):
-                slope.save(sfpath)
+        def slope():
+            # capped at 30 degrees and in radians, see terrain.slope_radians
+            return self.compress(array(self.terrain_planes()[0]))
 
-        return slope
+        return self.get_product("slope", os.path.join(self.middle_dir, "slope.tif"), slope,
+                                [self.input_key(self.dem_path), "horn"])
 
-    # use gdal_funcs to create individual aspects from DEM tiles
     def get_aspect(self):
-        pass
-
-    #     """ calculates the aspect raster from the DEM"""
-    #
-    #     afname = "aspect.tif"
-    #     afpath = os.path.join(self.middle_dir, afname)
-    #
-    #     if os.path.isfile(afpath) and not self.recalc:
-    #         aspect = ras.convert_raster_to_array(afpath)
-    #     else:
-    #
-    #         aspect = ras.get_raster_geo_attributes(self.aspect_file)
-    #         # get rid of -1 "slope 0" flag
-    #         # TODO: is this necessary?
-    #         aspect = ras.get_raster_geo_attributes(arcpy.sa.Con(aspect, aspect, math.pi, "VALUE > -1"))
-    #
-    #         # convert degrees to radians and rotate half turn to put 0 aspect to south
-    #         aspect = (aspect * math.pi / 180) - math.pi
-    #
-    #         if self.check_saveflag("aspect"):
-    #             aspect.save(afpath)
-    #
-    #     return aspect
+        """ calculates the aspect raster from the DEM"""
+
+        def aspect():
+            print "Calculating elevation derivatives... "
+            dem = terrain.read_with_halo(self.dem_path, self.window, dtype=self.precision.dtype)
+            aspect = terrain.slope_aspect(dem, *terrain.resolution(self.raster_geo))[1]
+            return terrain.aspect_radians(self.compress(aspect))
+
+        return self.get_product("aspect", os.path.join(self.middle_dir, "aspect.tif"), aspect,
+                                [self.input_key(self.dem_path), "horn"])
 
     def get_solar_zenith_angle(self, declination, lat, hour_angle):
         return fnbank.Num8(declination, lat, hour_angle)
@@ -323,45 +585,37 @@ class MetricModel:
         e_a = fnbank.Saturation_Vapor_Pressure(dewp_C)
         return e_a
 
-    def get_cosine_of_solar_incidence_angle(self, declination, lat, slope, aspect, hour_angle):
-        """ calculate the cosine of solar incidence angle from sceen geometry"""
+    def get_cosine_of_solar_incidence_angle(self, declination, lat, hour_angle):
+        """
+        calculate the cosine of solar incidence angle from sceen geometry
 
-        siname = "sia_output.tif"
-        sipath = os.path.join(self.middle_dir, siname)
+        fnbank.Num7 as the sum of the cached terrain planes weighted by the sun angles of the scene
+        """
 
-        if os.path.isfile(sipath) and not self.recalc:
-            print "Reading previously estimated cosine of solar incidence angles... "
-            sia = ras.raster_to_array(sipath)
-        else:
+        def sia():
             print "Calculating cosine of solar incidence angles... "
-            sia, sia1, sia2, sia3, sia4, sia5 = fnbank.Num7(declination, lat, slope, aspect, hour_angle)
+            coefficients = terrain.incidence_coefficients(declination, lat, hour_angle)
+            return terrain.cos_incidence(self.compress(self.terrain_planes()), coefficients)
 
-            if self.check_saveflag("sia"):
-                sia.save(sipath)
-        return sia
+        return self.get_product("sia", os.path.join(self.middle_dir, "sia_output.tif"), sia,
+                                [self.input_key(self.dem_path), "horn", declination, lat, hour_angle])
 
     def get_reflectance_band(self, cos_sia):
-        """ converts landsat bands to reflectance """
+        """ converts the six reflective landsat bands (2 - 7) to a (band, row, col) reflectance cube"""
 
-        refl_bands = []
-        for i in xrange(len(self.landsat_bands)):
-            if i >= 8:
-                landsat_band_file = "LS_ref{0}.tif".format(str(i + 4))
-            else:
-                landsat_band_file = "LS_ref{0}.tif".format(str(i + 2))
-            landsat_band_path = os.path.join(self.middle_dir, landsat_band_file)
+        bands = self.landsat_bands[:6]
+        luts = [self.dn_luts[i] for i in xrange(2, 8)]
 
-            if os.path.isfile(landsat_band_path) and not self.recalc:
-                reflectance_band = ras.raster_to_array(landsat_band_path)
-                refl_bands.append(reflectance_band)
-            else:
-                reflectance_band = fnbank.Num10(self.landsat_bands[i], cos_sia)
-                refl_bands.append(landsat_band_path)
+        def compute():
+            dn_bands = [self.compress(band.read()) for band in bands]
+            return band_cube.reflectance(dn_bands, cos_sia, self.precision.dtype, luts)
 
-                if self.check_saveflag("LS_ref"):
-                    reflectance_band.save(landsat_band_path)
-
-        return refl_bands
+        refl = self.get_product("LS_ref", self.band_paths("LS_ref{0}.tif", first=2), compute,
+                                [bands, cos_sia, luts])
+        # reflectance is the only consumer of the bands
+        for band in bands:
+            band.release()
+        return refl
 
     def get_SAVI(self, refl_band5, refl_band4):
         """ calculates soil adjusted vegetation index"""
@@ -369,111 +623,44 @@ class MetricModel:
         # L=0.1 for SAVI_idaho or L=0.5 for common SAVI
         L = self.L_green_fac
 
-        svname = "savi_output.tif"
-        svpath = os.path.join(self.out_dir, svname)
-
-        if os.path.isfile(svpath) and not self.recalc:
-            savi = ras.raster_to_array(svpath)
-        else:
-            outFloat5 = arcpy.sa.Float(refl_band5)
-            outFloat4 = arcpy.sa.Float(refl_band4)
-            savi = ((1 + L) * (outFloat5 - outFloat4)) / (L + (outFloat5 + outFloat4))
-
-            if self.check_saveflag("savi"):
-                savi.save(svpath)
-        return savi
+        return self.get_product("savi", os.path.join(self.out_dir, "savi_output.tif"),
+                                lambda: fnbank.Num19(refl_band5, refl_band4, L), [refl_band5, refl_band4, L])
 
     def get_NDVI(self, refl_band5, refl_band4):
         """ calculates normalized difference vegetation index"""
 
-        ndname = "ndvi_output.tif"
-        ndpath = os.path.join(self.out_dir, ndname)
-
-        if os.path.isfile(ndpath) and not self.recalc:
-            ndvi = ras.raster_to_array(ndpath)
-        else:
-            outFloat5 = arcpy.sa.Float(refl_band5)
-            outFloat4 = arcpy.sa.Float(refl_band4)
-            ndvi = (outFloat5 - outFloat4) / (outFloat5 + outFloat4)
-
-            if self.check_saveflag("ndvi"):
-                ndvi.save(ndpath)
-        return ndvi
+        return self.get_product("ndvi", os.path.join(self.out_dir, "ndvi_output.tif"),
+                                lambda: fnbank.Num23(refl_band5, refl_band4), [refl_band5, refl_band4])
 
     def get_LAI(self, savi):
         """ calculates leaf area index"""
 
-        laname = "lai_output.tif"
-        lapath = os.path.join(self.out_dir, laname)
-
-        if os.path.isfile(lapath) and not self.recalc:
-            lai = ras.raster_to_array(lapath)
-        else:
-
-            # assigns LAI for 0.1 <= SAVI <= 0.687
-            outMath = ((arcpy.sa.Ln((0.69 - savi) / 0.59)) / (-0.91))
-            # assigns LAI for SAVI >= 0.687
-            outCon1 = arcpy.sa.Con(savi, outMath, 6, "VALUE <= 0.687")
-            # assigns LAI for SAVI <= 0.1
-            lai = arcpy.sa.Con(savi, outCon1, 0, "VALUE >= 0.1")
-
-            if self.check_saveflag("lai"):
-                lai.save(lapath)
-
-        return lai
+        # LAI from SAVI, capped at 6 above SAVI 0.687 and zero below SAVI 0.1
+        return self.get_product("lai", os.path.join(self.out_dir, "lai_output.tif"), lambda: fnbank.Num18(savi), [savi])
 
     def get_broadband_surface_emissivity(self, lai):
-        bbse_name = "bbse_output.tif"
-        bbse_path = os.path.join(self.middle_dir, bbse_name)
-
-        if os.path.isfile(bbse_path) and not self.recalc:
-            bbse = ras.raster_to_array(bbse_path)
-        else:
-            bbse = fnbank.Num17(lai)
-
-            if self.check_saveflag("bbse"):
-                bbse.save(bbse_path)
-        return bbse
+        return self.get_product("bbse", os.path.join(self.middle_dir, "bbse_output.tif"),
+                                lambda: fnbank.Num17(lai), [lai])
 
     def get_narrow_band_emissivity(self, lai):
-        nbe_name = "nbe_output.tif"
-        nbe_path = os.path.join(self.middle_dir, nbe_name)
-
-        if os.path.isfile(nbe_path) and not self.recalc:
-            nbe = ras.raster_to_array(nbe_path)
-        else:
-            nbe = fnbank.Num22(lai)
-
-            if self.check_saveflag("nbe"):
-                nbe.save(nbe_path)
-        return nbe
+        return self.get_product("nbe", os.path.join(self.middle_dir, "nbe_output.tif"),
+                                lambda: fnbank.Num22(lai), [lai])
 
     def _get_initial_thermal_radiances(self):
 
         # Landsat Thermal Band 10
-        thrad10_name = "thermRad10_output.tif"
-        thrad10_path = os.path.join(self.middle_dir, thrad10_name)
-
-        if os.path.isfile(thrad10_path) and not self.recalc:
-            therm_rad10 = ras.raster_to_array(thrad10_path)
-        else:
-            therm_rad10 = fnbank.L8_Thermal_Radiance(self.B10_rast)
-
-            if self.check_saveflag("therm_rad10"):
-                therm_rad10.save(thrad10_path)
+        therm_rad10 = self.get_product("therm_rad10", os.path.join(self.middle_dir, "thermRad10_output.tif"),
+                                       lambda: self.dn_luts[10](self.compress(self.B10_rast.read())),
+                                       [self.B10_rast, self.dn_luts[10]])
 
         # Landsat Thermal Band 11
-        thrad11_name = "thermRad11_output.tif"
-        thrad11_path = os.path.join(self.middle_dir, thrad11_name)
-
-        if os.path.isfile(thrad11_path) and not self.recalc:
-            therm_rad11 = ras.raster_to_array(thrad11_path)
-        else:
-            therm_rad11 = fnbank.L8_Thermal_Radiance(self.B11_rast)
-
-            if self.check_saveflag("therm_rad11"):
-                therm_rad11.save(thrad11_path)
+        therm_rad11 = self.get_product("therm_rad11", os.path.join(self.middle_dir, "thermRad11_output.tif"),
+                                       lambda: self.dn_luts[11](self.compress(self.B11_rast.read())),
+                                       [self.B11_rast, self.dn_luts[11]])
 
+        # the thermal radiances are the only consumers of the thermal bands
+        self.B10_rast.release()
+        self.B11_rast.release()
         return [therm_rad10, therm_rad11]
 
     def _get_corrected_thermal_radiances(self, nbe):
@@ -488,64 +675,35 @@ class MetricModel:
         sky_rad = 1.32
 
         # Corrections Thermal Band 10
-        corr10_name = "corrRad10_output.tif"
-        corr10_path = os.path.join(self.middle_dir, corr10_name)
-
-        if os.path.isfile(corr10_path) and not self.recalc:
-            corr_rad10 = ras.raster_to_array(corr10_path)
-        else:
-            corr_rad10 = fnbank.Num21(therm_rad10, path_rad, nbt, nbe, sky_rad)
-
-            if self.check_saveflag("corr_rad10"):
-                corr_rad10.save(corr10_path)
+        corr_rad10 = self.get_product("corr_rad10", os.path.join(self.middle_dir, "corrRad10_output.tif"),
+                                      lambda: fnbank.Num21(therm_rad10, path_rad, nbt, nbe, sky_rad),
+                                      [therm_rad10, path_rad, nbt, nbe, sky_rad])
 
         # Corrections Thermal Band 11
-        corr11_name = "corrRad11_output.tif"
-        corr11_path = os.path.join(self.middle_dir, corr11_name)
-
-        if os.path.isfile(corr11_path) and not self.recalc:
-            corr_rad11 = ras.raster_to_array(corr11_path)
-        else:
-            corr_rad11 = fnbank.Num21(therm_rad11, path_rad, nbt, nbe, sky_rad)
-
-            if self.check_saveflag("corr_rad11"):
-                corr_rad11.save(corr11_path)
+        corr_rad11 = self.get_product("corr_rad11", os.path.join(self.middle_dir, "corrRad11_output.tif"),
+                                      lambda: fnbank.Num21(therm_rad11, path_rad, nbt, nbe, sky_rad),
+                                      [therm_rad11, path_rad, nbt, nbe, sky_rad])
 
         return [corr_rad10, corr_rad11]
 
     def get_surface_temperature(self, nbe):
         """@param nbe: found in get_narrow_band_emissivity (Ln262)"""
 
-        lst_name = "sfcTemp_output.tif"
-        lst_path = os.path.join(self.middle_dir, lst_name)
-
-        if os.path.isfile(lst_path) and not self.recalc:
-            sfcTemp = ras.raster_to_array(lst_path)
-        else:
+        def sfcTemp():
             corrected_thermal_radiances = self._get_corrected_thermal_radiances(nbe)
             corr_rad10 = corrected_thermal_radiances[0]
             # corr_rad11 = corrected_thermal_radiances[1]
 
             sfcTemp10 = fnbank.Num20(corr_rad10, nbe, 774.89, 1321.08)
             # sfcTemp11 = fnbank.Num20(corr_rad11, nbe, 480.89, 1201.14)
-            sfcTemp = (sfcTemp10)  # + sfcTemp11) / 2
+            return sfcTemp10  # + sfcTemp11) / 2
 
-            if self.check_saveflag("sfcTemp"):
-                sfcTemp.save(lst_path)
-        return sfcTemp
+        return self.get_product("sfcTemp", os.path.join(self.middle_dir, "sfcTemp_output.tif"), sfcTemp,
+                                [self.B10_rast, self.B11_rast, nbe])
 
     def get_atmospheric_pressure(self):
-        p_name = "p_output.tif"
-        p_path = os.path.join(self.middle_dir, p_name)
-
-        if os.path.isfile(p_path) and not self.recalc:
-            p = ras.raster_to_array(p_path)
-        else:
-            p = fnbank.Num5(self.dem_file)
-
-            if self.check_saveflag("p"):
-                p.save(p_path)
-        return p
+        return self.get_product("p", os.path.join(self.middle_dir, "p_output.tif"), lambda: fnbank.Num5(self.dem_file),
+                                [self.dem_file])
 
     def get_water_in_the_atmosphere(self, e_a, p, P_air):
         """
@@ -553,17 +711,8 @@ class MetricModel:
         @param p: found in get_atmospheric_pressure (ln344)
         """
 
-        w_name = "w_output.tif"
-        w_path = os.path.join(self.middle_dir, w_name)
-
-        if os.path.isfile(w_path) and not self.recalc:
-            w = ras.raster_to_array(w_path)
-        else:
-            w = fnbank.Num6(e_a, p)
-
-            if self.check_saveflag("w"):
-                w.save(w_path)
-        return w
+        return self.get_product("w", os.path.join(self.middle_dir, "w_output.tif"),
+                                lambda: fnbank.Num6(e_a, p), [e_a, p])
 
     def get_effective_narrowband_trasmittance1(self, p, w, cth):
         """
@@ -573,28 +722,9 @@ class MetricModel:
         """
 
         kt = 1.0
-        constants = [[0.987, -0.00071, 0.000036, 0.0880, 0.0789],
-                     [2.319, -0.00016, 0.000105, 0.0437, -1.2697],
-                     [0.951, -0.00033, 0.000280, 0.0875, 0.1014],
-                     [0.375, -0.00048, 0.005018, 0.1355, 0.6621],
-                     [0.234, -0.00101, 0.004336, 0.0560, 0.7757],
-                     [0.365, -0.00097, 0.004296, 0.0155, 0.6390]]
-        entirs_bands = []
-        for i in xrange(6):
-            ent_name = 'entisrBnd0' + str(i + 1) + '_output.tif'
-            ent_path = os.path.join(self.middle_dir, ent_name)
-
-            if os.path.isfile(ent_path) and not self.recalc:
-                raster = ras.raster_to_array(ent_path)
-            else:
-                raster = fnbank.Num12(p, w, cth, kt, constants[i][0], constants[i][1],
-                                      constants[i][2], constants[i][3], constants[i][4])
-
-                if self.check_saveflag("entisr"):
-                    raster.save(ent_path)
-
-            entirs_bands.append(raster)
-        return entirs_bands
+        return self.get_product("entisr", self.band_paths("entisrBnd0{0}_output.tif"),
+                                lambda: band_cube.narrowband_transmittance(p, w, cth, kt),
+                                [p, w, cth, kt, NARROWBAND_TRANSMITTANCE_CONSTANTS])
 
     def get_effective_narrowband_transmittance2(self, p, w):
         """
@@ -604,48 +734,16 @@ class MetricModel:
 
         kt = 1.0
         cos_n = 1
-        constants = [[0.987, -0.00071, 0.000036, 0.0880, 0.0789],
-                     [2.319, -0.00016, 0.000105, 0.0437, -1.2697],
-                     [0.951, -0.00033, 0.000280, 0.0875, 0.1014],
-                     [0.375, -0.00048, 0.005018, 0.1355, 0.6621],
-                     [0.234, -0.00101, 0.004336, 0.0560, 0.7757],
-                     [0.365, -0.00097, 0.004296, 0.0155, 0.6390]]
-        entsrrs_bands = []
-        for i in xrange(6):
-            ent2_name = 'entsrrsBnd0' + str(i + 1) + '_output.tif'
-            ent2_path = os.path.join(self.middle_dir, ent2_name)
-
-            if os.path.isfile(ent2_path) and not self.recalc:
-                raster = ras.raster_to_array(ent2_path)
-            else:
-                raster = fnbank.Num13(p, w, cos_n, kt, constants[i][0], constants[i][1],
-                                      constants[i][2], constants[i][3], constants[i][4])
-
-                if self.check_saveflag("entsrrs"):
-                    raster.save(ent2_path)
-
-            entsrrs_bands.append(raster)
-        return entsrrs_bands
+        return self.get_product("entsrrs", self.band_paths("entsrrsBnd0{0}_output.tif"),
+                                lambda: band_cube.narrowband_transmittance(p, w, cos_n, kt),
+                                [p, w, cos_n, kt, NARROWBAND_TRANSMITTANCE_CONSTANTS])
 
     def get_per_band_path_reflectance(self, entisr_bands):
         """@param entisr_bands: found in get_effective_narrowband_trasmittance1 (ln373)"""
 
-        pr_bands = []
-        constants = [0.254, 0.149, 0.147, 0.311, 0.103, 0.036]
-        for i in xrange(6):
-            pr_name = 'prBnd0' + str(i + 1) + '_output.tif'
-            pr_path = os.path.join(self.middle_dir, pr_name)
-
-            if os.path.isfile(pr_path) and not self.recalc:
-                raster = ras.raster_to_array(pr_path)
-            else:
-                raster = fnbank.Num14(entisr_bands[i], constants[i])
-
-                if self.check_saveflag("pr"):
-                    raster.save(pr_path)
-
-            pr_bands.append(raster)
-        return pr_bands
+        return self.get_product("pr", self.band_paths("prBnd0{0}_output.tif"),
+                                lambda: band_cube.path_reflectance(entisr_bands),
+                                [entisr_bands, PATH_REFLECTANCE_WEIGHTS])
 
     def get_broad_band_atmospheric_transmissivity(self, p, w, cth):
         """
@@ -654,35 +752,17 @@ class MetricModel:
         @param cth: found in get_solar_zenith_angle (ln178)
         """
 
-        bbat_name = "bbat_output.tif"
-        bbat_path = os.path.join(self.middle_dir, bbat_name)
-
-        if os.path.isfile(bbat_path) and not self.recalc:
-            bbat = ras.raster_to_array(bbat_path)
-        else:
-            kt = 1.0
-            bbat = fnbank.Num4(p, w, cth, kt)
-
-            if self.check_saveflag("bbat"):
-                bbat.save(bbat_path)
-        return bbat
+        kt = 1.0
+        return self.get_product("bbat", os.path.join(self.middle_dir, "bbat_output.tif"),
+                                lambda: fnbank.Num4(*self.precision.promote("bbat", p, w, cth) + [kt]), [p, w, cth, kt])
 
     def get_incoming_broad_band_short_wave_radiation(self, sia, bbat, earth_sun_distance):
         """
         @param sia: found in get_cosine_of_solar_incidence_angle (ln185)
         @param bbat: found in get_broad_band_atmospheric_transmissivity (ln440)
         """
-        ibbswr_name = "ibbswr_output.tif"
-        ibbswr_path = os.path.join(self.middle_dir, ibbswr_name)
-
-        if os.path.isfile(ibbswr_path) and not self.recalc:
-            ibbswr = ras.raster_to_array(ibbswr_path)
-        else:
-            ibbswr = fnbank.Num3(sia, bbat, earth_sun_distance)
-
-            if self.check_saveflag("ibbswr"):
-                ibbswr.save(ibbswr_path)
-        return ibbswr
+        return self.get_product("ibbswr", os.path.join(self.middle_dir, "ibbswr_output.tif"),
+                                lambda: fnbank.Num3(sia, bbat, earth_sun_distance), [sia, bbat, earth_sun_distance])
 
     def get_at_surface_reflectance(self, refl_bands, entisr_bands, entsrrs_bands, pr_bands):
         """
@@ -692,13 +772,9 @@ class MetricModel:
         @param pr_bands: found in get_per_band_path_reflectance (ln421)
         """
 
-        asr_bands = []
-        for i in xrange(6):
-            raster = fnbank.Num11(refl_bands[i], entisr_bands[i], entsrrs_bands[i], pr_bands[i])
-            asr_bands.append(raster)
-
-            if self.check_saveflag("asr"):
-                raster.save()
+        inputs = [refl_bands, entisr_bands, entsrrs_bands, pr_bands]
+        asr_bands = self.get_product("asr", self.band_paths("asrBnd0{0}_output.tif"),
+                                     lambda: band_cube.at_surface_reflectance(*inputs), inputs)
 
         self.ls_surface_reflectances = asr_bands
         return asr_bands
@@ -711,9 +787,9 @@ class MetricModel:
         canopy scale" by Hunt et al.
 
         Inputs:
-        :param ls_blue      arcpy.raster object for a landsat blue band
-        :param ls_green     arcpy.raster object for a landsat green band
-        :param ls_red       arcpy.raster object for a landsat red band
+        :param ls_blue      numpy array for a landsat blue band
+        :param ls_green     numpy array for a landsat green band
+        :param ls_red       numpy array for a landsat red band
 
         should be updated to include MODIS scale calculation as well as Landsat.
         """
@@ -728,38 +804,21 @@ class MetricModel:
 
         TGIpath = os.path.join(self.out_dir, "CI_TGI_landsat.tif")
         if self.check_saveflag("TGI"):
-            TGI.save(TGIpath)
+            self.save_raster(TGI, TGIpath)
 
         return TGI
 
     def get_broadband_surface_albedo(self, asr_bands):
         """@param asr_bands: found in get_at_surface_reflectance (ln471)"""
 
-        bsa_name = "bsa_output.tif"
-        bsa_path = os.path.join(self.middle_dir, bsa_name)
-
-        if os.path.isfile(bsa_path) and not self.recalc:
-            bsa = ras.raster_to_array(bsa_path)
-        else:
-            bsa = fnbank.Num15(asr_bands)
-
-            if self.check_saveflag("bsa"):
-                bsa.save(bsa_path)
-        return bsa
+        return self.get_product("bsa", os.path.join(self.middle_dir, "bsa_output.tif"),
+                                lambda: band_cube.broadband_albedo(asr_bands), [asr_bands])
 
     def get_effective_atmospheric_transmissivity(self, bbat):
         """@param bbat: found in get_broad_band_atmospheric_transmissivity (ln440)"""
 
-        eae_name = 'eae_output.tif'
-        eae_path = os.path.join(self.middle_dir, eae_name)
-
-        if os.path.isfile(eae_path) and not self.recalc:
-            eae = ras.raster_to_array(eae_path)
-        else:
-            eae = fnbank.Num25(bbat)
-            if self.check_saveflag("eae"):
-                eae.save(eae_path)
-        return eae
+        return self.get_product("eae", os.path.join(self.middle_dir, "eae_output.tif"),
+                                lambda: fnbank.Num25(bbat), [bbat])
 
     def get_soil_heat_flux_to_net_radiation_ratio(self, bsa, sfc_temp, ndvi):
         """
@@ -768,17 +827,8 @@ class MetricModel:
         @param ndvi: found in get_NDVI
         """
 
-        grat_name = "g_ratio_output.tif"
-        grat_path = os.path.join(self.middle_dir, grat_name)
-
-        if os.path.isfile(grat_path) and not self.recalc:
-            g_ratio = ras.raster_to_array(grat_path)
-        else:
-            g_ratio = fnbank.Num26(bsa, sfc_temp, ndvi)
-
-            if self.check_saveflag("g_ratio"):
-                g_ratio.save(grat_path)
-        return g_ratio
+        return self.get_product("g_ratio", os.path.join(self.middle_dir, "g_ratio_output.tif"),
+                                lambda: fnbank.Num26(bsa, sfc_temp, ndvi), [bsa, sfc_temp, ndvi])
 
     def get_momentum_roughness_length(self, lai):
         """@param lai: found in get_LAI"""
@@ -786,22 +836,14 @@ class MetricModel:
         zom = fnbank.Num33(lai)
 
         if self.check_saveflag("zom"):
-            zom.save('zom_output.tif')
+            self.save_raster(zom, os.path.join(self.middle_dir, "zom_output.tif"))
         return zom
 
     def get_incoming_long_wave_radiation(self, eae, temp_C_mid):
         """@param eae: found in get_effective_atmospheric_transmissivity (ln495)"""
 
-        ilwr_name = "ilwr_output.tif"
-        ilwr_path = os.path.join(self.middle_dir, ilwr_name)
-
-        if os.path.isfile(ilwr_path) and not self.recalc:
-            ilwr = ras.raster_to_array(ilwr_path)
-        else:
-            ilwr = fnbank.Num24(eae, temp_C_mid + 273)
-            if self.check_saveflag("ilwr"):
-                ilwr.save(ilwr_path)
-        return ilwr
+        return self.get_product("ilwr", os.path.join(self.middle_dir, "ilwr_output.tif"),
+                                lambda: fnbank.Num24(eae, temp_C_mid + 273), [eae, temp_C_mid])
 
     def get_outgoing_long_wave_radiation(self, bbse, sfc_temp):
         """
@@ -809,16 +851,8 @@ class MetricModel:
         @param sfc_temp: found in get_surface_temperature (ln328)
         """
 
-        olwr_name = "olwr_output.tif"
-        olwr_path = os.path.join(self.middle_dir, olwr_name)
-
-        if os.path.isfile(olwr_path) and not self.recalc:
-            olwr = ras.raster_to_array(olwr_path)
-        else:
-            olwr = fnbank.Num16(bbse, sfc_temp)
-            if self.check_saveflag("olwr"):
-                olwr.save(olwr_path)
-        return olwr
+        return self.get_product("olwr", os.path.join(self.middle_dir, "olwr_output.tif"),
+                                lambda: fnbank.Num16(bbse, sfc_temp), [bbse, sfc_temp])
 
     def get_net_radiation(self, ibbswr, bsa, olwr, ilwr, bbse):
         """
@@ -829,28 +863,15 @@ class MetricModel:
         @param bbse: found in get_broadband_surface_emissivity (ln252)
         """
 
-        netrad_name = "net_rad.tif"
-        netrad_path = os.path.join(self.middle_dir, netrad_name)
-
-        if os.path.isfile(netrad_path) and not self.recalc:
-            self.net_radiation = ras.raster_to_array(netrad_path)
-        else:
-            self.net_radiation = fnbank.Num2(ibbswr, bsa, olwr, ilwr, bbse)
-            if self.check_saveflag("net_rad"):
-                self.net_radiation.save(netrad_name)
+        self.net_radiation = self.get_product("net_rad", os.path.join(self.middle_dir, "net_rad.tif"),
+                                              lambda: fnbank.Num2(ibbswr, bsa, olwr, ilwr, bbse),
+                                              [ibbswr, bsa, olwr, ilwr, bbse])
         return self.net_radiation
 
     def get_soil_heat_flux(self, g_ratio):
-        shflux_name = "soil_hf.tif"
-        shflux_path = os.path.join(self.middle_dir, shflux_name)
-
-        if os.path.isfile(shflux_path) and not self.recalc:
-            self.soil_heat_flux = ras.raster_to_array(shflux_path)
-        else:
-            self.soil_heat_flux = self.net_radiation * g_ratio
-            if self.check_saveflag("soil_hf"):
-                self.soil_heat_flux.save(shflux_path)
-
+        net_radiation = self.net_radiation
+        self.soil_heat_flux = self.get_product("soil_hf", os.path.join(self.middle_dir, "soil_hf.tif"),
+                                               lambda: net_radiation * g_ratio, [net_radiation, g_ratio])
         return self.soil_heat_flux
 
     def get_wind_speed_weighting_coefficient(self):
@@ -858,7 +879,7 @@ class MetricModel:
         wcoeff = fnbank.Num36(self.dem_file, elev_wx)
 
         if self.check_saveflag("wcoeff"):
-            wcoeff.save("wcoeff_output.tif")
+            self.save_raster(wcoeff, os.path.join(self.middle_dir, "wcoeff_output.tif"))
         return wcoeff
 
     def get_T_s_datum(self, sfc_temp):
@@ -867,7 +888,7 @@ class MetricModel:
         T_s_datum = fnbank.Datum_Ref_Temp(sfc_temp, self.dem_file, elev_ts_datum)
 
         if self.check_saveflag("T_s_datum"):
-            T_s_datum.save(T_s_datum_path)
+            self.save_raster(T_s_datum, T_s_datum_path)
         return T_s_datum
 
     # this function appears to be unused? why?
@@ -889,7 +910,7 @@ class MetricModel:
         fric_vel = fnbank.Num31(ws_200m, zom)
 
         if self.check_saveflag("fric_vel"):
-            fric_vel.save(fric_vel_path)
+            self.save_raster(fric_vel, fric_vel_path)
         return fric_vel
 
     def get_aerodynamic_resistance(self, fric_vel):
@@ -899,10 +920,10 @@ class MetricModel:
         aero_res = fnbank.Num30(fric_vel)
 
         if self.check_saveflag("aero_res"):
-            aero_res.save(aero_res_path)
+            self.save_raster(aero_res, aero_res_path)
         return aero_res
 
-    def get_sensible_heat_flux(self, lai, wx_wind_speed, pressure, surface_temp, LEr, dem, slope):
+    def get_sensible_heat_flux(self, lai, wx_wind_speed, pressure, surface_temp, LEr, dem=None, slope=None):
         """
         iteratively solves for sensible heat flux
 
@@ -912,11 +933,21 @@ class MetricModel:
             p               atmospheric pressure (raster)
             surface_temp    temperature measured at the station?
             LEr             reference LE value.
+            dem             elevation (raster), the DEM of the model if None, which is then
+                            released once the last product needing it is computed
+            slope           slope (raster)
 
         This function was re-writen durring final code review.
         It is fairly complex so it prints nearly every variable for heads up sanity checking
+
+        The default "scene" mode iterates every pixel of the scene on every pass until a and b
+        converge, it does not leave settled pixels out and so reports no count of active
+        pixels per pass, see get_sensible_heat_flux_from_reference and
+        sensible_heat.solve_sensible_heat for the masked loop.
         """
         omega = None
+        if dem is None:
+            dem = self.dem_file
 
         print("========================= Sensible heat calculation: iteration 0 =========================")
         print("========================= Sensible heat calculation: iteration 0 =========================")
@@ -935,21 +966,41 @@ class MetricModel:
         else:
             zom = fnbank.Num33(lai)  # momentum roughness length (eq 33)
 
+        # the datum temperature and omega are the last consumers of the DEM
+        del dem
+        self.release_input("dem_file")
+
         LEr_factor = self.LE_cold_cal_factor  # grab reference cold calibration factor
         zom_wx = self.wx_zom  # grab guessed zom at station locationS
 
         print_stats(zom, "zom")
-        zom.save(os.path.join(self.middle_dir, "zom.tif"))
+        self.save_raster(zom, os.path.join(self.middle_dir, "zom.tif"))
+
+        if self.mountainous_terrain:
+            u200 = omega * fnbank.Num32(wx_wind_speed, zom_wx, z_wx)  # guess at assumed bending height
+        else:
+            u200 = fnbank.Num32(wx_wind_speed, zom_wx, z_wx)  # guess at assumed bending height
+
+        # the stability iteration runs in the precision of H, see metric.precision
+        zom, pressure, surface_temp, T_s_datum = self.precision.promote("H", zom, pressure, surface_temp, T_s_datum)
+
+        if self.sensible_heat_mode == "reference" or not self.solver.lagged:
+            return self.get_sensible_heat_flux_from_reference(u200, zom, pressure, surface_temp, T_s_datum,
+                                                              LEr * LEr_factor)
+
+        # flat indices of the reference pixels, rasterized from the shapefiles once
+        hot_index = self.get_ref_pixel_index("hot")
+        cold_index = self.get_ref_pixel_index("cold")
 
         # calculate sensible heat flux at reference locations (eq 47 and 48)
-        T_s_datum_hot = fnbank.ref_pix_mean(T_s_datum, self.hot_shape_path, self.hot_pixel_table)
-        T_s_datum_cold = fnbank.ref_pix_mean(T_s_datum, self.cold_shape_path, self.cold_pixel_table)
+        T_s_datum_hot = fnbank.ref_pix_mean(T_s_datum, hot_index)
+        T_s_datum_cold = fnbank.ref_pix_mean(T_s_datum, cold_index)
 
-        Rn_hot = fnbank.ref_pix_mean(self.net_radiation, self.hot_shape_path, self.hot_pixel_table)
-        Rn_cold = fnbank.ref_pix_mean(self.net_radiation, self.cold_shape_path, self.cold_pixel_table)
+        Rn_hot = fnbank.ref_pix_mean(self.net_radiation, hot_index)
+        Rn_cold = fnbank.ref_pix_mean(self.net_radiation, cold_index)
 
-        G_hot = fnbank.ref_pix_mean(self.soil_heat_flux, self.hot_shape_path, self.hot_pixel_table)
-        G_cold = fnbank.ref_pix_mean(self.soil_heat_flux, self.cold_shape_path, self.cold_pixel_table)
+        G_hot = fnbank.ref_pix_mean(self.soil_heat_flux, hot_index)
+        G_cold = fnbank.ref_pix_mean(self.soil_heat_flux, cold_index)
 
         LE_hot = 0
         LE_cold = LEr * LEr_factor
@@ -970,30 +1021,27 @@ class MetricModel:
         print_stats(H_cold, "H cold")
 
         # initial guesses for iteration
-        if self.mountainous_terrain:
-            u200 = omega * fnbank.Num32(wx_wind_speed, zom_wx, z_wx)  # guess at assumed bending height
-        else:
-            u200 = fnbank.Num32(wx_wind_speed, zom_wx, z_wx)  # guess at assumed bending height
-
         ustar = fnbank.Num31(u200, zom)  # guess at friction velocity (eq 31)
         rah = fnbank.Num30(ustar)  # guess at aerodynamic trans (eq 30)
         rho_air = fnbank.Num37(pressure, surface_temp, 0)  # guess at air density (eq 37)
 
-        if self.check_saveflag("ustar"):
-            ustar.save(os.path.join(self.middle_dir, "ustar_0.tif"))
-        if self.check_saveflag("rah"):
-            rah.save(os.path.join(self.middle_dir, "rah_0.tif"))
+        # the iterations kept of each variable are written as the bands of one raster
+        snapshots = IterationSnapshots(self.snapshots, self.middle_dir,
+                                       dict(self.raster_geo, data_type=gdal.GDT_Float32), self.solver.max_iter,
+                                       self.writer.write_function)
+        self.save_snapshot(snapshots, "ustar", 0, ustar)
+        self.save_snapshot(snapshots, "rah", 0, rah)
 
         print_stats(u200, "u200")
         print_stats(ustar, "ustar_0")
         print_stats(rah, "rah_0")
 
         # obtain reference values (hot and cold) for rah and rho variables
-        rah_hot = fnbank.ref_pix_mean(rah, self.hot_shape_path, self.hot_pixel_table)
-        rah_cold = fnbank.ref_pix_mean(rah, self.cold_shape_path, self.cold_pixel_table)
+        rah_hot = fnbank.ref_pix_mean(rah, hot_index)
+        rah_cold = fnbank.ref_pix_mean(rah, cold_index)
 
-        rho_air_hot = fnbank.ref_pix_mean(rho_air, self.hot_shape_path, self.hot_pixel_table)
-        rho_air_cold = fnbank.ref_pix_mean(rho_air, self.cold_shape_path, self.cold_pixel_table)
+        rho_air_hot = fnbank.ref_pix_mean(rho_air, hot_index)
+        rho_air_cold = fnbank.ref_pix_mean(rho_air, cold_index)
 
         print_stats(rah_hot, "rah hot")
         print_stats(rah_cold, "rah cold")
@@ -1026,8 +1074,12 @@ class MetricModel:
         # subsequent iteration to solve for all above variables
         i = 1
         converged = False
+        self.solver.reset()
+        psi = empty(L.shape, L.dtype), empty(L.shape, L.dtype), empty(L.shape, L.dtype)
 
-        while not converged and i < 1000:
+        while not converged and i < self.solver.max_iter:
+            start = time.time()
+            span = self.profiler.start("sensible heat iteration", iteration=i)
 
             print(
                 "========================= Sensible heat calculation: iteration {0} =========================".format(
@@ -1036,30 +1088,12 @@ class MetricModel:
                 "========================= Sensible heat calculation: iteration {0} =========================".format(
                     i))
 
-            # calculate psi200, psi2, psi01 stable and unstable
-            psi200u = fnbank.Num41(L)
-            psi2u = fnbank.Num42a(L)
-            psi01u = fnbank.Num42b(L)
-
-            psi200s = fnbank.Num44(L)
-            psi2s = fnbank.Num45a(L)
-            psi01s = fnbank.Num45b(L)
-
-            # aggregate the two (stable and unstable) with a Con statement for each height
-            if L.minimum < 0 and L.minimum != None:
-                print("combining unstable and stable psi's")
-                psi200 = arcpy.sa.Con(L, psi200u, psi200s, "VALUE < 0")
-                psi2 = arcpy.sa.Con(L, psi2u, psi2s, "VALUE < 0")
-                psi01 = arcpy.sa.Con(L, psi01u, psi01s, "VALUE < 0")
-            else:
-                psi200 = psi200s
-                psi2 = psi2s
-                psi01 = psi01s
-
-            if self.check_saveflag("psi"):
-                psi200.save(os.path.join(self.middle_dir, "psi200_{0}.tif".format(i)))
-                psi2.save(os.path.join(self.middle_dir, "psi2_{0}.tif".format(i)))
-                psi01.save(os.path.join(self.middle_dir, "psi01_{0}.tif".format(i)))
+            # calculate psi200, psi2, psi01, unstable where L < 0 and stable elsewhere
+            psi200, psi2, psi01 = shf.stability_corrections(L, out=psi)
+
+            self.save_snapshot(snapshots, "psi200", i, psi200, "psi")
+            self.save_snapshot(snapshots, "psi2", i, psi2, "psi")
+            self.save_snapshot(snapshots, "psi01", i, psi01, "psi")
 
             print_stats(psi200, "psi200_" + str(i))
             print_stats(psi2, "psi2_" + str(i))
@@ -1070,22 +1104,19 @@ class MetricModel:
             rah = fnbank.Num39(psi2, psi01, ustar)
             rho_air = fnbank.Num37(pressure, surface_temp, dT)
 
-            if self.check_saveflag("ustar"):
-                ustar.save(os.path.join(self.middle_dir, "ustar_{0}.tif".format(i)))
-            if self.check_saveflag("rah"):
-                rah.save(os.path.join(self.middle_dir, "rah_{0}.tif".format(i)))
-            if self.check_saveflag("rho_air"):
-                rho_air.save(os.path.join(self.middle_dir, "rho_air_{0}.tif".format(i)))
+            self.save_snapshot(snapshots, "ustar", i, ustar)
+            self.save_snapshot(snapshots, "rah", i, rah)
+            self.save_snapshot(snapshots, "rho_air", i, rho_air)
 
             print_stats(ustar, "ustar_{0}".format(i))
             print_stats(rah, "rah_{0}".format(i))
             print_stats(rho_air, "rho_air_{0}".format(i))
 
             # recalculate dT for reference pixels and adjust a and b accordingly.
-            rah_hot = fnbank.ref_pix_mean(rah, self.hot_shape_path, self.hot_pixel_table)
-            rah_cold = fnbank.ref_pix_mean(rah, self.cold_shape_path, self.cold_pixel_table)
-            rho_air_hot = fnbank.ref_pix_mean(rho_air, self.hot_shape_path, self.hot_pixel_table)
-            rho_air_cold = fnbank.ref_pix_mean(rho_air, self.cold_shape_path, self.cold_pixel_table)
+            rah_hot = fnbank.ref_pix_mean(rah, hot_index)
+            rah_cold = fnbank.ref_pix_mean(rah, cold_index)
+            rho_air_hot = fnbank.ref_pix_mean(rho_air, hot_index)
+            rho_air_cold = fnbank.ref_pix_mean(rho_air, cold_index)
 
             dT_hot = fnbank.Num46(Rn_hot, G_hot, rah_hot, rho_air_hot)
             dT_cold = fnbank.Num49(Rn_cold, G_cold, LE_cold, rah_cold, rho_air_cold)
@@ -1094,12 +1125,9 @@ class MetricModel:
             a_new = fnbank.Num50(dT_hot, dT_cold, T_s_datum_hot, T_s_datum_cold)
             b_new = fnbank.Num51(dT_hot, a, T_s_datum_hot)
 
-            if round(a_new / a, 4) == 1.0000 and round(b_new / b, 4) == 1.0000:
-                converged = True
-
-            # completely off-the-cuff damping attempt to speed up convergence
-            a = 0.6 * a + 0.4 * a_new
-            b = 0.6 * b + 0.4 * b_new
+            residual = self.solver.residual((a, b), (a_new, b_new))
+            converged = self.solver.converged(residual)
+            a, b = self.solver.step((a, b), (a_new, b_new))
 
             print_stats(a, "a_{0}".format(i))
             print_stats(b, "b_{0}".format(i))
@@ -1112,18 +1140,25 @@ class MetricModel:
             print_stats(H, "sensible heat, H_{0}".format(i))
             print_stats(L, "Monin-Obukhov length L_{0}".format(i))
 
-            if self.check_saveflag("dT") or converged:
-                dT.save(os.path.join(self.middle_dir, "dT_{0}.tif".format(i)))
-            if self.check_saveflag("H") or converged:
-                H.save(os.path.join(self.middle_dir, "H_{0}.tif".format(i)))
-            if self.check_saveflag("L") or converged:
-                L.save(os.path.join(self.middle_dir, "L_{0}.tif".format(i)))
+            self.save_snapshot(snapshots, "dT", i, dT)
+            self.save_snapshot(snapshots, "H", i, H)
+            self.save_snapshot(snapshots, "L", i, L)
+            if converged:
+                self.save_raster(dT, os.path.join(self.middle_dir, "dT_{0}.tif".format(i)))
+                self.save_raster(H, os.path.join(self.middle_dir, "H_{0}.tif".format(i)))
+                self.save_raster(L, os.path.join(self.middle_dir, "L_{0}.tif".format(i)))
 
             # add to the iteration counter
+            self.solver.record((a, b), residual, time.time() - start)
+            self.profiler.stop(span)
             i += 1
 
         print("Converged on solution to sensible heat after {0} iterations!".format(i))
         print("Converged on solution to sensible heat after {0} iterations!".format(i))
+        self.solver.write_log(os.path.join(self.out_dir, SOLVER_LOG))
+
+        for name, iterations in snapshots.close().items():
+            print("Saved {0} iterations {1} to {2}".format(name, iterations, snapshots.path(name)))
 
         self.sensible_heat_flux = H
 
@@ -1132,39 +1167,94 @@ class MetricModel:
 
         return self.sensible_heat_flux
 
+    def get_ref_pixel_index(self, which):
+        """
+        flat indices of the scene pixels inside the "hot" or "cold" reference shapefile
+
+        the shapefile is rasterized against the scene grid once, later calls reuse the index.
+        In a compressed model these are positions in the vectors of valid pixels.
+        """
+
+        if which not in self.ref_pixel_index:
+            shape_path = {"hot": self.hot_shape_path, "cold": self.cold_shape_path}[which]
+            index = flatnonzero(ras.rasterize_shapefile(shape_path, self.raster_geo))
+            if self.grid is not None:
+                index = self.grid.positions(index)
+            if not index.size:
+                raise Exception("no pixels of the scene fall inside the {0} reference shapefile!".format(which))
+            self.ref_pixel_index[which] = index
+
+        return self.ref_pixel_index[which]
+
+    def get_sensible_heat_flux_from_reference(self, u200, zom, pressure, surface_temp, T_s_datum, LE_cold):
+        """
+        solves sensible heat by calibrating a and b on the reference pixels only
+
+        The scene wide loop only needs the hot and cold pixels to move a and b, so those are
+        iterated to convergence on their own. The whole scene is then solved once with the
+        converged coefficients, each pixel iterating its own stability correction.
+        """
+
+        print("=================== Sensible heat calculation on reference pixels ===================")
+
+        inputs = {"u200": u200, "zom": zom, "pressure": pressure, "surface_temp": surface_temp,
+                  "T_s_datum": T_s_datum, "net_rad": self.net_radiation, "soil_hf": self.soil_heat_flux}
+
+        reference = {}
+        for name in ("hot", "cold"):
+            index = self.get_ref_pixel_index(name)
+            reference[name] = dict((key, fnbank.ref_pix_values(value, index)) for key, value in inputs.items())
+
+        history = shf.calibrate_coefficients(reference["hot"], reference["cold"], LE_cold, solver=self.solver)
+        self.solver.write_log(os.path.join(self.out_dir, SOLVER_LOG))
+        a, b = history[-1]
+        print_stats(a, "a value")
+        print_stats(b, "b value")
+
+        H, active = shf.solve_sensible_heat(a, b, u200, zom, pressure, surface_temp, T_s_datum)
+        print("Solved sensible heat for the scene in {0} passes, active pixels per pass: {1}".format(
+            len(active), ", ".join(str(n) for n in active)))
+        print_stats(H, "sensible heat, H")
+
+        if self.check_saveflag("H"):
+            self.save_raster(H, os.path.join(self.middle_dir, "H.tif"))
+
+        self.sensible_heat_flux = H
+        return self.sensible_heat_flux
+
     def get_latent_energy_consumed_by_ET(self):
         self.latent_energy = fnbank.Num1(self.net_radiation, self.soil_heat_flux, self.sensible_heat_flux)
 
         if self.check_saveflag("LE"):
-            self.latent_energy.save("LE.tif")
+            self.save_raster(self.latent_energy, os.path.join(self.out_dir, "LE.tif"))
         return self.latent_energy
 
     def get_latent_heat_vaporization(self, sfcTemp):
         self.latent_heat = fnbank.Num53(sfcTemp)
 
         if self.check_saveflag("LH_vapor"):
-            self.latent_heat.save("LH_vapor_output.tif")
+            self.save_raster(self.latent_heat, os.path.join(self.out_dir, "LH_vapor_output.tif"))
         return self.latent_heat
 
     def get_evapotranspiration_instant(self):
         self.ETinstant = fnbank.Num52(self.latent_energy)
 
         if self.check_saveflag("ET_inst"):
-            self.ETinstant.save("ET_inst.tif")
+            self.save_raster(self.ETinstant, os.path.join(self.out_dir, "ET_inst.tif"))
         return self.ETinstant
 
     def get_ET_fraction(self, ET_ref_hr):
         self.ET_fraction = fnbank.Num54(self.ETinstant, ET_ref_hr)
 
         if self.check_saveflag("ET_frac"):
-            self.ET_fraction.save("ET_frac.tif")
+            self.save_raster(self.ET_fraction, os.path.join(self.out_dir, "ET_frac.tif"))
         return self.ET_fraction
 
     def get_evapotranspiration_day(self, ET_ref_day):
         self.evapotranspiration_daily = fnbank.Num55(self.ET_fraction, ET_ref_day)
 
         if self.check_saveflag("ET_24hr"):
-            self.evapotranspiration_daily.save("ET_24hr.tif")
+            self.save_raster(self.evapotranspiration_daily, os.path.join(self.out_dir, "ET_24hr.tif"))
         return self.evapotranspiration_daily
 
 
@@ -1315,16 +1405,14 @@ def reference_calculation(longitude, latitude, earth_sun_distance, cloud_cover,
     return LE_reference, ET_ref_day, ET_ref_hr
 
 
-def run(config_filepath):
-    """
-    main function for calling and executing the metric model for a pre built configuration
+def get_scene_constants(mike):
     """
+    Calculates the scalar terms that are shared by every pixel of the scene
 
-    # take current system time
-    start_time = datetime.now()
-
-    # initialize MetricModel object named "mike"
-    mike = MetricModel(config_filepath)
+    sun geometry from the landsat metadata, weather at the time of overpass and the
+    reference ET values. The weather statistics are also written to the workspace.
+    returns a dict of named scalars.
+    """
 
     time = mike.get_time()
     longitude = mike.get_longitude()
@@ -1341,7 +1429,7 @@ def run(config_filepath):
     # get ugly list of reference variables from obsgrid data (legacy formating)
     temp_C_min, temp_C_max, temp_C_mid, P_air, wind_speed, dewp_C = extract_wx_data(mike.landsat_meta.datetime_obj,
                                                                                     mike.weather_path)
-    wx_save = ioconfig()
+    wx_save = IoConfig()
 
     # go ahead and write these obsgrid stats to a file in the workspace
     wx_save.add_param({"temp_min": temp_C_min,
@@ -1352,151 +1440,82 @@ def run(config_filepath):
                        "dewpoint": dewp_C})
     wx_save.write(os.path.join(mike.work_dir, "weather_stats.txt"))
 
-    # get reference values 
+    # get reference values
     LE_reference, ET_ref_day, ET_ref_hr = reference_calculation(longitude, latitude, earth_sun_distance, cloud_cover,
                                                                 doy,
                                                                 solar_declination_angle, decimal_time, temp_C_min,
                                                                 temp_C_max,
                                                                 temp_C_mid, P_air, wind_speed, dewp_C, crop, timezone)
 
-    # Calculate net radiation
-    slope = mike.get_slope()
-    aspect = mike.get_aspect()
-    solar_incidence_angle = mike.get_cosine_of_solar_incidence_angle(solar_declination_angle, latitude, slope, aspect,
-                                                                     hour_angle)
-    del aspect
-    del latitude
-    del solar_declination_angle
-
-    # get vegetation indices
-    reflectance_bands = mike.get_reflectance_band(solar_incidence_angle)
-    ####### For Band # use reflectance_bands[#-2]
-    SAVI = mike.get_SAVI(reflectance_bands[3], reflectance_bands[2])
-    NDVI = mike.get_NDVI(reflectance_bands[3], reflectance_bands[2])
-    LAI = mike.get_LAI(SAVI)
-
-    print_stats(SAVI, "SAVI")
-    print_stats(NDVI, "NDVI")
-    print_stats(LAI, "LAI")
-    del SAVI
-
-    # emissivitiies
-    broad_band_surface_emissivity = mike.get_broadband_surface_emissivity(LAI)
-    print_stats(broad_band_surface_emissivity, "broad band surface emissivity")
-
-    narrow_band_emissivity = mike.get_narrow_band_emissivity(LAI)
-    print_stats(narrow_band_emissivity, "narrow band emissivity")
-
-    atmospheric_pressure = mike.get_atmospheric_pressure()
-    print_stats(atmospheric_pressure, "atmospheric pressure")
-
-    vapor_pressure = mike.get_vapor_pressure(dewp_C)
-    print_stats(vapor_pressure, "vapor pressure")
-    print_stats(dewp_C, "dewpoint (C)")
-    del dewp_C
-
-    water_in_atmosphere = mike.get_water_in_the_atmosphere(vapor_pressure, atmospheric_pressure, P_air)
-    print_stats(water_in_atmosphere, "water in atmosphere")
-    del vapor_pressure
-    del P_air
-
-    entisr_bands = mike.get_effective_narrowband_trasmittance1(atmospheric_pressure, water_in_atmosphere,
-                                                               solar_incidence_angle)
-    print_stats(entisr_bands, "effective narrowband transmittance surface reflectance bands")
-
-    entsrrs_bands = mike.get_effective_narrowband_transmittance2(atmospheric_pressure, water_in_atmosphere)
-    print_stats(entsrrs_bands, "enb transmittance for shortwave radiation reflected")
-
-    pr_bands = mike.get_per_band_path_reflectance(entisr_bands)
-    print_stats(pr_bands, "per band path reflectance")
-
-    bbat = mike.get_broad_band_atmospheric_transmissivity(atmospheric_pressure, water_in_atmosphere,
-                                                          solar_incidence_angle)
-    print_stats(bbat, "broad band atmospheric transmissivity")
-    del water_in_atmosphere
-
-    ibbswr = mike.get_incoming_broad_band_short_wave_radiation(solar_incidence_angle, bbat, earth_sun_distance)
-    print_stats(ibbswr, "incoming broadband short wave radiation")
-    del solar_incidence_angle
-    del earth_sun_distance
-
-    asr_bands = mike.get_at_surface_reflectance(reflectance_bands, entisr_bands, entsrrs_bands, pr_bands)
-    print_stats(asr_bands, "at surface reflectance")
-    del pr_bands
-    del entsrrs_bands
-    del entisr_bands
-    del reflectance_bands
-
-    CI_TGI = mike.get_TGI(asr_bands[0], asr_bands[1], asr_bands[2])
-    print_stats(CI_TGI, "chlorophyll TGI")
-    del CI_TGI
-
-    bsa = mike.get_broadband_surface_albedo(asr_bands)
-    print_stats(bsa, "broadband surface albedo")
-    del asr_bands
-
-    eae = mike.get_effective_atmospheric_transmissivity(bbat)
-    print_stats(eae, "effective atmospheric transmissivity")
-    del bbat
-
-    surface_temperature = mike.get_surface_temperature(narrow_band_emissivity)
-    print_stats(surface_temperature, "surface temperature")
-    del narrow_band_emissivity
-
-    ilwr = mike.get_incoming_long_wave_radiation(eae, temp_C_mid)
-    print_stats(ilwr, "incoming long wave radiation")
-    del eae
-    del temp_C_mid
-
-    olwr = mike.get_outgoing_long_wave_radiation(broad_band_surface_emissivity, surface_temperature)
-    print_stats(olwr, "outgoing long wave radiation")
-
-    net_radiation = mike.get_net_radiation(ibbswr, bsa, olwr, ilwr, broad_band_surface_emissivity)
-    print_stats(net_radiation, "net radiation")
-    del olwr
-    del ilwr
-    del ibbswr
-    del broad_band_surface_emissivity
-    del net_radiation
-
-    # Calculate soil heat flux
-    g_ratio = mike.get_soil_heat_flux_to_net_radiation_ratio(bsa, surface_temperature, NDVI)
-    soil_heat_flux = mike.get_soil_heat_flux(g_ratio)
-    print_stats(g_ratio, "soil heat flux to net radiation ratio")
-    print_stats(soil_heat_flux, "soil heat flux")
-    del bsa
-    del NDVI
-    del g_ratio
-    del soil_heat_flux
-
-    # Calculate sensible heat flux
-    sensible_heat_flux = mike.get_sensible_heat_flux(LAI, wind_speed, atmospheric_pressure, surface_temperature,
-                                                     LE_reference, mike.dem_file, slope)
-
-    lhv = mike.get_latent_heat_vaporization(surface_temperature)
-    print_stats(sensible_heat_flux, "sensible heat flux")
-    print_stats(lhv, "latent heat of vaporization")
-
-    del surface_temperature
-    del atmospheric_pressure
-    del wind_speed
-    del LAI
-    del sensible_heat_flux
-    del lhv
-
-    # Calculate LE
-    lecet = mike.get_latent_energy_consumed_by_ET()
-    print_stats(lecet, "latent energy consumed by ET")
-
-    # calculate ETS
-    eti = mike.get_evapotranspiration_instant()
-    etf = mike.get_ET_fraction(ET_ref_hr)
-    etd = mike.get_evapotranspiration_day(ET_ref_day)
-    print_stats(eti, "evapotranspiration instant")
-    print_stats(etf, "et fraction")
-    print_stats(etd, "daily evapotranspiration")
-    del ET_ref_day
-    del ET_ref_hr
+    return {"latitude": latitude,
+            "earth_sun_distance": earth_sun_distance,
+            "solar_declination_angle": solar_declination_angle,
+            "hour_angle": hour_angle,
+            "temp_C_mid": temp_C_mid,
+            "P_air": P_air,
+            "wind_speed": wind_speed,
+            "dewp_C": dewp_C,
+            "LE_reference": LE_reference,
+            "ET_ref_day": ET_ref_day,
+            "ET_ref_hr": ET_ref_hr}
+
+
+def run(config_filepath, tile_size=None, workers=None, executor="thread", sensible_heat_mode="scene", solver=None,
+        outputs=None, precision="float32", compressed=False, mask_path=None, mask_bits=None, snapshots=None,
+        trace=False, terrain_cache=None, clip_path=None, store=False):
+    """
+    main function for calling and executing the metric model for a pre built configuration
+
+    with a tile_size the scene is streamed through windows of about tile_size pixels
+    so that memory scales with the tile rather than the scene, see metric.tiled.
+    workers runs those tiles in parallel. sensible_heat_mode, solver, precision, compressed, mask_path,
+    mask_bits, snapshots, terrain_cache, clip_path and store are passed on to MetricModel.
+
+    outputs lists the products wanted from an in memory run, e.g. ["ndvi", "sfcTemp"], see
+    metric.product_graph. Only they and their ancestors are computed, and they are left in
+    mike.products. By default these are the products the save flag asks for.
+
+    The time and memory of every stage are written to run_report.json in the workspace,
+    with trace=True also as a Chrome trace, see metric.profiler.
+    """
+
+    # take current system time
+    start_time = datetime.now()
+
+    # initialize MetricModel object named "mike"
+    mike = MetricModel(config_filepath, tile_size=tile_size, workers=workers, executor=executor,
+                       sensible_heat_mode=sensible_heat_mode, solver=solver, precision=precision,
+                       compressed=compressed, mask_path=mask_path, mask_bits=mask_bits,
+                       snapshots=snapshots, terrain_cache=terrain_cache, clip_path=clip_path, store=store)
+
+    with mike.profiler.span("get_scene_constants"):
+        constants = get_scene_constants(mike)
+
+    if mike.tile_size is not None:
+        from metric.tiled import run_tiled
+        run_tiled(mike, constants)
+        with mike.profiler.span("writer.close"):
+            mike.writer.close()
+            mike.close_store()
+            mike.cache.flush()
+            mike.inputs.flush()
+        print_write_summary(mike.writer.summary())
+        write_run_report(mike, trace)
+
+        finish_time = datetime.now()
+        elapsed_time = finish_time - start_time
+        print("Finished in {0} minutes!".format(elapsed_time.total_seconds() / 60))
+        return mike
+
+    # only the requested products and their ancestors are computed
+    mike.products = ProductGraph(mike, constants).evaluate(outputs)
+    with mike.profiler.span("writer.close"):
+        mike.writer.close()
+        mike.close_store()
+        mike.cache.flush()
+        mike.inputs.flush()
+    print_write_summary(mike.writer.summary())
+    write_run_report(mike, trace)
 
     # take finishing time and print it
     finish_time = datetime.now()
@@ -1509,6 +1528,30 @@ def run(config_filepath):
     return mike
 
 
+def write_run_report(mike, trace=False):
+    """ writes the profile of a run to the workspace and prints its slowest stages"""
+
+    path = mike.profiler.write_report(os.path.join(mike.work_dir, REPORT_FILE),
+                                      writer=mike.writer.summary(), solver_iterations=mike.solver.iterations,
+                                      settings={"tile_size": mike.tile_size, "workers": mike.workers,
+                                                "executor": mike.executor, "precision": mike.precision.dtype.name,
+                                                "compressed": mike.compressed,
+                                                "sensible_heat_mode": mike.sensible_heat_mode})
+    if trace:
+        mike.profiler.write_trace(os.path.join(mike.work_dir, TRACE_FILE))
+
+    print("Slowest stages, see {0}".format(path))
+    for stage in mike.profiler.summary()[:5]:
+        print("    {name:<50} {calls:>4} calls {wall_seconds:8.2f} s wall {cpu_seconds:8.2f} s cpu".format(**stage))
+
+
+def print_write_summary(summary):
+    """ prints the rasters written by a run and the time spent on it, see raster_tools.RasterWriter.summary"""
+
+    print("Wrote {files} rasters, {0:.1f} MB, in {write_seconds:.1f} s on the writer thread, "
+          "the model waited {wait_seconds:.1f} s on it".format(summary["bytes"] / 2. ** 20, **summary))
+
+
 # scratch area to run multiple metric models
 if __name__ == "__main__":
     pass
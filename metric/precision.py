@@ -0,0 +1,70 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Floating point precision policy of the METRIC pipeline.
+
+Landsat bands are read in their native integer type and only become floating point when
+they are converted to reflectance or radiance. Every physical intermediate is then held
+in the working precision, float32 by default, which halves the memory and the memory
+traffic of a scene compared to float64. The few products whose equations are sensitive
+to rounding are computed in float64 whatever the working precision.
+"""
+
+import numpy as np
+
+# computed in float64 in every mode, bbat is the exponential of equation 4 and H the
+# stability iteration of the sensible heat flux, which feeds the a and b calibration
+DOUBLE_PRECISION_PRODUCTS = ("bbat", "H")
+
+
+class PrecisionPolicy(object):
+    def __init__(self, dtype="float32", double=DOUBLE_PRECISION_PRODUCTS):
+        """
+        dtype           working precision of the intermediate products
+        double          names of the products always computed in float64
+        """
+
+        self.dtype = np.dtype(dtype)
+        if self.dtype.kind != "f":
+            raise ValueError("precision must be a floating point type, not {0}".format(self.dtype))
+        self.double = frozenset(double)
+
+    def dtype_for(self, name):
+        """ precision of the product name"""
+
+        if name in self.double:
+            return np.dtype(np.float64)
+        return self.dtype
+
+    def cast(self, name, product):
+        """ product, or every band of a list of products, in the precision of name"""
+
+        if isinstance(product, list):
+            return [self.cast(name, band) for band in product]
+        if isinstance(product, np.ndarray) and product.dtype != self.dtype_for(name):
+            return product.astype(self.dtype_for(name))
+        return product
+
+    def promote(self, name, *arrays):
+        """ the inputs of product name, cast so that its arithmetic runs in its own precision"""
+
+        return [self.cast(name, array) for array in arrays]
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -1,66 +1,43 @@
 __author__ = 'jwely'
 
 import os
-import shutil
-
-import arcpy
 
 from metric import textio
-
-arcpy.CheckOutExtension("Spatial")
-arcpy.env.overwriteOutput = True
+from metric.input_manifest import COPY, InputManifest
 
 
-def copyfile(path, dest_dir, workspace = ""):
+def copyfile(path, dest_dir, manifest, mode = COPY):
     """
     path      the full filepath to a file
-    dest_dir  destination for copy
-    returns   the full filepath of the new destination
-
-    removes the workspace from the filepath to give a
-    workspace relative filepath.
+    dest_dir  destination for copy, relative to the workspace of manifest
+    manifest  input_manifest.InputManifest of the workspace, records the file
+    mode      "copy", "link" or "reference", see input_manifest.InputManifest.add
+    returns   the filepath to record in the config, relative to the workspace
+              unless the file is only referenced
     """
 
     if os.path.isfile(path):
 
-        head, tail = os.path.split(path)
-        destination = os.path.join(workspace, dest_dir, tail)
-
-        if not os.path.isfile(destination):
-            shutil.copy(path, destination)
-            print("Added {0}".format(destination))
-        else:
-            print("Found {0}".format(destination))
-
-        return destination.replace(workspace + "\\", "")
+        recorded = manifest.add(path, dest_dir, mode)
+        print("Added {0}".format(recorded))
+        return recorded
 
     else:
         print("{0} is an invalid filepath!".format(path))
         return None
 
 
-def clip_inputs(raster, shapefile, outpath):
-    """
-    uses arcpy to clip a raster to an input shapefile, used for reducing the calculation area.
-    """
-
-    print("Clipped and added {0}".format(outpath))
-    arcpy.Clip_management(raster, "#", outpath, shapefile, "ClippingGeometry")
-    out = arcpy.sa.Float(arcpy.sa.ExtractByMask(outpath, shapefile))
-    out.save(outpath)
-    return outpath
-
-
 def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, landsat_band5,
                        landsat_band6, landsat_band7, landsat_band10, landsat_band11, landsat_metapath,
                        dem_path, hot_shape_path, cold_shape_path, wx_filepath, testflag = None,
                        recalc = None, crop_type = None, wx_elev = None,
                        wx_zom = None, LE_cold_cal_factor = None, mountains = None, L_green_fac = None,
-                       clip_extent = None):
+                       clip_extent = None, cache_max_gb = None, input_mode = COPY, terrain_cache_dir = None):
     """
     Saves a config file with all required attributes of this metric model, also copies
     the source data files into the template structure for good record keeping. all stored
-    filepaths are relative to "workspace"
+    filepaths are relative to "workspace", except those of inputs only referenced.
+    Every input is recorded in the input manifest of the workspace, see metric.input_manifest
 
     workspace:              fresh folder to populate with the many metric model files and parameters
     landsat_filepath_list:  list of landsat band tiff filepaths, MUST be in order [2,3,4,5,6,7,10,11]
@@ -78,6 +55,16 @@ def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, l
     LE_cold_cal_factor      used to calibrate LE terms. This should probably always be = 1.05
     mountains               will be either True or False, defaults to False.
     L_green_fac             reference L factor for calculating SAVI (0.1 for Idaho, 0.5 for NorthCarolina)
+    clip_extent             shapefile of the study area, the model reads the window of the scene covering
+                                it and computes the pixels inside its polygons only, see MetricModel
+    cache_max_gb            disk space allowed to the cache of intermediate products, which reruns
+                                with other parameters reuse. Defaults to 0, no cache
+    input_mode              "copy" copies the inputs into the workspace, "link" hard links them and
+                                "reference" records them where they are. Both of the latter take no
+                                disk space, the manifest lets the model check the inputs did not change
+    terrain_cache_dir       directory shared by the workspaces of a path/row where the slope and solar
+                                incidence terms of the DEM are kept, see terrain.TerrainCache. None
+                                computes them in memory on every run
     """
 
     # set default values if they are still None
@@ -107,15 +94,8 @@ def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, l
     if L_green_fac is None:
         L_green_fac = 0.5
 
-
-    # first copy the template "empty metric model" structure
-    if not os.path.isdir(workspace):
-        live_path = os.path.realpath(__file__)
-        head, tail = os.path.split(live_path)
-        template_path = os.path.join(head, "Empty_Metric_Model")
-        shutil.copytree(template_path, workspace)
-    else:
-        raise Exception("input workspace must be a directory that does not already exist! one will be created here!")
+    if cache_max_gb is None:
+        cache_max_gb = 0
 
 
     # set other inferred attributes of the working directory structure
@@ -128,54 +108,57 @@ def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, l
     geodatabase    = "scratch"
 
 
+    # first build the "empty metric model" structure
+    if not os.path.isdir(workspace):
+        for directory in [out_dir, middle_dir, ref_pixel_dir, landsat_dir, weather_dir, dem_dir, geodatabase]:
+            os.makedirs(os.path.join(workspace, directory))
+    else:
+        raise Exception("input workspace must be a directory that does not already exist! one will be created here!")
+
+    manifest = InputManifest(workspace)
+
+
     # move the landsat data and set the new path attributes
-    landsat_metapath = copyfile(landsat_metapath, landsat_dir, workspace)
+    landsat_metapath = copyfile(landsat_metapath, landsat_dir, manifest, input_mode)
 
     bands = [landsat_band2, landsat_band3, landsat_band4, landsat_band5,
                  landsat_band6, landsat_band7, landsat_band10, landsat_band11]
 
     for i,band in enumerate(bands):
 
-        if clip_extent is None:
-            if os.path.exists(band + ".ovr"):
-                copyfile(band + ".ovr", landsat_dir, workspace)
-            bands[i] = copyfile(band, landsat_dir, workspace)
-
-        else:
-            copyfile(band + ".ovr", landsat_dir, workspace)
-            bands[i]= os.path.join(workspace, landsat_dir, os.path.basename(band))
-            clip_inputs(band, clip_extent, bands[i])
+        if os.path.exists(band + ".ovr"):
+            copyfile(band + ".ovr", landsat_dir, manifest, input_mode)
+        bands[i] = copyfile(band, landsat_dir, manifest, input_mode)
 
 
     # move the DEM and associated files
     for demfile in [dem_path + ext for ext in [".ovr", ".aux.xml", ".xml"]]:
         if os.path.exists(demfile):
-            copyfile(dem_path + ".ovr", dem_dir, workspace)
+            copyfile(demfile, dem_dir, manifest, input_mode)
     if os.path.exists(dem_path.replace(".tif", ".tfw")):
-        copyfile(dem_path.replace(".tif", ".tfw"), dem_dir, workspace)
+        copyfile(dem_path.replace(".tif", ".tfw"), dem_dir, manifest, input_mode)
 
-    if clip_extent is None:
-        dem_path = copyfile(dem_path, dem_dir, workspace)
-    else:
-        outpath = os.path.join(workspace, dem_dir, os.path.basename(dem_path))
-        dem_path = clip_inputs(dem_path, clip_extent, outpath)
+    # the inputs are clipped on read by the model, see clip_extent
+    dem_path = copyfile(dem_path, dem_dir, manifest, input_mode)
 
 
     # moves the shapefiles for hot and cold pixels, and clip extent.
     extensions = [".cpg", ".dbf", ".prj", ".sbn", ".sbx", ".shx", ".shp"]
 
+    # the .shp goes last, so that the paths recorded are those next to the side car files
     for extension in extensions:
-        copyfile(hot_shape_path.replace(".shp", extension), ref_pixel_dir, workspace)
-        copyfile(cold_shape_path.replace(".shp", extension), ref_pixel_dir, workspace)
+        hot = copyfile(hot_shape_path.replace(".shp", extension), ref_pixel_dir, manifest, input_mode)
+        cold = copyfile(cold_shape_path.replace(".shp", extension), ref_pixel_dir, manifest, input_mode)
         if clip_extent is not None:
-            copyfile(clip_extent.replace(".shp", extension), dem_dir, workspace)
+            clip = copyfile(clip_extent.replace(".shp", extension), dem_dir, manifest, input_mode)
 
-    #hot_shape_path = copyfile(hot_shape_path, ref_pixel_dir, workspace)
-    #cold_shape_path = copyfile(cold_shape_path, ref_pixel_dir, workspace)
-    #clip_extent = copyfile(clip_extent, dem_dir, workspace)
+    hot_shape_path, cold_shape_path = hot, cold
+    if clip_extent is not None:
+        clip_extent = clip
 
     # move the obsgrid data
-    wx_filepath = copyfile(wx_filepath, weather_dir, workspace)
+    wx_filepath = copyfile(wx_filepath, weather_dir, manifest, input_mode)
+    manifest.write()
 
 
     # create the config file
@@ -202,6 +185,7 @@ def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, l
               "landsat_band11"  : bands[7],
 
               "dem_path"        : dem_path,
+              "vrt_path"        : dem_path,
               "hot_shp_path"    : hot_shape_path,
               "cold_shp_path"   : cold_shape_path,
               "weather_path"    : wx_filepath,
@@ -215,9 +199,11 @@ def prepare_metric_env(workspace, landsat_band2, landsat_band3, landsat_band4, l
               "L_green_fac"     : L_green_fac,
               "testflag"        : testflag,
               "recalc"          : recalc,
-              "clip_extent"     : clip_extent}
+              "cache_max_gb"    : cache_max_gb,
+              "clip_extent"     : clip_extent,
+              "terrain_cache_dir": terrain_cache_dir}
 
-    config = textio.ioconfig()
+    config = textio.IoConfig()
     config.add_param(cdict)
     config.write(os.path.join(workspace, config_filepath))
     config.read(os.path.join(workspace, config_filepath))
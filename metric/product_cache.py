@@ -0,0 +1,233 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Content addressed cache of the intermediate products of MetricModel.
+
+Every product is stored under a key that hashes its name and everything it was built
+from: input files by content, scalars by value and upstream products by their own keys.
+A product is therefore reused only when all of its inputs are unchanged, and changing
+one input (say the cold pixel calibration factor) leaves everything upstream of it valid.
+
+When a product is rebuilt under a new key the old entry is dropped together with every
+entry that was built from it. The cache is bounded by total size and entry count, least
+recently used entries are evicted first. The index is only written by flush(), once per
+run, the products themselves as they are stored.
+"""
+
+import hashlib
+import json
+import os
+import weakref
+
+import numpy as np
+
+# bump when the equations change, so products built by older code are not reused
+CACHE_VERSION = 1
+
+
+class ProductCache(object):
+    index_name = "index.json"
+
+    def __init__(self, cache_dir, max_bytes=None, max_entries=None):
+        """
+        cache_dir       directory holding one .npy file per product and the index
+        max_bytes       upper bound on the summed size of the cached products
+        max_entries     upper bound on the number of cached products
+        """
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.index_path = os.path.join(cache_dir, self.index_name)
+        self.index = {"clock": 0, "products": {}, "files": {}}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+        # keys of the arrays handed out or stored by this cache, by id
+        self._registry = {}
+        self._dirty = False
+
+    # keys ---------------------------------------------------------------------------
+    def file_key(self, path):
+        """ sha1 of the contents of a file, only recomputed when its size or mtime changes"""
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime]
+
+        entry = self.index["files"].get(path)
+        if entry is not None and entry["signature"] == signature:
+            return entry["sha1"]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        self.index["files"][path] = {"signature": signature, "sha1": digest.hexdigest()}
+        self._dirty = True
+        return digest.hexdigest()
+
+    def register(self, value, key):
+        """
+        remembers that value is described by key, e.g. a band read from a file
+
+        key may be a function returning the key, it is then only called when the key is needed
+        """
+
+        self._registry[id(value)] = (weakref.ref(value), key)
+        return value
+
+    def key_of(self, value):
+        """ a json friendly description of an input value"""
+
+        known = self._registry.get(id(value))
+        if known is not None and known[0]() is value:
+            if callable(known[1]):
+                self._registry[id(value)] = known = (known[0], known[1]())
+            return known[1]
+
+        if isinstance(value, np.ndarray):
+            # not seen before, fall back on hashing the contents
+            data = np.ascontiguousarray(value)
+            digest = hashlib.sha1(data.view(np.uint8))
+            digest.update(repr((data.dtype.str, data.shape)).encode())
+            return "array:" + digest.hexdigest()
+        if isinstance(value, (list, tuple)):
+            return [self.key_of(v) for v in value]
+        if isinstance(value, np.generic):
+            value = value.item()
+        return repr(value)
+
+    def product_key(self, name, inputs=()):
+        """ key of the product name built from inputs"""
+
+        description = [CACHE_VERSION, name, [self.key_of(value) for value in inputs]]
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    # storage ------------------------------------------------------------------------
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def flush(self):
+        """ writes the index if it changed, entries stored since the last flush are lost without it"""
+
+        if not self._dirty:
+            return
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.rename(tmp_path, self.index_path)
+        self._dirty = False
+
+    def _touch(self, entry):
+        self.index["clock"] += 1
+        entry["last_used"] = self.index["clock"]
+        self._dirty = True
+
+    def load(self, key):
+        """ returns the product stored under key, or None"""
+
+        entry = self.index["products"].get(key)
+        if entry is None:
+            return None
+        if not os.path.isfile(self._path(key)):
+            self.invalidate(key)
+            return None
+
+        product = np.load(self._path(key))
+        self._touch(entry)
+        return self.register(product, key)
+
+    def store(self, name, key, product, inputs=()):
+        """
+        stores product under key, drops older versions of name and everything built from them
+
+        inputs are the inputs the key was built from, used to track downstream products
+        """
+
+        for old_key, entry in list(self.index["products"].items()):
+            if entry["name"] == name and old_key != key:
+                self.invalidate(old_key)
+
+        np.save(self._path(key), product)
+        upstream = [k for k in _flatten([self.key_of(value) for value in inputs]) if k in self.index["products"]]
+        entry = {"name": name, "bytes": os.path.getsize(self._path(key)), "inputs": upstream}
+        self.index["products"][key] = entry
+        self._touch(entry)
+
+        self.evict(keep=key)
+        return self.register(product, key)
+
+    def invalidate(self, key):
+        """ removes the entry key and, recursively, every entry built from it"""
+
+        entry = self.index["products"].pop(key, None)
+        if entry is None:
+            return
+        self._dirty = True
+        if os.path.isfile(self._path(key)):
+            os.remove(self._path(key))
+        for other_key, other in list(self.index["products"].items()):
+            if key in other["inputs"]:
+                self.invalidate(other_key)
+
+    def size(self):
+        return sum(entry["bytes"] for entry in self.index["products"].values())
+
+    def evict(self, keep=None):
+        """ drops least recently used entries until the cache is within its bounds"""
+
+        def over():
+            products = self.index["products"]
+            too_big = self.max_bytes is not None and self.size() > self.max_bytes
+            too_many = self.max_entries is not None and len(products) > self.max_entries
+            return too_big or too_many
+
+        while over():
+            candidates = [(entry["last_used"], key) for key, entry in self.index["products"].items() if key != keep]
+            if not candidates:
+                break
+            key = min(candidates)[1]
+            entry = self.index["products"].pop(key)
+            self._dirty = True
+            if os.path.isfile(self._path(key)):
+                os.remove(self._path(key))
+
+    def clear(self):
+        for key in list(self.index["products"]):
+            self.invalidate(key)
+        self.flush()
+
+
+def _flatten(keys):
+    for key in keys:
+        if isinstance(key, list):
+            for k in _flatten(key):
+                yield k
+        else:
+            yield key
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
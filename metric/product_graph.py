@@ -0,0 +1,201 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+The METRIC run as a dependency graph of named products.
+
+Every product is computed by one MetricModel getter from other products and from the
+scalars of metric_py.get_scene_constants. Asking the graph for a few outputs computes
+only their ancestors, in dependency order, and drops each intermediate as soon as the
+last product that needs it has been computed. A quick look NDVI never reaches the energy
+balance. Product names match MetricModel.check_saveflag.
+"""
+
+from metric.function_bank import print_stats
+
+# scalars of the scene, supplied by metric_py.get_scene_constants
+CONSTANTS = ("latitude", "earth_sun_distance", "solar_declination_angle", "hour_angle", "temp_C_mid", "P_air",
+             "wind_speed", "dewp_C", "LE_reference", "ET_ref_day", "ET_ref_hr")
+
+# MetricModel attributes that the later getters read instead of taking arguments, or that
+# the getters keep their product in, reset when the product is released
+ATTRIBUTES = {"asr": "ls_surface_reflectances",
+              "net_rad": "net_radiation",
+              "soil_hf": "soil_heat_flux",
+              "H": "sensible_heat_flux",
+              "LE": "latent_energy",
+              "LH_vapor": "latent_heat",
+              "ET_inst": "ETinstant",
+              "ET_frac": "ET_fraction",
+              "ET_24hr": "evapotranspiration_daily"}
+
+
+def _with_attributes(getter, *names):
+    """ wraps getter so that the products named are set on the model before it is called"""
+
+    def compute(mike, *args):
+        for name, value in zip(names, args):
+            setattr(mike, ATTRIBUTES[name], value)
+        return getter(mike, *args[len(names):])
+
+    return compute
+
+
+# product name: (inputs, function of the model and the inputs, description)
+PRODUCTS = {
+    "slope": ((), lambda m: m.get_slope(), "slope"),
+    "aspect": ((), lambda m: m.get_aspect(), "aspect"),
+    "sia": (("solar_declination_angle", "latitude", "hour_angle"),
+            lambda m, *args: m.get_cosine_of_solar_incidence_angle(*args), "cosine of solar incidence angle"),
+    "LS_ref": (("sia",), lambda m, sia: m.get_reflectance_band(sia), "reflectance bands"),
+    "savi": (("LS_ref",), lambda m, refl: m.get_SAVI(refl[3], refl[2]), "SAVI"),
+    "ndvi": (("LS_ref",), lambda m, refl: m.get_NDVI(refl[3], refl[2]), "NDVI"),
+    "lai": (("savi",), lambda m, savi: m.get_LAI(savi), "LAI"),
+    "bbse": (("lai",), lambda m, lai: m.get_broadband_surface_emissivity(lai), "broad band surface emissivity"),
+    "nbe": (("lai",), lambda m, lai: m.get_narrow_band_emissivity(lai), "narrow band emissivity"),
+    "sfcTemp": (("nbe",), lambda m, nbe: m.get_surface_temperature(nbe), "surface temperature"),
+    "p": ((), lambda m: m.get_atmospheric_pressure(), "atmospheric pressure"),
+    "e_a": (("dewp_C",), lambda m, dewp_C: m.get_vapor_pressure(dewp_C), "vapor pressure"),
+    "w": (("e_a", "p", "P_air"), lambda m, *args: m.get_water_in_the_atmosphere(*args), "water in atmosphere"),
+    "entisr": (("p", "w", "sia"), lambda m, *args: m.get_effective_narrowband_trasmittance1(*args),
+               "effective narrowband transmittance surface reflectance bands"),
+    "entsrrs": (("p", "w"), lambda m, *args: m.get_effective_narrowband_transmittance2(*args),
+                "enb transmittance for shortwave radiation reflected"),
+    "pr": (("entisr",), lambda m, entisr: m.get_per_band_path_reflectance(entisr), "per band path reflectance"),
+    "bbat": (("p", "w", "sia"), lambda m, *args: m.get_broad_band_atmospheric_transmissivity(*args),
+             "broad band atmospheric transmissivity"),
+    "ibbswr": (("sia", "bbat", "earth_sun_distance"),
+               lambda m, *args: m.get_incoming_broad_band_short_wave_radiation(*args),
+               "incoming broadband short wave radiation"),
+    "asr": (("LS_ref", "entisr", "entsrrs", "pr"), lambda m, *args: m.get_at_surface_reflectance(*args),
+            "at surface reflectance"),
+    "TGI": (("asr",), lambda m, asr: m.get_TGI(asr[0], asr[1], asr[2]), "chlorophyll TGI"),
+    "bsa": (("asr",), lambda m, asr: m.get_broadband_surface_albedo(asr), "broadband surface albedo"),
+    "eae": (("bbat",), lambda m, bbat: m.get_effective_atmospheric_transmissivity(bbat),
+            "effective atmospheric transmissivity"),
+    "ilwr": (("eae", "temp_C_mid"), lambda m, *args: m.get_incoming_long_wave_radiation(*args),
+             "incoming long wave radiation"),
+    "olwr": (("bbse", "sfcTemp"), lambda m, *args: m.get_outgoing_long_wave_radiation(*args),
+             "outgoing long wave radiation"),
+    "net_rad": (("ibbswr", "bsa", "olwr", "ilwr", "bbse"), lambda m, *args: m.get_net_radiation(*args),
+                "net radiation"),
+    "g_ratio": (("bsa", "sfcTemp", "ndvi"), lambda m, *args: m.get_soil_heat_flux_to_net_radiation_ratio(*args),
+                "soil heat flux to net radiation ratio"),
+    "soil_hf": (("net_rad", "g_ratio"), _with_attributes(lambda m, g_ratio: m.get_soil_heat_flux(g_ratio), "net_rad"),
+                "soil heat flux"),
+    "H": (("net_rad", "soil_hf", "lai", "wind_speed", "p", "sfcTemp", "LE_reference", "slope"),
+          _with_attributes(lambda m, lai, wind_speed, p, sfc_temp, LEr, slope:
+                           m.get_sensible_heat_flux(lai, wind_speed, p, sfc_temp, LEr, slope=slope),
+                           "net_rad", "soil_hf"),
+          "sensible heat flux"),
+    "LH_vapor": (("sfcTemp",), lambda m, sfc_temp: m.get_latent_heat_vaporization(sfc_temp),
+                 "latent heat of vaporization"),
+    "LE": (("net_rad", "soil_hf", "H"),
+           _with_attributes(lambda m: m.get_latent_energy_consumed_by_ET(), "net_rad", "soil_hf", "H"),
+           "latent energy consumed by ET"),
+    "ET_inst": (("LE",), _with_attributes(lambda m: m.get_evapotranspiration_instant(), "LE"),
+                "evapotranspiration instant"),
+    "ET_frac": (("ET_inst", "ET_ref_hr"), _with_attributes(lambda m, ET_ref_hr: m.get_ET_fraction(ET_ref_hr),
+                                                           "ET_inst"),
+                "et fraction"),
+    "ET_24hr": (("ET_frac", "ET_ref_day"), _with_attributes(lambda m, ET_ref_day: m.get_evapotranspiration_day(
+        ET_ref_day), "ET_frac"), "daily evapotranspiration")}
+
+
+class ProductGraph(object):
+    def __init__(self, mike, constants, products=None):
+        """
+        mike            a MetricModel with the scene held in memory
+        constants       dict of the scene scalars, see CONSTANTS
+        products        graph to evaluate, defaults to PRODUCTS
+        """
+
+        self.mike = mike
+        self.constants = constants
+        self.products = products or PRODUCTS
+
+    def default_outputs(self):
+        """ the products the save flag of the model asks for, and the daily ET"""
+
+        return [name for name in sorted(self.products)
+                if name == "ET_24hr" or self.mike.check_saveflag(name)]
+
+    def schedule(self, outputs):
+        """ outputs and all of their ancestors, each after all of its inputs"""
+
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order or name in self.constants:
+                return
+            if name not in self.products:
+                raise ValueError("unknown product {0}".format(name))
+            if name in visiting:
+                raise ValueError("product {0} depends on itself".format(name))
+
+            visiting.add(name)
+            for dependency in self.products[name][0]:
+                visit(dependency)
+            visiting.remove(name)
+            order.append(name)
+
+        for output in outputs:
+            visit(output)
+        return order
+
+    def evaluate(self, outputs=None):
+        """
+        computes outputs, defaulting to default_outputs(), and returns them in a dict
+
+        intermediates are released as soon as the last product that needs them is done
+        """
+
+        if outputs is None:
+            outputs = self.default_outputs()
+
+        order = self.schedule(outputs)
+        consumers = dict((name, 0) for name in order)
+        for name in order:
+            for dependency in self.products[name][0]:
+                if dependency in consumers:
+                    consumers[dependency] += 1
+
+        values = dict(self.constants)
+        for name in order:
+            inputs, compute, description = self.products[name]
+            values[name] = compute(self.mike, *[values[i] for i in inputs])
+            print_stats(values[name], description)
+
+            for dependency in inputs:
+                if dependency in consumers:
+                    consumers[dependency] -= 1
+                    if consumers[dependency] == 0 and dependency not in outputs:
+                        self.release(dependency, values)
+
+        return dict((name, values[name]) for name in outputs)
+
+    def release(self, name, values):
+        """ drops the graph's and the model's references to product name"""
+
+        del values[name]
+        if name in ATTRIBUTES:
+            setattr(self.mike, ATTRIBUTES[name], 0)
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
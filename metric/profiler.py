@@ -0,0 +1,218 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Timing and memory instrumentation of a METRIC run.
+
+RunProfiler records a span around every MetricModel getter, every iteration of the sensible
+heat loop and the passes of a tiled run. Each span holds its wall and CPU time, how much
+the peak resident memory grew, the bytes the process read and wrote, and the arrays the
+getter returned. The spans are written as a JSON run report and, optionally, as a Chrome
+trace to open in chrome://tracing or Perfetto.
+
+CPU time, memory and IO are those of the whole process, the background raster writer
+included, and IO counts the bytes passed to read and write calls, not the pages of
+memory mapped rasters. Spans nest, a getter includes the getters it calls. The spans of a
+worker process are those of that process, sent back to the run with merge.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+# written to the workspace by metric_py.run, next to weather_stats.txt
+REPORT_FILE = "run_report.json"
+TRACE_FILE = "run_trace.json"
+
+
+def _io_counters():
+    """ (bytes read, bytes written) by the process so far, (None, None) without /proc"""
+
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (IOError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss():
+    """ peak resident memory of the process in bytes"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _arrays(value):
+    """ (count, bytes) of the numpy arrays in value, an array or a list, tuple or dict of them"""
+
+    if isinstance(value, np.ndarray):
+        return 1, int(value.nbytes)
+    if isinstance(value, dict):
+        return _arrays(list(value.values()))
+    if isinstance(value, (list, tuple)):
+        counts = [_arrays(v) for v in value]
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+    return 0, 0
+
+
+def _difference(end, start):
+    return None if end is None or start is None else end - start
+
+
+class RunProfiler(object):
+    def __init__(self, enabled=True):
+        """ enabled=False records nothing, wrap and instrument leave the functions as they are"""
+
+        self.enabled = enabled
+        self.origin = time.time()
+        self.spans = []
+        self._local = threading.local()
+
+    def start(self, name, **args):
+        """ opens a span, returns the token to pass to stop"""
+
+        if not self.enabled:
+            return None
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        return {"name": name, "args": args, "depth": depth, "thread": threading.current_thread().ident,
+                "wall": time.time(), "cpu": _cpu_seconds(), "peak_rss": _peak_rss(), "io": _io_counters()}
+
+    def stop(self, token, result=None):
+        """ closes the span of token, result is what it produced, returns the span recorded"""
+
+        if token is None:
+            return None
+        self._local.depth = token["depth"]
+        wall, cpu, peak_rss, io = time.time(), _cpu_seconds(), _peak_rss(), _io_counters()
+        arrays, array_bytes = _arrays(result)
+        span = {"name": token["name"],
+                "args": token["args"],
+                "depth": token["depth"],
+                "process": os.getpid(),
+                "thread": token["thread"],
+                "start": token["wall"] - self.origin,
+                "wall_seconds": wall - token["wall"],
+                "cpu_seconds": cpu - token["cpu"],
+                "peak_rss_delta": peak_rss - token["peak_rss"],
+                "peak_rss": peak_rss,
+                "read_bytes": _difference(io[0], token["io"][0]),
+                "written_bytes": _difference(io[1], token["io"][1]),
+                "arrays": arrays,
+                "array_bytes": array_bytes}
+        self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        token = self.start(name, **args)
+        try:
+            yield
+        finally:
+            self.stop(token)
+
+    def merge(self, spans):
+        """ adds the spans recorded by a forked worker process, see tiled.map_tiles"""
+
+        if self.enabled:
+            self.spans.extend(spans)
+        return None
+
+    def wrap(self, name, function):
+        """ function recording a span named name around every call"""
+
+        if not self.enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            token = self.start(name)
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                self.stop(token, result)
+
+        return wrapper
+
+    def instrument(self, model, prefix="get_"):
+        """ wraps every method of model whose name starts with prefix, on that instance only"""
+
+        if not self.enabled:
+            return
+        for name in dir(model.__class__):
+            if name.startswith(prefix) and callable(getattr(model.__class__, name)):
+                setattr(model, name, self.wrap(name, getattr(model, name)))
+
+    def summary(self):
+        """ totals of the spans by name, the slowest first"""
+
+        totals = {}
+        for span in self.spans:
+            total = totals.setdefault(span["name"], {"name": span["name"], "calls": 0, "wall_seconds": 0.,
+                                                     "cpu_seconds": 0., "peak_rss_delta": 0, "read_bytes": 0,
+                                                     "written_bytes": 0, "array_bytes": 0})
+            total["calls"] += 1
+            for key in ("wall_seconds", "cpu_seconds", "peak_rss_delta", "read_bytes", "written_bytes",
+                        "array_bytes"):
+                total[key] += span[key] or 0
+        return sorted(totals.values(), key=lambda total: -total["wall_seconds"])
+
+    def write_report(self, path, **extra):
+        """ writes the spans, their summary and the extra items given as a JSON document"""
+
+        report = {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.origin)),
+                  "wall_seconds": time.time() - self.origin,
+                  "peak_rss": _peak_rss(),
+                  "summary": self.summary(),
+                  "spans": self.spans}
+        report.update(extra)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        return path
+
+    def write_trace(self, path):
+        """ writes the spans in the Chrome trace event format"""
+
+        events = []
+        for span in self.spans:
+            args = dict(span["args"], cpu_seconds=span["cpu_seconds"], peak_rss_delta=span["peak_rss_delta"],
+                        read_bytes=span["read_bytes"], written_bytes=span["written_bytes"],
+                        array_bytes=span["array_bytes"])
+            events.append({"name": span["name"], "cat": "metric", "ph": "X", "pid": span["process"], "tid": span["thread"],
+                           "ts": span["start"] * 1e6, "dur": span["wall_seconds"] * 1e6, "args": args})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return path
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
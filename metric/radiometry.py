@@ -0,0 +1,123 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Radiometric conversion of landsat DN through lookup tables.
+
+A landsat band holds 16 bit integers, so any function of that band alone takes at most
+65536 distinct values. DNLookupTable evaluates such a function once for every DN and
+converts a band with a single take, instead of running the arithmetic on every pixel of
+the scene. The gains and offsets of the reflectance and radiance conversions are those of
+the MTL file parsed by landsat.grab_meta.
+"""
+
+import numpy as np
+
+DN_RANGE = 2 ** 16
+
+# pixels per take, numpy converts the DN of each take to a temporary array of intp
+TAKE_CHUNK = 2 ** 17
+
+THERMAL_BANDS = (10, 11)
+
+# landsat 8 rescaling used when the MTL file does not give one
+DEFAULT_REFLECTANCE_RESCALING = (0.00002, -0.1)
+DEFAULT_RADIANCE_RESCALING = (0.0003342, 0.1)
+
+
+def rescale(dn, mult, add, dtype=float):
+    """ mult * DN + add in the floating point type dtype, DN below 1 (fill) is nan"""
+
+    values = np.where(dn >= 1, np.asarray(dn, dtype=dtype), np.nan)
+    values *= mult
+    values += add
+    return values
+
+
+class DNLookupTable(object):
+    def __init__(self, function, args=(), dtype=float):
+        """
+        function        function(dn, *args, dtype=dtype) of a single integer band
+        args            the other arguments of function, scalars
+        dtype           type of the converted band
+        """
+
+        self.function = function
+        self.args = tuple(args)
+        self.dtype = np.dtype(dtype)
+        self._table = None
+
+    @property
+    def table(self):
+        """ function of every DN from 0 to 65535, computed on first use"""
+
+        if self._table is None:
+            dn = np.arange(DN_RANGE, dtype=np.uint16)
+            self._table = np.asarray(self.function(dn, *self.args, dtype=self.dtype), dtype=self.dtype)
+        return self._table
+
+    def __call__(self, dn, out=None):
+        """ the band dn converted, written to out if given"""
+
+        dn = np.asarray(dn)
+        if dn.dtype.kind == "u" and dn.dtype.itemsize <= 2:
+            if out is None:
+                out = np.empty(dn.shape, dtype=self.dtype)
+            if dn.ndim < 2:
+                return np.take(self.table, dn, out=out, mode="clip")
+
+            # every value is a valid index, clip mode lets take write to out directly, in
+            # blocks of rows so that the index temporary stays small
+            rows = max(1, TAKE_CHUNK // max(1, dn[0].size))
+            for start in xrange(0, len(dn), rows):
+                np.take(self.table, dn[start:start + rows], out=out[start:start + rows], mode="clip")
+            return out
+
+        # not a 16 bit band, fall back on the arithmetic
+        values = np.asarray(self.function(dn, *self.args, dtype=self.dtype), dtype=self.dtype)
+        if out is None:
+            return values
+        out[...] = values
+        return out
+
+    def __repr__(self):
+        return "DNLookupTable({0}, {1}, {2})".format(self.function.__name__, self.args, self.dtype.str)
+
+
+def band_rescaling(meta, band):
+    """
+    (mult, add) of a landsat band from its MTL metadata
+
+    reflective bands convert to top of atmosphere reflectance, without the sun angle
+    correction, thermal bands to radiance
+    """
+
+    if band in THERMAL_BANDS:
+        names, default = ("RADIANCE_MULT_BAND_{0}", "RADIANCE_ADD_BAND_{0}"), DEFAULT_RADIANCE_RESCALING
+    else:
+        names, default = ("REFLECTANCE_MULT_BAND_{0}", "REFLECTANCE_ADD_BAND_{0}"), DEFAULT_REFLECTANCE_RESCALING
+    return tuple(float(getattr(meta, name.format(band), value)) for name, value in zip(names, default))
+
+
+def band_lookup_table(meta, band, dtype=float):
+    """ lookup table of the reflectance or radiance of a landsat band"""
+
+    return DNLookupTable(rescale, band_rescaling(meta, band), dtype)
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -0,0 +1,383 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+One chunked, compressed file holding the products of a scene.
+
+A run used to write every intermediate and output as a GeoTIFF of its own. A SceneStore
+keeps them all as named variables of one file on the grid of the scene instead: each
+variable is cut in square chunks, the bytes of a chunk shuffled and deflated, and any
+window of any variable read back by decompressing only the chunks it overlaps. Chunks
+holding nothing but the fill value are not stored, so the pixels outside a study area
+take no space.
+
+The file is the header, the chunks, and a JSON index of the variables appended after
+them. The header points at the last index written, and is only moved once a new index is
+on disk, so a run killed while writing leaves the store as it was at its last flush.
+Chunks rewritten leave their old bytes behind, close() compacts the file once they
+take up a quarter of it.
+
+    python -m metric.scene_store <store> <out_dir> [name ...]
+
+exports the variables of a store, all of them by default, to GeoTIFFs in out_dir.
+"""
+
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import numpy as np
+from osgeo import gdal
+
+from utils import raster_tools as ras
+
+# written to the output directory of the workspace by MetricModel(store=True)
+STORE_FILE = "scene_store.mst"
+
+MAGIC = b"MSTORE01"
+
+# magic, offset and length of the current index
+HEADER = struct.Struct("<8sQQ")
+
+# edge of the chunks in pixels and zlib level
+CHUNK = 256
+LEVEL = 6
+
+# close() compacts the file when the bytes of dropped chunks pass this fraction of it
+COMPACT_FRACTION = .25
+
+GDAL_TYPES = {"uint8": gdal.GDT_Byte, "uint16": gdal.GDT_UInt16, "int16": gdal.GDT_Int16,
+              "uint32": gdal.GDT_UInt32, "int32": gdal.GDT_Int32, "float32": gdal.GDT_Float32,
+              "float64": gdal.GDT_Float64}
+NUMPY_TYPES = dict((gdal_type, name) for name, gdal_type in GDAL_TYPES.items())
+
+
+def variable_name(path):
+    """ name of the variable standing for the raster at path, its file name without extension"""
+
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _fill_value(dtype):
+    return np.nan if np.dtype(dtype).kind == "f" else 0
+
+
+def _encode(block, level):
+    """ deflates block with its bytes shuffled, the nth byte of every value first then the next"""
+
+    block = np.ascontiguousarray(block)
+    shuffled = block.reshape(-1).view(np.uint8).reshape(-1, block.dtype.itemsize).T
+    return zlib.compress(shuffled.tobytes(), level)
+
+
+def _decode(blob, dtype, shape):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(shuffled.T).view(dtype).reshape(shape)
+
+
+def _is_fill(block, fill):
+    if isinstance(fill, float) and np.isnan(fill):
+        return np.isnan(block).all()
+    return (block == fill).all()
+
+
+def _append_index(f, index):
+    """ appends index to the open store f, then points its header at it"""
+
+    f.seek(0, os.SEEK_END)
+    offset = f.tell()
+    index = json.dumps(index, sort_keys=True).encode("utf-8")
+    f.write(index)
+    f.flush()
+    os.fsync(f.fileno())
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, offset, len(index)))
+
+
+class SceneStore(object):
+    def __init__(self, path, geo=None, chunk=CHUNK, level=LEVEL):
+        """
+        path            file of the store, opened if it exists and created otherwise
+        geo             grid of the variables, see spatial_reference_tools.get_raster_geo_attributes,
+                        required to create a store. An existing store on another grid raises
+                        a ValueError
+        chunk           edge of the chunks in pixels of a new store
+        level           zlib compression level, 1 fastest to 9 smallest
+        """
+
+        self.path = path
+        self.level = level
+        self._lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                magic, offset, length = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC:
+                    raise ValueError("{0} is not a scene store".format(path))
+                f.seek(offset)
+                self.index = json.loads(f.read(length).decode("utf-8"))
+            if geo is not None and not self._same_grid(geo):
+                raise ValueError("{0} holds the products of another grid, remove it to start over".format(path))
+        else:
+            if geo is None:
+                raise ValueError("the grid of a new store is required")
+            self.index = {"grid": {"cols": geo["cols"], "rows": geo["rows"],
+                                   "geotransform": list(geo["geotransform"]), "projection": geo["projection"]},
+                          "chunk": chunk, "variables": {}}
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, 0, 0))
+            self.flush()
+
+        grid = self.index["grid"]
+        self.geo = dict(grid, geotransform=tuple(grid["geotransform"]))
+        self.chunk = self.index["chunk"]
+        self._file = None
+
+    def _same_grid(self, geo):
+        grid = self.index["grid"]
+        return (grid["cols"], grid["rows"]) == (geo["cols"], geo["rows"]) and \
+            np.allclose(grid["geotransform"], geo["geotransform"])
+
+    def names(self):
+        return sorted(self.index["variables"])
+
+    def __contains__(self, name):
+        return name in self.index["variables"]
+
+    def variable(self, name):
+        """ dtype, bands (0 for a single 2-D array) and band descriptions of a variable"""
+
+        entry = self.index["variables"][name]
+        return dict((key, entry[key]) for key in ("dtype", "bands", "descriptions"))
+
+    def _chunks(self, window):
+        """ (chunk row, chunk col, (xoff, yoff, xsize, ysize) of the chunk) of the chunks overlapping window"""
+
+        xoff, yoff, xsize, ysize = window
+        cols, rows, chunk = self.geo["cols"], self.geo["rows"], self.chunk
+        for i in range(yoff // chunk, (yoff + ysize - 1) // chunk + 1):
+            for j in range(xoff // chunk, (xoff + xsize - 1) // chunk + 1):
+                x0, y0 = j * chunk, i * chunk
+                yield i, j, (x0, y0, min(chunk, cols - x0), min(chunk, rows - y0))
+
+    @staticmethod
+    def _overlap(window, chunk_window):
+        """ slices of the overlap of a chunk and a window, in the chunk and in the window"""
+
+        xoff, yoff, xsize, ysize = window
+        cx, cy, cxsize, cysize = chunk_window
+        x0, x1 = max(xoff, cx), min(xoff + xsize, cx + cxsize)
+        y0, y1 = max(yoff, cy), min(yoff + ysize, cy + cysize)
+        return ((slice(y0 - cy, y1 - cy), slice(x0 - cx, x1 - cx)),
+                (slice(y0 - yoff, y1 - yoff), slice(x0 - xoff, x1 - xoff)))
+
+    def _read_blob(self, f, location):
+        f.seek(location[0])
+        return f.read(location[1])
+
+    def write(self, name, array, window=None, descriptions=None):
+        """
+        writes array at window (xoff, yoff, xsize, ysize) of variable name, the whole grid if None
+
+        array is (rows, cols) or (bands, rows, cols), a list of 2-D arrays is taken as bands.
+        Writing the whole grid replaces the variable, writing a window replaces its pixels
+        only. Returns the bytes of the chunks written.
+        """
+
+        array = np.asarray(array)
+        whole = (0, 0, self.geo["cols"], self.geo["rows"])
+        window = tuple(window) if window is not None else whole
+        bands = array.shape[0] if array.ndim == 3 else 0
+        if array.shape[-2:] != (window[3], window[2]):
+            raise ValueError("array of shape {0} written to a window of {1} x {2}".format(array.shape, *window[2:]))
+
+        with self._lock:
+            entry = self.index["variables"].get(name)
+            if window == whole or entry is None:
+                entry = {"dtype": array.dtype.str, "bands": bands, "descriptions": descriptions, "chunks": {}}
+            elif (np.dtype(entry["dtype"]), entry["bands"]) != (array.dtype, bands):
+                raise ValueError("{0} is a {1} of {2} bands".format(name, entry["dtype"], entry["bands"]))
+            chunks = dict(entry["chunks"])
+            dtype = np.dtype(entry["dtype"])
+            fill = _fill_value(dtype)
+
+            if self._file is None:
+                self._file = open(self.path, "r+b")
+            f = self._file
+            f.seek(0, os.SEEK_END)
+            written = 0
+            for b, band in enumerate(array if bands else [array]):
+                for i, j, chunk_window in self._chunks(window):
+                    key = "{0},{1},{2}".format(b, i, j)
+                    in_chunk, in_window = self._overlap(window, chunk_window)
+                    shape = (chunk_window[3], chunk_window[2])
+                    if band[in_window].shape == shape:
+                        block = band[in_window]
+                    else:
+                        # a chunk the window covers partly keeps its other pixels
+                        if key in chunks:
+                            block = _decode(self._read_blob(f, chunks[key]), dtype, shape).copy()
+                            f.seek(0, os.SEEK_END)
+                        else:
+                            block = np.full(shape, fill, dtype=dtype)
+                        block[in_chunk] = band[in_window]
+
+                    if _is_fill(block, fill):
+                        chunks.pop(key, None)
+                        continue
+                    blob = _encode(block.astype(dtype, copy=False), self.level)
+                    chunks[key] = [f.tell(), len(blob)]
+                    f.write(blob)
+                    written += len(blob)
+
+            # the chunks are on disk before the index points at them
+            f.flush()
+            self.index["variables"][name] = dict(entry, chunks=chunks,
+                                                 descriptions=descriptions or entry["descriptions"])
+        return written
+
+    def write_raster(self, save_array, out_path, geo, descriptions=None, **options):
+        """
+        raster_tools.array_to_raster into the store, out_path names the variable
+
+        lets RasterWriter and IterationSnapshots write to the store, the array is stored in
+        the data_type of geo and the GeoTIFF options are ignored. Returns the bytes of the
+        chunks written.
+        """
+
+        if not self._same_grid(geo):
+            raise ValueError("{0} is not on the grid of the store".format(out_path))
+        save_array = np.asarray(save_array, dtype=NUMPY_TYPES.get(geo.get("data_type")))
+        return self.write(variable_name(out_path), save_array, descriptions=descriptions)
+
+    def read(self, name, window=None, band=None):
+        """
+        window (xoff, yoff, xsize, ysize) of variable name, the whole grid if None
+
+        a variable of several bands is read as (bands, rows, cols) unless band picks one.
+        Pixels never written hold NaN, 0 for an integer variable.
+        """
+
+        with self._lock:
+            entry = self.index["variables"].get(name)
+            if entry is None:
+                raise KeyError("{0} is not in {1}".format(name, self.path))
+            chunks = dict(entry["chunks"])
+
+        window = tuple(window) if window is not None else (0, 0, self.geo["cols"], self.geo["rows"])
+        dtype = np.dtype(entry["dtype"])
+        bands = range(entry["bands"]) if entry["bands"] and band is None else [band or 0]
+        out = np.full((len(bands), window[3], window[2]), _fill_value(dtype), dtype=dtype)
+
+        # a handle of its own, the store may be read from several threads or forked processes
+        with open(self.path, "rb") as f:
+            for n, b in enumerate(bands):
+                for i, j, chunk_window in self._chunks(window):
+                    location = chunks.get("{0},{1},{2}".format(b, i, j))
+                    if location is None:
+                        continue
+                    block = _decode(self._read_blob(f, location), dtype, (chunk_window[3], chunk_window[2]))
+                    in_chunk, in_window = self._overlap(window, chunk_window)
+                    out[n][in_window] = block[in_chunk]
+
+        return out if entry["bands"] and band is None else out[0]
+
+    def export_geotiff(self, name, out_path, window=None, **options):
+        """ writes a window of variable name to a GeoTIFF, options as raster_tools.array_to_raster"""
+
+        array = self.read(name, window)
+        geo = self.geo if window is None else ras.window_geo(self.geo, window)
+        entry = self.variable(name)
+        geo = dict(geo, bands=max(entry["bands"], 1), data_type=GDAL_TYPES[array.dtype.name])
+        return ras.array_to_raster(array, out_path, geo, descriptions=entry["descriptions"], **options)
+
+    def flush(self):
+        """ writes the index, the variables written so far survive a crash from then on"""
+
+        with self._lock:
+            with open(self.path, "r+b") as f:
+                _append_index(f, self.index)
+
+    def live_bytes(self):
+        """ bytes of the chunks the index points at"""
+
+        return sum(length for entry in self.index["variables"].values()
+                   for offset, length in entry["chunks"].values())
+
+    def compact(self):
+        """
+        rewrites the store with its live chunks only
+
+        the new file holds its index before it replaces the store, and the index of the
+        store is only swapped for it then, so a failure leaves the store as it was
+        """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+            index = dict(self.index, variables={})
+            try:
+                with open(self.path, "rb") as source, open(tmp_path, "w+b") as f:
+                    f.write(HEADER.pack(MAGIC, 0, 0))
+                    for name, entry in self.index["variables"].items():
+                        chunks = {}
+                        for key, location in sorted(entry["chunks"].items()):
+                            blob = self._read_blob(source, location)
+                            chunks[key] = [f.tell(), len(blob)]
+                            f.write(blob)
+                        index["variables"][name] = dict(entry, chunks=chunks)
+                    _append_index(f, index)
+                os.rename(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self.index = index
+
+    def close(self):
+        """ writes the index, compacting the file instead once dropped chunks take up COMPACT_FRACTION of it"""
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if os.path.getsize(self.path) - self.live_bytes() > COMPACT_FRACTION * os.path.getsize(self.path):
+            self.compact()
+        else:
+            self.flush()
+
+
+def export(store_path, out_dir, names=None):
+    """ writes the variables of the store at store_path to "<name>.tif" in out_dir, returns their paths"""
+
+    store = SceneStore(store_path)
+    paths = []
+    for name in names or store.names():
+        paths.append(os.path.join(out_dir, "{0}.tif".format(name)))
+        store.export_geotiff(name, paths[-1])
+    return paths
+
+
+if __name__ == '__main__':
+    for exported in export(sys.argv[1], sys.argv[2], sys.argv[3:]):
+        print("Wrote {0}".format(exported))
+
+# ===============================================================================
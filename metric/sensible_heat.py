@@ -0,0 +1,480 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Building blocks of the iterative sensible heat solution (equations 28 - 51).
+
+The a and b coefficients of equation 29 only depend on the hot and cold reference
+pixels, so they can be calibrated on those pixels alone. Every other pixel then follows
+the same sequence of coefficients, which lets the scene be solved one window at a time.
+
+Alternatively only the converged pair is kept and each pixel iterates its own stability
+correction with those fixed coefficients, see solve_sensible_heat.
+"""
+
+import math
+import time
+
+from numpy import asarray, abs as np_abs, errstate, isnan, isfinite, column_stack, concatenate, arange, broadcast
+from numpy import empty, flatnonzero, divide, multiply, maximum, log, arctan, sqrt
+from numpy.linalg import lstsq
+
+from metric import function_bank as fnbank
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _psi_loop(L, psi200, psi2, psi01):
+    """ equations 41 - 45b pixel by pixel on flat arrays, compiled with numba when it is installed"""
+
+    for i in range(L.shape[0]):
+        l = L[i]
+        if l < 0:
+            x200 = (1 - 16 * (200 / l)) ** 0.25
+            x2 = (1 - 16 * (2 / l)) ** 0.25
+            x01 = (1 - 16 * (0.1 / l)) ** 0.25
+            psi200[i] = (2 * math.log((1 + x200) / 2) + math.log((1 + x200 ** 2) / 2) - 2 * math.atan(x200) +
+                         0.5 * math.pi)
+            psi2[i] = 2 * math.log((1 + x2 ** 2) / 2)
+            psi01[i] = 2 * math.log((1 + x01 ** 2) / 2)
+        else:
+            psi200[i] = -5 * (200 / l)
+            psi2[i] = -5 * (2 / l)
+            psi01[i] = -5 * (0.1 / l)
+
+
+if numba is not None:
+    _psi_loop = numba.njit(error_model="numpy")(_psi_loop)
+
+
+def stability_corrections(L, out=None, use_numba=None):
+    """
+    psi200, psi2 and psi01, from the unstable branch where L < 0 and the stable branch elsewhere
+
+    All three corrections come out of one pass over L. The stable branch (eq 44 - 45b) is
+    written straight into the output buffers, the unstable branch (eq 41 - 42b) is then only
+    evaluated on the flat indices where L < 0, in two reused work arrays, and put over it.
+
+    out is an optional tuple of three preallocated float arrays shaped like L, they are
+    returned. The corrections are computed in the precision of L, a float32 L is not copied.
+    With numba installed a compiled loop is used unless use_numba is False.
+    """
+
+    L = asarray(L)
+    if L.dtype.kind != "f":
+        L = L.astype(float)
+    if out is None:
+        out = empty(L.shape, L.dtype), empty(L.shape, L.dtype), empty(L.shape, L.dtype)
+    psi200, psi2, psi01 = out
+
+    if use_numba is None:
+        use_numba = numba is not None
+    if use_numba and L.flags.c_contiguous and all(psi.flags.c_contiguous for psi in out):
+        _psi_loop(L.reshape(-1), psi200.reshape(-1), psi2.reshape(-1), psi01.reshape(-1))
+        return psi200, psi2, psi01
+
+    # stable branch everywhere, same operations as Num44, Num45a and Num45b
+    with errstate(divide="ignore", invalid="ignore"):
+        for psi, z in ((psi200, 200), (psi2, 2), (psi01, 0.1)):
+            divide(z, L, out=psi)
+            multiply(psi, -5, out=psi)
+        unstable = flatnonzero(L < 0)
+
+    # unstable branch on the L < 0 pixels only, equations 41, 42a and 42b with the fourth
+    # root taken as two square roots, which is much cheaper than a power of 0.25
+    if unstable.size:
+        L_u = L.reshape(-1)[unstable]
+        x = empty(L_u.shape, L.dtype)
+        term = empty(L_u.shape, L.dtype)
+        for psi, z in ((psi200, 200), (psi2, 2), (psi01, 0.1)):
+            divide(-16 * z, L_u, out=x)
+            x += 1
+            sqrt(x, out=x)
+            sqrt(x, out=x)
+            # ln((1 + x^2) / 2), doubled for heat transport
+            multiply(x, x, out=term)
+            term += 1
+            term /= 2
+            log(term, out=term)
+            if z == 200:
+                # 2 ln((1 + x) / 2) + ln((1 + x^2) / 2) - 2 atan(x) + pi / 2
+                psi_u = log((1 + x) / 2)
+                psi_u -= arctan(x)
+                psi_u *= 2
+                psi_u += term
+                psi_u += 0.5 * math.pi
+            else:
+                psi_u = term
+                psi_u *= 2
+            psi.put(unstable, psi_u)
+
+    return psi200, psi2, psi01
+
+
+def initial_resistances(u200, zom, pressure, surface_temp):
+    """ first guess of friction velocity, aerodynamic resistance and air density (eq 31, 30, 37)"""
+
+    ustar = fnbank.Num31(u200, zom)
+    rah = fnbank.Num30(ustar)
+    rho_air = fnbank.Num37(pressure, surface_temp, 0)
+    return ustar, rah, rho_air
+
+
+def corrected_resistances(L, dT, u200, zom, pressure, surface_temp, psi=None):
+    """
+    stability corrected friction velocity, aerodynamic resistance and air density (eq 38, 39, 37)
+
+    psi is an optional tuple of buffers for the stability corrections, see stability_corrections
+    """
+
+    psi200, psi2, psi01 = stability_corrections(L, out=psi)
+    ustar = fnbank.Num38(u200, zom, psi200)
+    rah = fnbank.Num39(psi2, psi01, ustar)
+    rho_air = fnbank.Num37(pressure, surface_temp, dT)
+    return ustar, rah, rho_air
+
+
+def sensible_heat(a, b, T_s_datum, rho_air, rah, ustar, surface_temp):
+    """ near surface temperature difference, sensible heat and Monin-Obukhov length (eq 29, 28, 40)"""
+
+    dT = fnbank.Num29(a, b, T_s_datum)
+    H = fnbank.Num28(rho_air, dT, rah)
+    L = fnbank.Num40(rho_air, ustar, surface_temp, H)
+    return dT, H, L
+
+
+class FixedPointSolver(object):
+    """
+    Drives the iteration of the a and b coefficients of equations 50 and 51
+
+    subclasses implement step, which takes the current state x and its image gx under one
+    iteration and returns the next state. Stops when a and b, the first two entries of the
+    state, both change by less than tolerance relative to their current value, or after
+    max_iter iterations. Every iteration is logged with its residual and wall time.
+
+    lagged solvers follow the original scheme, where the state is (a, b) and the reference
+    pixels carry their stability correction over from the previous iteration, so the (a, b)
+    sequence can be replayed over the scene. The others iterate the whole state, a, b and
+    1 / L of every reference pixel, and the scene is solved with the final pair.
+    """
+
+    name = None
+    lagged = False
+
+    def __init__(self, tolerance=5e-5, max_iter=1000):
+        self.tolerance = tolerance
+        self.max_iter = max_iter
+        self.log = []
+        self.reset()
+
+    def reset(self):
+        self.log = []
+
+    @staticmethod
+    def residual(x, gx):
+        return max(abs(gx[0] / x[0] - 1), abs(gx[1] / x[1] - 1))
+
+    def converged(self, residual):
+        return residual < self.tolerance
+
+    def step(self, x, gx):
+        raise NotImplementedError
+
+    def record(self, x, residual, seconds):
+        self.log.append({"iteration": len(self.log) + 1, "a": x[0], "b": x[1], "residual": residual,
+                         "seconds": seconds})
+
+    @property
+    def iterations(self):
+        return len(self.log)
+
+    def write_log(self, path):
+        """ writes the iteration log as a comma separated table"""
+
+        with open(path, "w") as f:
+            f.write("# solver={0} tolerance={1} max_iter={2} iterations={3}\n".format(
+                self.name, self.tolerance, self.max_iter, self.iterations))
+            f.write("iteration,a,b,residual,seconds\n")
+            for row in self.log:
+                f.write("{iteration},{a!r},{b!r},{residual!r},{seconds:.6f}\n".format(**row))
+
+
+class DampedSolver(FixedPointSolver):
+    """ the original blend of the old and new values, x + weight * (gx - x)"""
+
+    name = "damped"
+
+    def __init__(self, weight=0.4, lagged=True, **kwargs):
+        self.weight = weight
+        self.lagged = lagged
+        FixedPointSolver.__init__(self, **kwargs)
+
+    def step(self, x, gx):
+        x, gx = asarray(x, dtype=float), asarray(gx, dtype=float)
+        return (1 - self.weight) * x + self.weight * gx
+
+
+class AndersonSolver(DampedSolver):
+    """
+    Anderson acceleration (type II) over the last depth iterations, mixed with weight
+
+    falls back to the damped step while there is no history or when the least squares
+    problem gives nothing finite. With depth 0 this is the damped iteration.
+    """
+
+    name = "anderson"
+
+    def __init__(self, depth=3, weight=1.0, **kwargs):
+        self.depth = depth
+        DampedSolver.__init__(self, weight=weight, lagged=False, **kwargs)
+
+    def reset(self):
+        DampedSolver.reset(self)
+        self._xs, self._fs = [], []
+
+    def step(self, x, gx):
+        x, gx = asarray(x, dtype=float), asarray(gx, dtype=float)
+        f = gx - x
+        self._xs = (self._xs + [x])[-(self.depth + 1):]
+        self._fs = (self._fs + [f])[-(self.depth + 1):]
+
+        new = x + self.weight * f
+        if len(self._fs) < 2:
+            return new
+
+        dx = column_stack([self._xs[k + 1] - self._xs[k] for k in range(len(self._xs) - 1)])
+        df = column_stack([self._fs[k + 1] - self._fs[k] for k in range(len(self._fs) - 1)])
+        if isfinite(df).all() and df.any():
+            gamma = lstsq(df, f, rcond=None)[0]
+            accelerated = new - (dx + self.weight * df).dot(gamma)
+            if isfinite(accelerated).all():
+                new = accelerated
+        return new
+
+
+class SecantSolver(AndersonSolver):
+    """ secant (Aitken) extrapolation from the last two iterations, Anderson with a depth of 1"""
+
+    name = "secant"
+
+    def __init__(self, weight=1.0, **kwargs):
+        AndersonSolver.__init__(self, depth=1, weight=weight, **kwargs)
+
+
+SOLVERS = {"damped": DampedSolver, "secant": SecantSolver, "aitken": SecantSolver, "anderson": AndersonSolver}
+
+
+def get_solver(solver=None, **kwargs):
+    """
+    returns a FixedPointSolver, solver is one of the names in SOLVERS or an instance
+
+    None gives the damped iteration with its original settings. kwargs (tolerance,
+    max_iter, weight, depth) are passed on when building from a name.
+    """
+
+    if solver is None:
+        solver = "damped"
+    if isinstance(solver, FixedPointSolver):
+        return solver
+    try:
+        return SOLVERS[solver](**kwargs)
+    except KeyError:
+        raise ValueError("unknown solver {0}, expected one of {1}".format(solver, sorted(SOLVERS)))
+
+
+def calibrate_coefficients(hot, cold, LE_cold, solver=None):
+    """
+    Iterates the a and b coefficients of equation 29 on the reference pixels only
+
+    inputs:
+        hot, cold       dicts of 1-D arrays holding the values of the pixels inside the hot
+                        and cold reference polygons, with keys "u200", "zom", "pressure",
+                        "surface_temp", "T_s_datum", "net_rad" and "soil_hf"
+        LE_cold         latent energy of the cold pixel, the reference LE times its calibration factor
+        solver          FixedPointSolver or solver name, see get_solver. Its log holds the
+                        residual and wall time of every iteration afterwards.
+
+    returns the list of (a, b) pairs, one per iteration, the last pair is the converged solution.
+    With a lagged solver replaying the list with replay_sensible_heat gives the same H as
+    iterating the whole scene.
+    """
+
+    solver = get_solver(solver)
+    solver.reset()
+
+    ref = {}
+    for name, pixels in (("hot", hot), ("cold", cold)):
+        ref[name] = dict((key, asarray(val, dtype=float)) for key, val in pixels.items())
+    n_hot = ref["hot"]["T_s_datum"].size
+
+    T_s_datum_hot = ref["hot"]["T_s_datum"].mean()
+    T_s_datum_cold = ref["cold"]["T_s_datum"].mean()
+    Rn_hot = ref["hot"]["net_rad"].mean()
+    Rn_cold = ref["cold"]["net_rad"].mean()
+    G_hot = ref["hot"]["soil_hf"].mean()
+    G_cold = ref["cold"]["soil_hf"].mean()
+
+    def coefficients(state, a=None):
+        """ a and b from the resistances of the reference pixels, b uses a when given"""
+
+        ustar_hot, rah_hot, rho_air_hot = state["hot"]
+        ustar_cold, rah_cold, rho_air_cold = state["cold"]
+        dT_hot = fnbank.Num46(Rn_hot, G_hot, rah_hot.mean(), rho_air_hot.mean())
+        dT_cold = fnbank.Num49(Rn_cold, G_cold, LE_cold, rah_cold.mean(), rho_air_cold.mean())
+        a_new = fnbank.Num50(dT_hot, dT_cold, T_s_datum_hot, T_s_datum_cold)
+        b_new = fnbank.Num51(dT_hot, a_new if a is None else a, T_s_datum_hot)
+        return a_new, b_new
+
+    def stability(a, b, state):
+        result = {}
+        for name in ("hot", "cold"):
+            ustar, rah, rho_air = state[name]
+            result[name] = sensible_heat(a, b, ref[name]["T_s_datum"], rho_air, rah, ustar,
+                                         ref[name]["surface_temp"])
+        return result
+
+    def corrected(stable):
+        result = {}
+        for name in ("hot", "cold"):
+            px = ref[name]
+            dT, H, L = stable[name]
+            result[name] = corrected_resistances(L, dT, px["u200"], px["zom"], px["pressure"], px["surface_temp"])
+        return result
+
+    state = {}
+    for name in ("hot", "cold"):
+        px = ref[name]
+        state[name] = initial_resistances(px["u200"], px["zom"], px["pressure"], px["surface_temp"])
+
+    a, b = coefficients(state)
+    history = [(a, b)]
+    stable = stability(a, b, state)
+
+    if not solver.lagged:
+        # a, b and 1 / L of every reference pixel, 1 / L stays finite near neutral conditions
+        def inverse_L(stable):
+            with errstate(divide="ignore"):
+                return concatenate([1.0 / stable["hot"][2], 1.0 / stable["cold"][2]])
+
+        def iterate(x):
+            a, b, inv_L = x[0], x[1], x[2:]
+            stable = {}
+            for name, part in (("hot", inv_L[:n_hot]), ("cold", inv_L[n_hot:])):
+                with errstate(divide="ignore"):
+                    stable[name] = (fnbank.Num29(a, b, ref[name]["T_s_datum"]), None, 1.0 / part)
+            state = corrected(stable)
+            a_new, b_new = coefficients(state)
+            return concatenate([[a_new, b_new], inverse_L(stability(a_new, b_new, state))])
+
+        x = concatenate([[a, b], inverse_L(stable)])
+
+    i = 1
+    converged = False
+    while not converged and i < solver.max_iter:
+        start = time.time()
+
+        if solver.lagged:
+            state = corrected(stable)
+            a_new, b_new = coefficients(state, a)
+            residual = solver.residual((a, b), (a_new, b_new))
+            converged = solver.converged(residual)
+            a, b = solver.step((a, b), (a_new, b_new))
+            stable = stability(a, b, state)
+        else:
+            gx = iterate(x)
+            residual = solver.residual(x, gx)
+            converged = solver.converged(residual)
+            x = solver.step(x, gx)
+            a, b = x[0], x[1]
+
+        history.append((a, b))
+        solver.record((a, b), residual, time.time() - start)
+        i += 1
+
+    print("Calibrated a and b on reference pixels after {0} iterations ({1} solver, residual {2:.3g})".format(
+        i, solver.name, solver.log[-1]["residual"] if solver.log else 0.))
+    return history
+
+
+def replay_sensible_heat(history, u200, zom, pressure, surface_temp, T_s_datum):
+    """
+    Solves sensible heat for any set of pixels by following a calibrated sequence of (a, b)
+
+    history is the list returned by calibrate_coefficients, returns H.
+    """
+
+    ustar, rah, rho_air = initial_resistances(u200, zom, pressure, surface_temp)
+    a, b = history[0]
+    dT, H, L = sensible_heat(a, b, T_s_datum, rho_air, rah, ustar, surface_temp)
+    psi = empty(L.shape, L.dtype), empty(L.shape, L.dtype), empty(L.shape, L.dtype)
+
+    for a, b in history[1:]:
+        ustar, rah, rho_air = corrected_resistances(L, dT, u200, zom, pressure, surface_temp, psi=psi)
+        dT, H, L = sensible_heat(a, b, T_s_datum, rho_air, rah, ustar, surface_temp)
+
+    return H
+
+
+def solve_sensible_heat(a, b, u200, zom, pressure, surface_temp, T_s_datum, tolerance=1e-4, max_iter=100):
+    """
+    Solves sensible heat for any set of pixels with fixed a and b coefficients
+
+    dT is fixed by the coefficients, so every pixel only iterates the stability correction of
+    its own ustar, rah and L. A pixel is done once its H, L and rah all change by less than
+    tolerance relative to their previous value (or one is nan), after that it is left out:
+    each pass only works on the flat indices of the pixels still changing and scatters the
+    results back. Most pixels settle in a few passes, only those close to neutral conditions
+    take longer. H alone is not enough, it may settle while the ustar^3 of L still moves.
+
+    returns H and the number of pixels computed in every pass, the first being all of them.
+    """
+
+    inputs = [asarray(value, dtype=float) for value in (u200, zom, pressure, surface_temp, T_s_datum)]
+    shape = broadcast(*inputs).shape
+    u200, zom, pressure, surface_temp, T_s_datum = [value.ravel() if value.ndim else value for value in inputs]
+
+    ustar, rah, rho_air = initial_resistances(u200, zom, pressure, surface_temp)
+    dT, H, L = sensible_heat(a, b, T_s_datum, rho_air, rah, ustar, surface_temp)
+
+    active = arange(H.size)
+    counts = [H.size]
+
+    def take(value, index):
+        return value[index] if value.ndim else value
+
+    while active.size and len(counts) < max_iter:
+        counts.append(active.size)
+        pixels = [take(value, active) for value in (u200, zom, pressure, surface_temp, T_s_datum)]
+        ustar_a, rah_a, rho_air_a = corrected_resistances(L[active], dT[active], *pixels[:4])
+        dT_a, H_a, L_a = sensible_heat(a, b, pixels[4], rho_air_a, rah_a, ustar_a, pixels[3])
+
+        with errstate(invalid="ignore", divide="ignore"):
+            change = np_abs(H_a - H[active]) / np_abs(H[active])
+            maximum(change, np_abs(L_a - L[active]) / np_abs(L[active]), out=change)
+            maximum(change, np_abs(rah_a - rah[active]) / np_abs(rah[active]), out=change)
+        H[active], L[active], rah[active] = H_a, L_a, rah_a
+
+        active = active[~((change <= tolerance) | isnan(change))]
+
+    return H.reshape(shape), counts
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -0,0 +1,191 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Bounded snapshots of the products of an iteration.
+
+The a and b calibration of the sensible heat flux recomputes ustar, rah, rho_air, the psi
+corrections, dT, H and L on every iteration, saving them all writes one scene sized raster
+per variable and iteration. A SnapshotPolicy picks the iterations worth keeping and
+IterationSnapshots writes those of each variable as the bands of a single GeoTIFF, each
+band described by its iteration.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from utils import raster_tools as ras
+
+# iterations a threshold keeps at most without a limit, the moves of the statistic are not
+# known before the loop runs and every iteration could be kept
+THRESHOLD_LIMIT = 10
+
+
+class SnapshotPolicy(object):
+    def __init__(self, every=10, first=2, last=2, threshold=None, limit=None, statistic=np.nanmean):
+        """
+        every           keep every Nth iteration, None for none
+        first           keep the first K iterations, counting the initial guess as iteration 0
+        last            keep the last K iterations
+        threshold       keep an iteration when statistic of the variable moved by more than
+                        this fraction of its value at the last iteration kept
+        limit           keep at most this many iterations besides the last K, None for no bound,
+                        or THRESHOLD_LIMIT with a threshold
+        statistic       scene statistic compared against threshold, only computed with one
+        """
+
+        self.every = every
+        self.first = first or 0
+        self.last = last or 0
+        self.threshold = threshold
+        self.limit = limit
+        self.statistic = statistic
+
+    def keep(self, i, value, kept_value):
+        """
+        whether iteration i is kept for its own sake
+
+        value is the statistic of the variable at iteration i, kept_value at the last
+        iteration kept, None if there is none yet
+        """
+
+        if i < self.first:
+            return True
+        if self.every and i % self.every == 0:
+            return True
+        if self.threshold is not None and np.isfinite(value):
+            if kept_value is None or not np.isfinite(kept_value):
+                return True
+            return abs(value - kept_value) > self.threshold * max(abs(kept_value), np.finfo(float).tiny)
+        return False
+
+    def capacity(self, iterations):
+        """ most iterations keep() can select out of iterations, the last K aside"""
+
+        limit = self.limit
+        if self.threshold is not None:
+            n = iterations
+            if limit is None:
+                limit = THRESHOLD_LIMIT
+        else:
+            n = min(self.first, iterations)
+            if self.every:
+                n += int(math.ceil(float(iterations) / self.every))
+        n = min(n, iterations)
+        if limit is not None:
+            n = min(n, limit)
+        return n
+
+
+class _SnapshotStack(object):
+    """
+    the snapshots of one variable, staged in a scratch file until the iteration is over
+
+    the scratch file is sized for every iteration the policy may keep, plus a ring of the
+    last K, and only the slots actually written take up disk space
+    """
+
+    def __init__(self, path, policy, iterations):
+        self.path = path
+        self.scratch_path = path + ".tmp"
+        self.policy = policy
+        self.capacity = policy.capacity(iterations)
+        self.buffer = None
+        self.kept = []
+        self.kept_value = None
+        self.ring = {}
+        self.ring_count = 0
+        self.latest = None
+
+    def add(self, i, array):
+        if self.buffer is None:
+            shape = (self.capacity + self.policy.last,) + array.shape
+            self.buffer = np.memmap(self.scratch_path, dtype=np.float32, mode="w+", shape=shape)
+
+        self.latest = i
+        value = self.policy.statistic(array) if self.policy.threshold is not None else None
+        if len(self.kept) < self.capacity and self.policy.keep(i, value, self.kept_value):
+            self.buffer[len(self.kept)] = array
+            self.kept.append((i, len(self.kept)))
+            self.kept_value = value
+        elif self.policy.last:
+            slot = self.capacity + self.ring_count % self.policy.last
+            self.buffer[slot] = array
+            self.ring[slot] = i
+            self.ring_count += 1
+
+    def close(self, geo, write_function=ras.array_to_raster, **options):
+        """ writes the snapshots as the bands of one GeoTIFF, returns the iterations written"""
+
+        if self.buffer is None:
+            return []
+
+        # the ring holds the last K iterations not kept otherwise, some may be older than the last K
+        ring = [(i, slot) for slot, i in self.ring.items() if i > self.latest - self.policy.last]
+        snapshots = sorted(self.kept + ring)
+        geo = dict(geo, bands=len(snapshots))
+        write_function([self.buffer[slot] for i, slot in snapshots], self.path, geo,
+                       descriptions=["iteration {0}".format(i) for i, slot in snapshots], **options)
+
+        self.buffer = None
+        os.remove(self.scratch_path)
+        return [i for i, slot in snapshots]
+
+
+class IterationSnapshots(object):
+    def __init__(self, policy, directory, geo, iterations, write_function=ras.array_to_raster, **options):
+        """
+        policy          SnapshotPolicy choosing the iterations kept
+        directory       where the "<name>_snapshots.tif" files are written
+        geo             grid of the snapshots, see spatial_reference_tools.get_raster_geo_attributes
+        iterations      most iterations the loop may run, the initial guess included
+        write_function  writes the bands, raster_tools.array_to_raster or SceneStore.write_raster
+        options         compress, tiled and block_size of raster_tools.array_to_raster
+        """
+
+        self.policy = policy
+        self.directory = directory
+        self.geo = geo
+        self.iterations = iterations
+        self.write_function = write_function
+        self.options = options
+        self.stacks = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, "{0}_snapshots.tif".format(name))
+
+    def add(self, name, i, array):
+        """ offers the value of variable name at iteration i, copied if the policy keeps it"""
+
+        if name not in self.stacks:
+            self.stacks[name] = _SnapshotStack(self.path(name), self.policy, self.iterations)
+        self.stacks[name].add(i, array)
+
+    def close(self):
+        """ writes one GeoTIFF per variable, returns a dict of the iterations written for each"""
+
+        written = {}
+        for name, stack in sorted(self.stacks.items()):
+            written[name] = stack.close(self.geo, self.write_function, **self.options)
+        self.stacks = {}
+        return written
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -0,0 +1,238 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Slope and aspect of the DEM, computed in process with Horn's method.
+
+The derivatives of a pixel use its eight neighbours, so a window of the DEM is read with a
+one pixel halo and the derivatives of a tile are those of the whole scene. Past the edges
+of the scene the halo repeats the outermost pixels. Slope and aspect are in degrees as
+gdaldem writes them, the aspect is the compass direction the slope faces and -1 on flat
+ground, which is what MetricModel.get_slope and get_aspect expect. The DEM must be in a
+projected reference system with the elevation in the units of the grid.
+
+The cosine of the solar incidence angle, Num7, is a sum of three terrain terms weighted by
+sun angles that are constant over a scene. TerrainCache keeps those terms, with the slope,
+per DEM so that the scenes of a path/row compute them once and then only weight them.
+"""
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+from osgeo import gdal
+
+from utils import raster_tools as ras
+
+HALO = 1
+
+# aspect of pixels without slope
+FLAT_ASPECT = -1.
+
+# slopes are capped to reduce DEM artifacts, degrees
+MAX_SLOPE = 30.
+
+# bands of the terrain planes, the slope in radians then the terms of the incidence angle
+PLANES = ("slope", "cos_slope", "sin_slope_cos_aspect", "sin_slope_sin_aspect")
+
+# bump when the planes change, so those built by older code are not reused
+PLANES_VERSION = 1
+
+# rows of the DEM turned into planes at a time
+PLANE_BLOCK_ROWS = 512
+
+
+def resolution(geo):
+    """ (east, south) pixel size of a grid, see spatial_reference_tools.get_raster_geo_attributes"""
+
+    geotransform = geo['geotransform']
+    return abs(geotransform[1]), abs(geotransform[5])
+
+
+def read_with_halo(path, window=None, halo=HALO, dtype=float):
+    """
+    window (xoff, yoff, xsize, ysize) of the raster at path, the whole raster if None,
+    grown by halo pixels on every side and padded with the edge pixels past the raster
+    """
+
+    data_set = gdal.Open(path)
+    cols, rows = data_set.RasterXSize, data_set.RasterYSize
+    data_set = None
+
+    xoff, yoff, xsize, ysize = window if window is not None else (0, 0, cols, rows)
+    x0, y0 = max(xoff - halo, 0), max(yoff - halo, 0)
+    x1, y1 = min(xoff + xsize + halo, cols), min(yoff + ysize + halo, rows)
+    block = ras.raster_to_array(path, window=(x0, y0, x1 - x0, y1 - y0), dtype=dtype)
+
+    pad = ((halo - (yoff - y0), halo - (y1 - yoff - ysize)), (halo - (xoff - x0), halo - (x1 - xoff - xsize)))
+    if any(before or after for before, after in pad):
+        block = np.pad(block, pad, mode="edge")
+    return block
+
+
+def horn_gradient(dem, x_res, y_res):
+    """
+    (dz/dx, dz/dy) towards the east and the south of the pixels of dem inside its one pixel halo
+
+    Horn's 3 x 3 kernel is separable, a 1 2 1 smoothing across a central difference.
+    """
+
+    across = dem[:-2] + 2 * dem[1:-1] + dem[2:]
+    dz_dx = across[:, 2:] - across[:, :-2]
+    dz_dx /= 8. * x_res
+    del across
+
+    along = dem[:, :-2] + 2 * dem[:, 1:-1] + dem[:, 2:]
+    dz_dy = along[2:] - along[:-2]
+    dz_dy /= 8. * y_res
+    return dz_dx, dz_dy
+
+
+def slope_aspect(dem, x_res, y_res):
+    """ slope and aspect in degrees of the pixels of dem inside its one pixel halo"""
+
+    dz_dx, dz_dy = horn_gradient(dem, x_res, y_res)
+    flat = (dz_dx == 0) & (dz_dy == 0)
+
+    # the slope faces down the gradient, the compass bearing of (-dz/dx east, dz/dy north)
+    aspect = np.degrees(np.arctan2(-dz_dx, dz_dy))
+    aspect %= 360.
+    aspect[flat] = FLAT_ASPECT
+
+    slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+    return slope, aspect
+
+
+def slope_radians(slope):
+    """ slope in degrees to the slope of the model, capped at MAX_SLOPE and in radians"""
+
+    return np.where(slope > MAX_SLOPE, MAX_SLOPE, slope) * math.pi / 180
+
+
+def aspect_radians(aspect):
+    """ aspect in degrees to the aspect of the model, in radians with 0 facing south"""
+
+    # flat pixels face nowhere, the -1 flag becomes 180, facing south, so that their aspect is 0.
+    # Their slope is 0, so the aspect drops out of the solar incidence angle either way
+    aspect = np.where(aspect > FLAT_ASPECT, aspect, 180.)
+
+    # convert degrees to radians and rotate half turn to put 0 aspect to south
+    return (aspect * math.pi / 180) - math.pi
+
+
+def terrain_planes(dem, x_res, y_res, dtype=np.float32):
+    """ (len(PLANES), rows, cols) array of the pixels of dem inside its one pixel halo"""
+
+    slope, aspect = slope_aspect(dem, x_res, y_res)
+    slope, aspect = slope_radians(slope), aspect_radians(aspect)
+    planes = np.empty((len(PLANES),) + slope.shape, dtype=dtype)
+    planes[0] = slope
+    planes[1] = np.cos(slope)
+    sin_slope = np.sin(slope)
+    planes[2] = sin_slope * np.cos(aspect)
+    planes[3] = sin_slope * np.sin(aspect)
+    return planes
+
+
+def incidence_coefficients(delta, phi, omega):
+    """
+    scene weights of the terrain planes cos_slope, sin_slope_cos_aspect and sin_slope_sin_aspect
+
+    delta is the solar declination, phi the latitude and omega the hour angle, in radians
+    """
+
+    return (math.sin(delta) * math.sin(phi) + math.cos(delta) * math.cos(phi) * math.cos(omega),
+            math.cos(delta) * math.sin(phi) * math.cos(omega) - math.sin(delta) * math.cos(phi),
+            math.cos(delta) * math.sin(omega))
+
+
+def cos_incidence(planes, coefficients):
+    """ cosine of the solar incidence angle, fnbank.Num7, from the terrain planes of a grid"""
+
+    cos_slope, sin_cos, sin_sin = coefficients
+    cos_theta = planes[1] * np.asarray(cos_slope, dtype=planes.dtype)
+    cos_theta += planes[2] * np.asarray(sin_cos, dtype=planes.dtype)
+    cos_theta += planes[3] * np.asarray(sin_sin, dtype=planes.dtype)
+    return cos_theta
+
+
+def scene_planes(dem_path, geo, dtype=np.float32, window=None, out=None):
+    """
+    (len(PLANES), rows, cols) planes of the DEM at dem_path on the grid geo, see PLANES
+
+    built a block of rows at a time, into out if given. With a window (xoff, yoff, xsize,
+    ysize) of the DEM the planes are those of the window, geo is then the grid of the
+    window, see raster_tools.window_geo.
+    """
+
+    rows, cols = geo['rows'], geo['cols']
+    x_res, y_res = resolution(geo)
+    if out is None:
+        out = np.empty((len(PLANES), rows, cols), dtype=dtype)
+    xoff, yoff = window[:2] if window is not None else (0, 0)
+    for row0 in xrange(0, rows, PLANE_BLOCK_ROWS):
+        row1 = min(rows, row0 + PLANE_BLOCK_ROWS)
+        dem = read_with_halo(dem_path, (xoff, yoff + row0, cols, row1 - row0), dtype=dtype)
+        out[:, row0:row1] = terrain_planes(dem, x_res, y_res, dtype)
+    return out
+
+
+class TerrainCache(object):
+    def __init__(self, cache_dir):
+        """
+        cache_dir       directory holding one .npy file of terrain planes per DEM, it may be
+                        shared by the workspaces of a path/row
+        """
+
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, dem_key, geo, dtype):
+        """ file of the planes of the DEM with contents dem_key on the grid geo"""
+
+        description = [PLANES_VERSION, dem_key, list(geo['geotransform']), geo['rows'], geo['cols'],
+                       np.dtype(dtype).str]
+        key = hashlib.sha1(json.dumps(description).encode()).hexdigest()
+        return os.path.join(self.cache_dir, "terrain_{0}.npy".format(key))
+
+    def planes(self, dem_path, dem_key, geo, dtype=np.float32, window=None):
+        """
+        memory mapped (len(PLANES), rows, cols) planes of the DEM at dem_path, see scene_planes
+
+        built on first use, dem_key is the hash of the DEM contents.
+        """
+
+        path = self.path(dem_key, geo, dtype)
+        if not os.path.isfile(path):
+            print "Calculating terrain planes of {0}... ".format(os.path.basename(dem_path))
+
+            # another run may be building the same planes
+            tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+            planes = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype,
+                                               shape=(len(PLANES), geo['rows'], geo['cols']))
+            scene_planes(dem_path, geo, dtype, window, planes)
+            planes.flush()
+            del planes
+            os.rename(tmp_path, path)
+        return np.load(path, mmap_mode="r")
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -14,6 +14,7 @@
 # limitations under the License.
 # ===============================================================================
 
+from ioconfig import IoConfig
 
 if __name__ == '__main__':
     pass
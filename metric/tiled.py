@@ -0,0 +1,441 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+"""
+Streams a METRIC scene through GDAL block aligned windows.
+
+The scene is processed in two passes over the tiles. The first pass runs the pixel wise
+chain from reflectance to soil heat flux, writes each tile of output as it goes and keeps
+only the values of the hot and cold reference pixels. The a and b coefficients are then
+calibrated on those pixels alone, and the second pass solves sensible heat and ET tile by
+tile. Peak memory depends on the tile size, not the scene size.
+"""
+
+import multiprocessing
+import os
+from multiprocessing.pool import ThreadPool
+
+from numpy import array, concatenate, flatnonzero
+
+from metric import band_cube, function_bank as fnbank
+from metric import sensible_heat as shf, terrain
+from metric.metric_py import SOLVER_LOG
+from metric.scene_store import GDAL_TYPES, variable_name
+from utils import raster_tools as ras
+
+# product name: (workspace directory attribute, file name), names match MetricModel.check_saveflag
+PRODUCT_FILES = {"slope": ("middle_dir", "slope.tif"),
+                 "aspect": ("middle_dir", "aspect.tif"),
+                 "sia": ("middle_dir", "sia_output.tif"),
+                 "LS_ref": ("middle_dir", "LS_ref{0}.tif"),
+                 "savi": ("out_dir", "savi_output.tif"),
+                 "ndvi": ("out_dir", "ndvi_output.tif"),
+                 "lai": ("out_dir", "lai_output.tif"),
+                 "bbse": ("middle_dir", "bbse_output.tif"),
+                 "nbe": ("middle_dir", "nbe_output.tif"),
+                 "p": ("middle_dir", "p_output.tif"),
+                 "w": ("middle_dir", "w_output.tif"),
+                 "entisr": ("middle_dir", "entisrBnd0{0}_output.tif"),
+                 "entsrrs": ("middle_dir", "entsrrsBnd0{0}_output.tif"),
+                 "pr": ("middle_dir", "prBnd0{0}_output.tif"),
+                 "bbat": ("middle_dir", "bbat_output.tif"),
+                 "ibbswr": ("middle_dir", "ibbswr_output.tif"),
+                 "asr": ("middle_dir", "asrBnd0{0}_output.tif"),
+                 "bsa": ("middle_dir", "bsa_output.tif"),
+                 "eae": ("middle_dir", "eae_output.tif"),
+                 "therm_rad10": ("middle_dir", "thermRad10_output.tif"),
+                 "corr_rad10": ("middle_dir", "corrRad10_output.tif"),
+                 "sfcTemp": ("middle_dir", "sfcTemp_output.tif"),
+                 "ilwr": ("middle_dir", "ilwr_output.tif"),
+                 "olwr": ("middle_dir", "olwr_output.tif"),
+                 "net_rad": ("middle_dir", "net_rad.tif"),
+                 "g_ratio": ("middle_dir", "g_ratio_output.tif"),
+                 "soil_hf": ("middle_dir", "soil_hf.tif"),
+                 "T_s_datum": ("middle_dir", "T_s_datum.tif"),
+                 "zom": ("middle_dir", "zom.tif"),
+                 "H": ("middle_dir", "H.tif"),
+                 "LE": ("out_dir", "LE.tif"),
+                 "LH_vapor": ("out_dir", "LH_vapor_output.tif"),
+                 "ET_inst": ("out_dir", "ET_inst.tif"),
+                 "ET_frac": ("out_dir", "ET_frac.tif"),
+                 "ET_24hr": ("out_dir", "ET_24hr.tif")}
+
+# products handed from the first pass to the second, always written
+HANDOFF_PRODUCTS = ["zom", "p", "sfcTemp", "T_s_datum", "net_rad", "soil_hf"]
+
+# pixel values gathered at the reference pixels for the a and b calibration
+REFERENCE_INPUTS = {"u200": "u200", "zom": "zom", "pressure": "p", "surface_temp": "sfcTemp",
+                    "T_s_datum": "T_s_datum", "net_rad": "net_rad", "soil_hf": "soil_hf"}
+
+
+def product_path(mike, name, index=None):
+    """ path in the workspace of mike where the named product is written"""
+
+    dir_attr, file_name = PRODUCT_FILES[name]
+    if index is not None:
+        file_name = file_name.format(index)
+    return os.path.join(getattr(mike, dir_attr), file_name)
+
+
+def read_product(mike, name, window, dtype):
+    """ window of a product written by an earlier pass, from the store of mike if it has one"""
+
+    if mike.store is not None:
+        return mike.store.read(variable_name(product_path(mike, name)), window).astype(dtype)
+    return ras.raster_to_array(product_path(mike, name), window=window, dtype=dtype)
+
+
+class TileWriter(object):
+    """
+    keeps one open GeoTIFF per product and writes windows of it as tiles come in,
+    or writes them to the store of the model if it has one
+
+    products are written in their precision, see metric.precision, so that those handed
+    from the first pass to the second keep it
+    """
+
+    def __init__(self, mike):
+        self.mike = mike
+        self.geo = mike.raster_geo
+        self.datasets = {}
+
+    def write(self, name, array, window, index=None):
+        path = product_path(self.mike, name, index)
+        dtype = self.mike.precision.dtype_for(name)
+        if self.mike.store is not None:
+            self.mike.store.write(variable_name(path), array.astype(dtype, copy=False), window)
+            return
+        if path not in self.datasets:
+            self.datasets[path] = ras.create_raster(path, self.geo, GDAL_TYPES[dtype.name])
+        ras.write_window(self.datasets[path], array, window)
+
+    def write_products(self, products, window, always=()):
+        """ writes every product the saveflag asks for, and those named in always"""
+
+        for name, array in products.items():
+            if name not in PRODUCT_FILES:
+                continue
+            if name not in always and not self.mike.check_saveflag(name):
+                continue
+            if getattr(array, "ndim", 2) == 3:
+                for i, band in enumerate(array):
+                    self.write(name, band, window, self._band_index(name, i))
+            else:
+                self.write(name, array, window)
+
+    def close(self):
+        for path in self.datasets:
+            self.datasets[path].FlushCache()
+        self.datasets = {}
+
+    @staticmethod
+    def _band_index(name, i):
+        if name == "LS_ref":
+            return i + 2
+        return i + 1
+
+
+def _wind_speed_at_blending_height(mike, constants, dem):
+    """ u200 for the pixels of dem, scaled by the terrain weighting coefficient in mountains"""
+
+    z_wx = mike.wx_elev
+    if z_wx < 1:  # prevents errors
+        z_wx = 1
+
+    u200 = fnbank.Num32(constants["wind_speed"], mike.wx_zom, z_wx)
+    if mike.mountainous_terrain:
+        u200 = fnbank.Num36(dem, z_wx) * u200
+    return u200
+
+
+def _momentum_roughness_length(mike, lai, slope):
+    zom = fnbank.Num33(lai)
+    if mike.mountainous_terrain:
+        zom = fnbank.Num35(zom, slope)
+    return zom
+
+
+def _tile_grid(mike, window):
+    """ the valid pixels of the window when mike is compressed, see MetricModel.pixel_grid"""
+
+    if mike.compressed:
+        return mike.pixel_grid(window)
+    return None
+
+
+def _compress(grid, array):
+    return array if grid is None else grid.compress(array)
+
+
+def _expand(grid, array):
+    return array if grid is None else grid.expand(array)
+
+
+def net_radiation_tile(mike, constants, window):
+    """
+    Runs the pixel wise chain of MetricModel from the raw bands to soil heat flux on one window
+
+    returns a dict of named products for the window, in the precision of mike.precision.
+    A compressed model computes on the valid pixels of the window only.
+    """
+
+    precision = mike.precision
+    grid = _tile_grid(mike, window)
+    dem = _compress(grid, ras.raster_to_array(mike.dem_path, window=mike.scene_window(window), dtype=precision.dtype))
+
+    # the terrain planes of the whole DEM are built once, before the tiles, see run_tiled
+    xoff, yoff, xsize, ysize = window
+    planes = _compress(grid, mike.terrain_planes()[:, yoff:yoff + ysize, xoff:xoff + xsize])
+    slope = array(planes[0])
+    sia = terrain.cos_incidence(planes, constants["incidence_coefficients"])
+    del planes
+
+    dn_bands = [_compress(grid, band.read(window)) for band in mike.landsat_bands[:6]]
+    refl_bands = band_cube.reflectance(dn_bands, sia, precision.dtype, [mike.dn_luts[i] for i in range(2, 8)])
+
+    savi = fnbank.Num19(refl_bands[3], refl_bands[2], mike.L_green_fac)
+    ndvi = fnbank.Num23(refl_bands[3], refl_bands[2])
+    lai = fnbank.Num18(savi)
+
+    bbse = fnbank.Num17(lai)
+    nbe = fnbank.Num22(lai)
+
+    p = fnbank.Num5(dem)
+    vapor_pressure = fnbank.Saturation_Vapor_Pressure(constants["dewp_C"])
+    w = fnbank.Num6(vapor_pressure, p)
+
+    kt = 1.0
+    entisr = band_cube.narrowband_transmittance(p, w, sia, kt)
+    entsrrs = band_cube.narrowband_transmittance(p, w, 1, kt)
+    pr = band_cube.path_reflectance(entisr)
+
+    bbat = fnbank.Num4(*precision.promote("bbat", p, w, sia) + [kt])
+    ibbswr = fnbank.Num3(sia, bbat, constants["earth_sun_distance"])
+
+    asr = band_cube.at_surface_reflectance(refl_bands, entisr, entsrrs, pr)
+    bsa = band_cube.broadband_albedo(asr)
+    eae = fnbank.Num25(bbat)
+
+    therm_rad10 = mike.dn_luts[10](_compress(grid, mike.B10_rast.read(window)))
+    corr_rad10 = fnbank.Num21(therm_rad10, 0.91, 0.866, nbe, 1.32)
+    sfc_temp = fnbank.Num20(corr_rad10, nbe, 774.89, 1321.08)
+
+    ilwr = fnbank.Num24(eae, constants["temp_C_mid"] + 273)
+    olwr = fnbank.Num16(bbse, sfc_temp)
+    net_rad = fnbank.Num2(ibbswr, bsa, olwr, ilwr, bbse)
+
+    g_ratio = fnbank.Num26(bsa, sfc_temp, ndvi)
+    soil_hf = net_rad * g_ratio
+
+    T_s_datum = fnbank.Datum_Ref_Temp(sfc_temp, dem, mike.wx_elev)
+    zom = _momentum_roughness_length(mike, lai, slope)
+    u200 = _wind_speed_at_blending_height(mike, constants, dem)
+
+    products = {"slope": slope, "sia": sia, "LS_ref": refl_bands, "savi": savi, "ndvi": ndvi,
+                "lai": lai, "bbse": bbse, "nbe": nbe, "p": p, "w": w, "entisr": entisr, "entsrrs": entsrrs,
+                "pr": pr, "bbat": bbat, "ibbswr": ibbswr, "asr": asr, "bsa": bsa, "eae": eae,
+                "therm_rad10": therm_rad10, "corr_rad10": corr_rad10, "sfcTemp": sfc_temp, "ilwr": ilwr,
+                "olwr": olwr, "net_rad": net_rad, "g_ratio": g_ratio, "soil_hf": soil_hf, "T_s_datum": T_s_datum,
+                "zom": zom, "u200": u200}
+    if mike.check_saveflag("aspect"):
+        # the halo makes the aspect of the tile that of the whole DEM
+        dem_halo = terrain.read_with_halo(mike.dem_path, mike.scene_window(window), dtype=precision.dtype)
+        aspect = terrain.slope_aspect(dem_halo, *terrain.resolution(mike.raster_geo))[1]
+        products["aspect"] = terrain.aspect_radians(_compress(grid, aspect))
+    return dict((name, precision.cast(name, _expand(grid, product))) for name, product in products.items())
+
+
+def evapotranspiration_tile(mike, constants, window, history):
+    """
+    Solves sensible heat with the calibrated (a, b) sequence and carries it through to daily ET
+
+    with mike.sensible_heat_mode "reference", or a solver that is not lagged, only the
+    converged pair is used, see sensible_heat.solve_sensible_heat, otherwise the whole
+    sequence is replayed.
+
+    reads the products of the first pass back from the workspace for this window.
+    """
+
+    dtype = mike.precision.dtype
+    grid = _tile_grid(mike, window)
+    first_pass = dict((name, _compress(grid, read_product(mike, name, window, dtype))) for name in HANDOFF_PRODUCTS)
+    dem = _compress(grid, ras.raster_to_array(mike.dem_path, window=mike.scene_window(window), dtype=dtype))
+    u200 = _wind_speed_at_blending_height(mike, constants, dem)
+
+    # the stability iteration runs in the precision of H, see metric.precision
+    pixels = mike.precision.promote("H", u200, first_pass["zom"], first_pass["p"], first_pass["sfcTemp"],
+                                    first_pass["T_s_datum"])
+    if mike.sensible_heat_mode == "reference" or not mike.solver.lagged:
+        a, b = history[-1]
+        H, active = shf.solve_sensible_heat(a, b, *pixels)
+    else:
+        H = shf.replay_sensible_heat(history, *pixels)
+    LE = fnbank.Num1(first_pass["net_rad"], first_pass["soil_hf"], H)
+    lhv = fnbank.Num53(first_pass["sfcTemp"])
+    et_inst = fnbank.Num52(LE)
+    et_frac = fnbank.Num54(et_inst, constants["ET_ref_hr"])
+    et_day = fnbank.Num55(et_frac, constants["ET_ref_day"])
+
+    products = {"H": H, "LE": LE, "LH_vapor": lhv, "ET_inst": et_inst, "ET_frac": et_frac, "ET_24hr": et_day}
+    return dict((name, mike.precision.cast(name, _expand(grid, product))) for name, product in products.items())
+
+
+def _reference_pixels(products, mask):
+    """ values of the masked pixels of this tile, None if it holds no reference pixels"""
+
+    index = flatnonzero(mask)
+    if not index.size:
+        return None
+    return dict((key, fnbank.ref_pix_values(products[name], index)) for key, name in REFERENCE_INPUTS.items())
+
+
+def _concatenate_reference_pixels(tiles):
+    """ joins the per tile reference values in tile order, so results do not depend on the pool"""
+
+    tiles = [tiles[i] for i in sorted(tiles)]
+    if not tiles:
+        return {}
+    return dict((key, concatenate([tile[key] for tile in tiles])) for key in REFERENCE_INPUTS)
+
+
+# the job run by the tile pool, module level so that forked worker processes inherit it
+_TILE_JOB = {}
+
+
+def _run_tile_job(indexed_window):
+    """ runs one tile, returns its result with the profiler spans recorded in a worker process"""
+
+    i, window = indexed_window
+    profiler = _TILE_JOB["profiler"]
+    recorded = len(profiler.spans)
+    products = _TILE_JOB["func"](*(_TILE_JOB["args"] + (window,)))
+    spans = []
+    if os.getpid() != _TILE_JOB["pid"]:
+        spans = profiler.spans[recorded:]
+        del profiler.spans[recorded:]
+    return i, window, products, spans
+
+
+def map_tiles(mike, func, args, windows):
+    """
+    Yields (index, window, products) for every window, where products is func(*args + (window,))
+
+    with mike.workers > 1 the tiles are computed on a pool of threads, or of processes if
+    mike.executor is "process" (this relies on fork, so Linux and OS X only). Results come
+    back to the calling thread as they finish, so every write to disk happens there. The
+    profiler spans of the worker processes come back with the tiles, see RunProfiler.merge.
+    """
+
+    _TILE_JOB["func"], _TILE_JOB["args"] = mike.profiler.wrap(func.__name__, func), args
+    _TILE_JOB["profiler"], _TILE_JOB["pid"] = mike.profiler, os.getpid()
+    jobs = list(enumerate(windows))
+
+    if not mike.workers or mike.workers < 2:
+        for job in jobs:
+            yield _run_tile_job(job)[:3]
+        return
+
+    if mike.executor == "process":
+        pool = multiprocessing.Pool(mike.workers)
+    else:
+        pool = ThreadPool(mike.workers)
+
+    try:
+        for i, window, products, spans in pool.imap_unordered(_run_tile_job, jobs):
+            mike.profiler.merge(spans)
+            yield i, window, products
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _evapotranspiration_job(mike, constants, history, window):
+    return evapotranspiration_tile(mike, constants, window, history)
+
+
+def run_tiled(mike, constants):
+    """
+    Runs the METRIC model on a MetricModel built with a tile_size
+
+    constants is the dict returned by metric_py.get_scene_constants. Tiles are spread over
+    mike.workers, the only synchronization point is the calibration of the sensible heat
+    coefficients on the reference pixels between the two passes. Returns the history of
+    (a, b) coefficients of that calibration.
+    """
+
+    windows = ras.get_block_windows(mike.B2_path, mike.tile_size, window=mike.window)
+    print("Processing scene in {0} tiles of up to {1} pixels on {2} workers".format(len(windows), mike.tile_size,
+                                                                                   mike.workers or 1))
+
+    # built by one thread, or before the worker processes fork
+    mike.terrain_planes()
+    constants = dict(constants, incidence_coefficients=terrain.incidence_coefficients(
+        constants["solar_declination_angle"], constants["latitude"], constants["hour_angle"]))
+
+    hot_mask = ras.rasterize_shapefile(mike.hot_shape_path, mike.raster_geo)
+    cold_mask = ras.rasterize_shapefile(mike.cold_shape_path, mike.raster_geo)
+    hot_tiles, cold_tiles = {}, {}
+
+    # first pass, everything up to the scene wide reductions
+    writer = TileWriter(mike)
+    span = mike.profiler.start("net radiation pass", tiles=len(windows))
+    for n, (i, window, products) in enumerate(map_tiles(mike, net_radiation_tile, (mike, constants), windows)):
+        xoff, yoff, xsize, ysize = window
+        print("net radiation, tile {0} of {1}".format(n + 1, len(windows)))
+        writer.write_products(products, window, always=HANDOFF_PRODUCTS)
+
+        for masks, tiles in ((hot_mask, hot_tiles), (cold_mask, cold_tiles)):
+            pixels = _reference_pixels(products, masks[yoff:yoff + ysize, xoff:xoff + xsize])
+            if pixels is not None:
+                tiles[i] = pixels
+        del products
+    writer.close()
+    mike.profiler.stop(span)
+
+    # the bands are only read by the first pass
+    for band in mike.landsat_bands:
+        band.release()
+
+    if not hot_tiles or not cold_tiles:
+        raise Exception("no pixels of the scene fall inside the hot and cold reference shapefiles!")
+
+    hot = _concatenate_reference_pixels(hot_tiles)
+    cold = _concatenate_reference_pixels(cold_tiles)
+    LE_cold = constants["LE_reference"] * mike.LE_cold_cal_factor
+    with mike.profiler.span("calibration"):
+        history = shf.calibrate_coefficients(hot, cold, LE_cold, solver=mike.solver)
+    mike.solver.write_log(os.path.join(mike.out_dir, SOLVER_LOG))
+
+    # second pass, sensible heat through ET with fixed coefficients
+    args = (mike, constants)
+    span = mike.profiler.start("evapotranspiration pass", tiles=len(windows))
+    for n, (i, window, products) in enumerate(map_tiles(mike, _evapotranspiration_job, args + (history,), windows)):
+        print("sensible heat and ET, tile {0} of {1}".format(n + 1, len(windows)))
+        writer.write_products(products, window, always=["H", "ET_24hr"])
+        del products
+    writer.close()
+    mike.profiler.stop(span)
+
+    # a compressed model reads the bands again to find the valid pixels of each tile
+    for band in mike.landsat_bands:
+        band.release()
+
+    return history
+
+
+if __name__ == '__main__':
+    pass
+
+# ===============================================================================
@@ -1039,7 +1039,7 @@ class time_series:
         self.clean(col_header)
 
         # x and y data for interpolation
-        y = self.col_data[col_header]
+        y = map(float, self.col_data[col_header])
         x = self.time_seconds
 
         if not isinstance(time_obj, datetime):
@@ -20,6 +20,19 @@ import unittest
 def suite():
     print 'Testing.......................................'
     from tests.test_integration.test_landsat import USGSLandstatTestCase
+    from tests.test_unit.test_band_cube import BandCubeTestCase
+    from tests.test_unit.test_function_bank import FunctionBankTestCase
+    from tests.test_unit.test_input_manifest import InputManifestTestCase
+    from tests.test_unit.test_product_cache import ProductCacheTestCase
+    from tests.test_unit.test_precision import PrecisionTestCase
+    from tests.test_unit.test_profiler import ProfilerTestCase
+    from tests.test_unit.test_radiometry import RadiometryTestCase
+    from tests.test_unit.test_product_graph import ProductGraphTestCase
+    from tests.test_unit.test_scene_store import SceneStoreTestCase
+    from tests.test_unit.test_sensible_heat import SensibleHeatTestCase
+    from tests.test_unit.test_snapshots import SnapshotsTestCase
+    from tests.test_unit.test_terrain import TerrainTestCase
+    from tests.test_unit.test_tiled import TiledTestCase
     from tests.test_unit.test_vector import VectorTestCase
     from tests.test_unit.test_web_tools import WebToolsTestCase
 
@@ -27,6 +40,19 @@ def suite():
     test_suite = unittest.TestSuite()
 
     tests = (USGSLandstatTestCase,
+             BandCubeTestCase,
+             FunctionBankTestCase,
+             InputManifestTestCase,
+             ProductCacheTestCase,
+             PrecisionTestCase,
+             ProfilerTestCase,
+             RadiometryTestCase,
+             ProductGraphTestCase,
+             SceneStoreTestCase,
+             SensibleHeatTestCase,
+             SnapshotsTestCase,
+             TerrainTestCase,
+             TiledTestCase,
              VectorTestCase,
              WebToolsTestCase)
 
@@ -0,0 +1,92 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import unittest
+
+import numpy as np
+
+from metric import band_cube
+from metric import function_bank as fnbank
+from metric.band_cube import NARROWBAND_TRANSMITTANCE_CONSTANTS, PATH_REFLECTANCE_WEIGHTS
+
+
+class BandCubeTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(13)
+        shape = (4, 5)
+        self.dn = [rng.randint(0, 30000, shape).astype(np.uint16) for _ in range(6)]
+        self.cos_sia = rng.uniform(0.3, 1., shape)
+        self.p = rng.uniform(80., 101., shape)
+        self.w = rng.uniform(0.5, 3., shape)
+
+    def tearDown(self):
+        pass
+
+    def test_matches_per_band_equations(self):
+        refl = band_cube.reflectance(self.dn, self.cos_sia)
+        entisr = band_cube.narrowband_transmittance(self.p, self.w, self.cos_sia)
+        entsrrs = band_cube.narrowband_transmittance(self.p, self.w, 1)
+        pr = band_cube.path_reflectance(entisr)
+        asr = band_cube.at_surface_reflectance(refl, entisr, entsrrs, pr)
+        self.assertEqual(asr.shape, (6, 4, 5))
+
+        asr_bands = []
+        for i, c in enumerate(NARROWBAND_TRANSMITTANCE_CONSTANTS):
+            refl_i = fnbank.Num10(self.dn[i], self.cos_sia)
+            entisr_i = fnbank.Num12(self.p, self.w, self.cos_sia, 1.0, *c)
+            entsrrs_i = fnbank.Num13(self.p, self.w, 1, 1.0, *c)
+            pr_i = fnbank.Num14(entisr_i, PATH_REFLECTANCE_WEIGHTS[i])
+            asr_bands.append(fnbank.Num11(refl_i, entisr_i, entsrrs_i, pr_i))
+
+            np.testing.assert_allclose(refl[i], refl_i)
+            np.testing.assert_allclose(entisr[i], entisr_i)
+            np.testing.assert_allclose(entsrrs[i], entsrrs_i)
+            np.testing.assert_allclose(pr[i], pr_i)
+            np.testing.assert_allclose(asr[i], asr_bands[i])
+
+        np.testing.assert_allclose(band_cube.broadband_albedo(asr), fnbank.Num15(asr_bands))
+
+    def test_pixel_vectors(self):
+        refl = band_cube.reflectance(self.dn, self.cos_sia)
+        entisr = band_cube.narrowband_transmittance(self.p, self.w, self.cos_sia)
+        pr = band_cube.path_reflectance(entisr)
+
+        # the valid pixels of a compressed model, held as vectors
+        valid = self.dn[0] >= 1
+        entisr_pixels = band_cube.narrowband_transmittance(self.p[valid], self.w[valid], self.cos_sia[valid])
+        self.assertEqual(entisr_pixels.shape, (6, valid.sum()))
+        np.testing.assert_allclose(entisr_pixels, entisr[:, valid])
+        np.testing.assert_allclose(band_cube.path_reflectance(entisr_pixels), pr[:, valid])
+        np.testing.assert_allclose(band_cube.reflectance([dn[valid] for dn in self.dn], self.cos_sia[valid]),
+                                   refl[:, valid])
+
+    def test_precision(self):
+        p, w, cos_sia = [a.astype(np.float32) for a in (self.p, self.w, self.cos_sia)]
+        refl = band_cube.reflectance(self.dn, cos_sia, np.float32)
+        entisr = band_cube.narrowband_transmittance(p, w, cos_sia)
+        entsrrs = band_cube.narrowband_transmittance(p, w, 1)
+        asr = band_cube.at_surface_reflectance(refl, entisr, entsrrs, band_cube.path_reflectance(entisr))
+
+        for cube in (refl, entisr, entsrrs, asr, band_cube.broadband_albedo(asr)):
+            self.assertEqual(cube.dtype, np.float32)
+        self.assertTrue(np.isnan(refl[np.array(self.dn) < 1]).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
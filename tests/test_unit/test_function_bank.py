@@ -0,0 +1,154 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import unittest
+
+import numpy as np
+
+from metric import function_bank as fnbank
+
+
+class FunctionBankTestCase(unittest.TestCase):
+    def setUp(self):
+        # a small 'scene', reference values were worked out by hand with math.*
+        self.shape = (3, 4)
+        self.p = np.full(self.shape, 85.0)
+        self.w = np.full(self.shape, 2.5)
+        self.cth = 0.8
+        self.kt = 1.0
+
+    def tearDown(self):
+        pass
+
+    def assertRaster(self, arr, value):
+        self.assertIsInstance(arr, np.ndarray)
+        self.assertEqual(arr.shape, self.shape)
+        np.testing.assert_allclose(arr, np.full(self.shape, value), rtol=1e-10)
+
+    def test_ref_pix_mean(self):
+        raster = np.arange(12.).reshape(self.shape)
+        index = np.flatnonzero(raster % 5 == 0)
+        self.assertAlmostEqual(fnbank.ref_pix_mean(raster, index), 5.)
+        self.assertAlmostEqual(fnbank.ref_pix_mean(2.5, index), 2.5)
+        np.testing.assert_array_equal(fnbank.ref_pix_values(raster, index), [0., 5., 10.])
+
+    def test_raster_stats(self):
+        raster = np.random.RandomState(3).normal(10., 2., (300, 400))
+        raster[:5] = np.nan
+        stats = fnbank.raster_stats(raster, "raster")
+        valid = raster[5:]
+        self.assertEqual((stats.count, stats.nan_count), (valid.size, 2000))
+        self.assertEqual((stats.minimum, stats.maximum), (valid.min(), valid.max()))
+        self.assertAlmostEqual(stats.mean, valid.mean(), places=10)
+        self.assertAlmostEqual(stats.std, valid.std(), places=10)
+
+        sample = fnbank.raster_stats(raster, stride=10)
+        self.assertEqual((sample.count + sample.nan_count, sample.stride), (1200, 10))
+        self.assertEqual(fnbank.raster_stats(np.uint8(7)).mean, 7.)
+        self.assertEqual(fnbank.raster_stats(np.full(3, np.nan)).count, 0)
+
+        with fnbank.collect_stats() as records:
+            fnbank.print_stats([raster, 2.], "layer")
+        self.assertEqual([r.name for r in records], ["layer0", "layer1"])
+
+    def test_thermal_radiance(self):
+        dn = np.array([[0, 20000], [1, 20000]], dtype=np.uint16)
+        rad = fnbank.L8_Thermal_Radiance(dn)
+        self.assertTrue(np.isnan(rad[0, 0]))
+        self.assertAlmostEqual(rad[0, 1], 6.784)
+        self.assertAlmostEqual(rad[1, 0], 0.1003342)
+
+    def test_num4(self):
+        self.assertRaster(fnbank.Num4(self.p, self.w, self.cth, self.kt), 0.8270002612312886)
+
+    def test_num7(self):
+        s = np.full(self.shape, 0.2)
+        gamma = np.full(self.shape, 0.5)
+        out = fnbank.Num7(0.3, 0.8, s, gamma, 0.1)
+        self.assertRaster(out[0], 0.9489049120129018)
+        for term, value in zip(out[1:], [0.20776746987871061, -0.035896820922319474, 0.6490629760866488,
+                                         0.11888713702607079, 0.009084149943791121]):
+            self.assertRaster(term, value)
+
+    def test_num10(self):
+        dn = np.array([[0, 20000]], dtype=np.uint16)
+        refl = fnbank.Num10(dn, np.array([[0.9, 0.9]]))
+        self.assertTrue(np.isnan(refl[0, 0]))
+        self.assertAlmostEqual(refl[0, 1], 0.33333333333333337)
+
+    def test_num12_num13(self):
+        c = [0.987, -0.00071, 0.000036, 0.0880, 0.0789]
+        self.assertRaster(fnbank.Num12(self.p, self.w, self.cth, self.kt, *c), 0.8855012598930203)
+        self.assertRaster(fnbank.Num13(self.p, self.w, 1, self.kt, *c), 0.9211514890160828)
+
+    def test_num17(self):
+        lai = np.array([2.0, 4.0])
+        np.testing.assert_allclose(fnbank.Num17(lai), [0.97, 0.98])
+
+    def test_num18(self):
+        savi = np.array([0.05, 0.4, 0.7])
+        np.testing.assert_allclose(fnbank.Num18(savi), [0., 0.780485290021149, 6.])
+
+    def test_num19_num23(self):
+        b5 = np.full(self.shape, 0.4)
+        b4 = np.full(self.shape, 0.1)
+        self.assertRaster(fnbank.Num19(b5, b4, 0.5), 0.45)
+        self.assertRaster(fnbank.Num23(b5, b4), 0.6)
+
+    def test_num20(self):
+        corr_rad = np.full(self.shape, 9.5)
+        self.assertRaster(fnbank.Num20(corr_rad, 0.98, 774.89, 1321.08), 300.67877509583906)
+
+    def test_num22(self):
+        lai = np.array([2.0, 4.0])
+        np.testing.assert_allclose(fnbank.Num22(lai), [0.9766, 0.98])
+
+    def test_nodata(self):
+        # fill pixels stay NaN through the conditionals, as they stayed NoData with arcpy Con
+        with np.errstate(invalid='ignore'):
+            np.testing.assert_array_equal(fnbank.Num18(np.array([np.nan, 0.05, 0.7])), [np.nan, 0., 6.])
+            lai = np.array([np.nan, 4.0])
+            np.testing.assert_array_equal(fnbank.Num17(lai), [np.nan, 0.98])
+            np.testing.assert_array_equal(fnbank.Num22(lai), [np.nan, 0.98])
+            np.testing.assert_array_equal(fnbank.Num33(np.array([np.nan, 0.1])), [np.nan, 0.005])
+
+    def test_num25(self):
+        self.assertRaster(fnbank.Num25(np.full(self.shape, 0.75)), 0.7598381198161615)
+
+    def test_aerodynamics(self):
+        self.assertRaster(fnbank.Num30(np.full(self.shape, 0.4)), 18.266660204597503)
+        self.assertRaster(fnbank.Num31(5.0, np.full(self.shape, 0.05)), 0.24716514717830676)
+        self.assertAlmostEqual(fnbank.Num32(3.0, 0.01, 2.0), 5.6075279380565615)
+        np.testing.assert_allclose(fnbank.Num33(np.array([0.1, 1.0])), [0.005, 0.018])
+        self.assertRaster(fnbank.Num38(5.0, np.full(self.shape, 0.05), 0.3), 0.025644073933644426)
+        self.assertRaster(fnbank.Num39(0.2, 0.1, np.full(self.shape, 0.4)), 17.656904107036528)
+
+    def test_stability_corrections(self):
+        L = np.full(self.shape, -50.)
+        self.assertRaster(fnbank.Num41(L), 1.9217598689670066)
+        self.assertRaster(fnbank.Num42a(L), 0.2626045615502078)
+        self.assertRaster(fnbank.Num42b(L), 0.015811343265472306)
+
+        L = np.full(self.shape, 100.)
+        self.assertRaster(fnbank.Num44(L), -10.)
+        self.assertRaster(fnbank.Num45a(L), -0.1)
+        self.assertRaster(fnbank.Num45b(L), -0.005)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,118 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from metric import textio
+from metric.input_manifest import InputManifest
+from metric.prepare_metric_env import prepare_metric_env
+from metric.product_cache import ProductCache
+
+
+class InputManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.sources = os.path.join(self.temp_folder, 'sources')
+        os.makedirs(self.sources)
+
+        names = ['B{0}.tif'.format(band) for band in [2, 3, 4, 5, 6, 7, 10, 11]]
+        names += ['MTL.txt', 'dem.tif', 'wx.txt', 'hot.shp', 'hot.dbf', 'cold.shp', 'cold.dbf']
+        for name in names:
+            with open(os.path.join(self.sources, name), 'w') as f:
+                f.write(name)
+        self.cache = ProductCache(os.path.join(self.temp_folder, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def prepare(self, workspace, input_mode):
+        source = lambda name: os.path.join(self.sources, name)
+        workspace = os.path.join(self.temp_folder, workspace)
+        prepare_metric_env(workspace, *[source('B{0}.tif'.format(band)) for band in [2, 3, 4, 5, 6, 7, 10, 11]] +
+                           [source('MTL.txt'), source('dem.tif'), source('hot.shp'), source('cold.shp'),
+                            source('wx.txt')], input_mode=input_mode)
+        return workspace, textio.IoConfig(os.path.join(workspace, 'config.txt'))
+
+    def test_reference(self):
+        workspace, config = self.prepare('reference', 'reference')
+        self.assertEqual(config['dem_path'], os.path.join(self.sources, 'dem.tif'))
+        self.assertEqual(config['hot_shp_path'], os.path.join(self.sources, 'hot.shp'))
+        self.assertEqual(os.listdir(os.path.join(workspace, 'input_landsat')), [])
+
+        # unchanged inputs are not read
+        hashed = []
+        file_key = lambda path: hashed.append(path) or self.cache.file_key(path)
+        manifest = InputManifest(workspace)
+        self.assertEqual(len(manifest.inputs), 15)
+        manifest.verify(file_key)
+        self.assertEqual(hashed, [])
+
+        # the sha1 is recorded once the model needs the key of an input
+        self.assertEqual(manifest.file_key(config['dem_path']), self.cache.file_key(config['dem_path']))
+        manifest.flush()
+        self.assertEqual([name for name, entry in InputManifest(workspace).inputs.items() if entry['sha1']],
+                         [config['dem_path']])
+
+        # rewritten with the same contents is fine once hashed, other contents are not
+        del hashed[:]
+        time.sleep(0.01)
+        with open(os.path.join(self.sources, 'dem.tif'), 'w') as f:
+            f.write('dem.tif')
+        InputManifest(workspace).verify(file_key)
+        self.assertEqual(hashed, [config['dem_path']])
+        with open(os.path.join(self.sources, 'dem.tif'), 'w') as f:
+            f.write('another dem')
+        self.assertRaises(Exception, InputManifest(workspace).verify, self.cache.file_key)
+
+        # an input touched before it was ever hashed cannot be checked
+        os.utime(os.path.join(self.sources, 'wx.txt'), (0, 0))
+        self.assertRaises(Exception, InputManifest(workspace).verify, self.cache.file_key)
+
+    def test_copy(self):
+        workspace, config = self.prepare('copy', 'copy')
+        self.assertEqual(config['dem_path'], os.path.join('input_dem', 'dem.tif'))
+        self.assertNotEqual(os.stat(os.path.join(workspace, config['dem_path'])).st_ino,
+                            os.stat(os.path.join(self.sources, 'dem.tif')).st_ino)
+
+        # the copies are checked, not the sources
+        InputManifest(workspace).verify(self.cache.file_key)
+        os.remove(os.path.join(self.sources, 'dem.tif'))
+        InputManifest(workspace).verify(self.cache.file_key)
+        with open(os.path.join(workspace, config['dem_path']), 'w') as f:
+            f.write('another dem')
+        self.assertRaises(Exception, InputManifest(workspace).verify, self.cache.file_key)
+
+    def test_link(self):
+        workspace, config = self.prepare('link', 'link')
+        self.assertEqual(config['dem_path'], os.path.join('input_dem', 'dem.tif'))
+        self.assertEqual(os.stat(os.path.join(workspace, config['dem_path'])).st_ino,
+                         os.stat(os.path.join(self.sources, 'dem.tif')).st_ino)
+
+        os.remove(os.path.join(self.sources, 'wx.txt'))
+        InputManifest(workspace).verify(self.cache.file_key)
+        os.remove(os.path.join(workspace, config['weather_path']))
+        self.assertRaises(Exception, InputManifest(workspace).verify, self.cache.file_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,62 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import unittest
+
+import numpy as np
+
+from metric import function_bank as fnbank
+from metric.precision import PrecisionPolicy
+
+
+class PrecisionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dn = np.array([[0, 9000], [12000, 30000]], dtype=np.uint16)
+        self.cos_sia = np.full((2, 2), 0.8, dtype=np.float32)
+
+    def tearDown(self):
+        pass
+
+    def test_policy(self):
+        policy = PrecisionPolicy()
+        self.assertEqual(policy.dtype_for("ndvi"), np.float32)
+        self.assertEqual(policy.dtype_for("H"), np.float64)
+
+        bands = policy.cast("asr", [np.ones(3), np.zeros(3)])
+        self.assertEqual([band.dtype for band in bands], [np.float32, np.float32])
+        self.assertEqual(policy.cast("bbat", np.ones(3, dtype=np.float32)).dtype, np.float64)
+        self.assertEqual(policy.cast("ndvi", 0.5), 0.5)
+
+        self.assertEqual(PrecisionPolicy("float64").dtype_for("ndvi"), np.float64)
+        self.assertRaises(ValueError, PrecisionPolicy, "int16")
+
+    def test_conversion_keeps_precision(self):
+        refl = fnbank.Num10(self.dn, self.cos_sia, np.float32)
+        self.assertEqual(refl.dtype, np.float32)
+        self.assertTrue(np.isnan(refl[0, 0]))
+        np.testing.assert_allclose(refl, fnbank.Num10(self.dn, self.cos_sia.astype(float)), rtol=1e-6)
+
+        self.assertEqual(fnbank.L8_Thermal_Radiance(self.dn, np.float32).dtype, np.float32)
+        self.assertEqual(fnbank.Num23(refl, refl * 0.5).dtype, np.float32)
+        self.assertEqual(fnbank.Num19(refl, refl * 0.5, 0.5).dtype, np.float32)
+        self.assertEqual(fnbank.Num23(self.dn + 1, self.dn).dtype, np.float64)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
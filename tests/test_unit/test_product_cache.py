@@ -0,0 +1,96 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from metric.product_cache import ProductCache
+
+
+class ProductCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.band_path = os.path.join(self.cache_dir, "band.bin")
+        np.arange(12.).tofile(self.band_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build(self, cache, band, factor):
+        """ a two step chain, double <- band and scaled <- (double, factor)"""
+
+        band = cache.register(band, cache.file_key(self.band_path))
+        double_key = cache.product_key("double", [band])
+        double = cache.load(double_key)
+        if double is None:
+            double = cache.store("double", double_key, band * 2, [band])
+
+        scaled_key = cache.product_key("scaled", [double, factor])
+        scaled = cache.load(scaled_key)
+        if scaled is None:
+            scaled = cache.store("scaled", scaled_key, double * factor, [double, factor])
+        return double_key, scaled_key
+
+    def test_reuse_and_invalidation(self):
+        band = np.arange(12.)
+        cache = ProductCache(self.cache_dir)
+        double_key, scaled_key = self.build(cache, band, 1.05)
+        self.assertFalse(os.path.isfile(cache.index_path))
+        cache.flush()
+
+        # a new session finds both products, changing the factor only rebuilds the last step
+        cache = ProductCache(self.cache_dir)
+        self.assertEqual(self.build(cache, band, 1.05), (double_key, scaled_key))
+        double_again, scaled_again = self.build(cache, band, 1.10)
+        self.assertEqual(double_again, double_key)
+        self.assertNotEqual(scaled_again, scaled_key)
+        self.assertIsNone(cache.load(scaled_key))
+        np.testing.assert_array_equal(cache.load(scaled_again), band * 2 * 1.10)
+
+        # a new band file invalidates the old chain downstream of it
+        np.arange(1., 13.).tofile(self.band_path)
+        os.utime(self.band_path, (0, 0))
+        double_new, _ = self.build(cache, np.arange(1., 13.), 1.10)
+        self.assertNotEqual(double_new, double_key)
+        self.assertIsNone(cache.load(double_key))
+        self.assertIsNone(cache.load(scaled_again))
+        self.assertEqual(len(cache.index["products"]), 2)
+
+    def test_lru_eviction(self):
+        cache = ProductCache(self.cache_dir, max_entries=2)
+        keys = [cache.product_key("p{0}".format(i)) for i in range(3)]
+        cache.store("p0", keys[0], np.zeros(4))
+        cache.store("p1", keys[1], np.ones(4))
+        cache.load(keys[0])
+        cache.store("p2", keys[2], np.ones(4))
+        self.assertIsNotNone(cache.load(keys[0]))
+        self.assertIsNone(cache.load(keys[1]))
+        self.assertEqual(len(cache.index["products"]), 2)
+
+        cache = ProductCache(self.cache_dir, max_bytes=1)
+        cache.store("p3", cache.product_key("p3"), np.zeros(4))
+        self.assertEqual(len(cache.index["products"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,96 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import unittest
+import weakref
+
+from metric import product_graph
+
+
+class Product(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class StubModel(object):
+    def __init__(self):
+        self.computed = []
+        self.alive = {}
+        self.net_radiation = None
+
+    def check_saveflag(self, name):
+        return name == "ndvi"
+
+
+class ProductGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mike = StubModel()
+
+        def product(name, inputs):
+            def compute(mike, *args):
+                mike.computed.append(name)
+                value = Product(name)
+                mike.alive[name] = weakref.ref(value)
+                # the getters of MetricModel keep some of their products on the model
+                if name in product_graph.ATTRIBUTES:
+                    setattr(mike, product_graph.ATTRIBUTES[name], value)
+                return value
+            return inputs, compute, name
+
+        self.products = {"refl": product("refl", ("latitude",)),
+                         "ndvi": product("ndvi", ("refl",)),
+                         "lai": product("lai", ("refl",)),
+                         "sfcTemp": product("sfcTemp", ("lai",)),
+                         "net_rad": product("net_rad", ("lai", "sfcTemp")),
+                         "H": product("H", ("net_rad", "sfcTemp")),
+                         "ET_24hr": product("ET_24hr", ("H", "net_rad"))}
+
+    def test_schedule(self):
+        graph = product_graph.ProductGraph(self.mike, {"latitude": 0.8}, self.products)
+        self.assertEqual(graph.schedule(["ndvi"]), ["refl", "ndvi"])
+
+        order = graph.schedule(["ET_24hr"])
+        self.assertEqual(sorted(order), ["ET_24hr", "H", "lai", "net_rad", "refl", "sfcTemp"])
+        for name in order:
+            for dependency in self.products[name][0]:
+                if dependency in self.products:
+                    self.assertLess(order.index(dependency), order.index(name))
+
+        self.assertEqual(graph.default_outputs(), ["ET_24hr", "ndvi"])
+        self.assertRaises(ValueError, graph.schedule, ["TGI"])
+
+    def test_evaluate_frees_intermediates(self):
+        graph = product_graph.ProductGraph(self.mike, {"latitude": 0.8}, self.products)
+        results = graph.evaluate(["ndvi"])
+        self.assertEqual(self.mike.computed, ["refl", "ndvi"])
+        self.assertEqual(results.keys(), ["ndvi"])
+
+        self.mike.computed = []
+        results = graph.evaluate(["sfcTemp", "ET_24hr"])
+        self.assertNotIn("ndvi", self.mike.computed)
+        self.assertEqual(sorted(results), ["ET_24hr", "sfcTemp"])
+
+        # only the outputs outlive the run, the model attribute of net_rad is reset
+        self.assertEqual(sorted(name for name, ref in self.mike.alive.items() if ref() is not None),
+                         ["ET_24hr", "sfcTemp"])
+        self.assertEqual(self.mike.net_radiation, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
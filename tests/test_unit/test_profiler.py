@@ -0,0 +1,84 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from metric.profiler import RunProfiler
+
+
+class Model:
+    def get_band(self, n):
+        return np.zeros((n, n))
+
+    def get_bands(self, n):
+        return [self.get_band(n), self.get_band(n)]
+
+    def scale(self, x):
+        return x
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def test_instrument(self):
+        profiler = RunProfiler()
+        model = Model()
+        profiler.instrument(model)
+        self.assertEqual(model.get_bands(10)[0].shape, (10, 10))
+        self.assertEqual(model.scale(2), 2)
+        with profiler.span("iteration", iteration=1):
+            pass
+
+        # the spans close innermost first
+        spans = profiler.spans
+        self.assertEqual([(s["name"], s["depth"], s["arrays"]) for s in spans],
+                         [("get_band", 1, 1), ("get_band", 1, 1), ("get_bands", 0, 2), ("iteration", 0, 0)])
+        self.assertEqual(spans[2]["array_bytes"], 1600)
+        self.assertEqual(spans[3]["args"], {"iteration": 1})
+        summary = dict((s["name"], s) for s in profiler.summary())
+        self.assertEqual(summary["get_band"]["calls"], 2)
+
+        report = json.load(open(profiler.write_report(os.path.join(self.temp_folder, "report.json"), run=3)))
+        self.assertEqual((report["run"], len(report["spans"])), (3, 4))
+        trace = json.load(open(profiler.write_trace(os.path.join(self.temp_folder, "trace.json"))))
+        self.assertEqual([e["ph"] for e in trace["traceEvents"]], ["X"] * 4)
+
+    def test_disabled(self):
+        profiler = RunProfiler(enabled=False)
+        model = Model()
+        profiler.instrument(model)
+        model.get_bands(2)
+        with profiler.span("iteration"):
+            pass
+        self.assertEqual(profiler.spans, [])
+        self.assertNotIn("get_band", model.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
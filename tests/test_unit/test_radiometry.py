@@ -0,0 +1,68 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import unittest
+
+import numpy as np
+
+from metric import band_cube, radiometry
+from metric import function_bank as fnbank
+
+
+class Meta(object):
+    REFLECTANCE_MULT_BAND_4 = 2.0E-05
+    REFLECTANCE_ADD_BAND_4 = -0.1
+    RADIANCE_MULT_BAND_10 = 3.3420E-04
+    RADIANCE_ADD_BAND_10 = 0.1
+
+
+class RadiometryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dn = np.array([[0, 1, 9000], [12000, 30000, 65535]], dtype=np.uint16)
+        self.cos_sia = np.full((2, 3), 0.8)
+
+    def tearDown(self):
+        pass
+
+    def test_lookup_table(self):
+        lut = radiometry.band_lookup_table(Meta(), 10)
+        np.testing.assert_allclose(lut(self.dn), fnbank.L8_Thermal_Radiance(self.dn))
+        self.assertEqual(lut.table.shape, (radiometry.DN_RANGE,))
+
+        # anything but an unsigned 16 bit band goes through the arithmetic
+        np.testing.assert_allclose(lut(self.dn.astype(np.int32)), lut(self.dn))
+
+        out = np.empty((2, 3), dtype=np.float32)
+        self.assertIs(radiometry.band_lookup_table(Meta(), 10, np.float32)(self.dn, out=out), out)
+        np.testing.assert_allclose(out, lut(self.dn), rtol=1e-6)
+
+    def test_rescaling(self):
+        self.assertEqual(radiometry.band_rescaling(Meta(), 4), (2.0E-05, -0.1))
+        self.assertEqual(radiometry.band_rescaling(Meta(), 11), radiometry.DEFAULT_RADIANCE_RESCALING)
+        self.assertEqual(repr(radiometry.band_lookup_table(Meta(), 4)), repr(radiometry.band_lookup_table(Meta(), 4)))
+
+    def test_reflectance(self):
+        luts = [radiometry.band_lookup_table(Meta(), band) for band in range(2, 8)]
+        refl = band_cube.reflectance([self.dn] * 6, self.cos_sia, luts=luts)
+        for band in refl:
+            np.testing.assert_allclose(band, fnbank.Num10(self.dn, self.cos_sia))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -20,6 +20,7 @@ import osr
 import gdal
 import shutil
 import unittest
+import weakref
 import numpy as np
 import pkg_resources
 from tempfile import mkdtemp
@@ -112,6 +113,103 @@ class RasterTestCase(unittest.TestCase):
             else:
                 raise NotImplementedError('You have a key in {} that is unaccounted for.'.format(mtspcs_geo_expected))
 
+    def test_block_windows(self):
+        windows = rt.get_block_windows(self.mtspcs_file, tile_size=64)
+        rows, cols = self.mtspcs_arr.shape
+        self.assertEqual(sum([xsize * ysize for _, _, xsize, ysize in windows]), rows * cols)
+
+        for window in windows:
+            xoff, yoff, xsize, ysize = window
+            tile = rt.raster_to_array(self.mtspcs_file, window=window)
+            np.testing.assert_array_equal(tile, self.mtspcs_arr[yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def test_clip_window(self):
+        geo = self.mtspcs_geo_known
+        x, dx, _, y, _, dy = geo['geotransform']
+        window = (3, 5, 40, 30)
+
+        # a box around the window, inside its edge pixels
+        box = [(x + 3.2 * dx, y + 5.4 * dy), (x + 42.9 * dx, y + 5.4 * dy), (x + 42.9 * dx, y + 34.6 * dy),
+               (x + 3.2 * dx, y + 34.6 * dy), (x + 3.2 * dx, y + 5.4 * dy)]
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for point in box:
+            ring.AddPoint(*point)
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ring)
+        shapefile = os.path.join(self.temp_folder, 'clip.shp')
+        data_source = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(shapefile)
+        layer = data_source.CreateLayer('clip', geom_type=ogr.wkbPolygon)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(polygon)
+        layer.CreateFeature(feature)
+        data_source = None
+        self.assertEqual(rt.shapefile_window(shapefile, geo), window)
+
+        clip_geo = rt.window_geo(geo, window)
+        self.assertEqual((clip_geo['cols'], clip_geo['rows']), (40, 30))
+        self.assertEqual(clip_geo['geotransform'][::3], (x + 3 * dx, y + 5 * dy))
+        mask = rt.rasterize_shapefile(shapefile, clip_geo)
+        self.assertEqual(mask.sum(), 40 * 30)
+
+        # tiles of the window follow the blocks of the raster, relative to the window
+        tiles = rt.get_block_windows(self.mtspcs_file, tile_size=64, window=window)
+        self.assertEqual(sum([xsize * ysize for _, _, xsize, ysize in tiles]), 40 * 30)
+        proxy = rt.RasterProxy(self.mtspcs_file, dtype=float, window=window)
+        for tile in tiles:
+            xoff, yoff, xsize, ysize = rt.offset_window(tile, window)
+            np.testing.assert_array_equal(proxy.read(tile), self.mtspcs_arr[yoff:yoff + ysize, xoff:xoff + xsize])
+        self.assertEqual(proxy.read().shape, (30, 40))
+
+    def test_raster_proxy(self):
+        proxy = rt.RasterProxy(self.mtspcs_file)
+        band = proxy.read()
+        self.assertEqual(band.dtype, self.mtspcs_dataset.GetRasterBand(1).ReadAsArray().dtype)
+        np.testing.assert_array_equal(band, self.mtspcs_arr)
+
+        window = rt.get_block_windows(self.mtspcs_file, tile_size=64)[-1]
+        xoff, yoff, xsize, ysize = window
+        proxy.release()
+        np.testing.assert_array_equal(rt.RasterProxy(self.mtspcs_file, dtype=float).read(window),
+                                      self.mtspcs_arr[yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def test_raster_writer(self):
+        geo = dict(self.mtspcs_geo_known, bands=1, data_type=gdal.GDT_Float32)
+        writer = rt.RasterWriter(max_queue=1, compress='DEFLATE')
+        paths = [os.path.join(self.temp_folder, 'written_{0}.tif'.format(i)) for i in range(3)]
+        for i, path in enumerate(paths):
+            writer.write(self.mtspcs_arr + i, path, geo)
+        writer.close()
+
+        self.assertEqual(writer.summary()['files'], 3)
+        self.assertEqual(writer.summary()['bytes'], sum(os.path.getsize(path) for path in paths))
+
+        # nothing but its owner holds on to a closed writer
+        writer_ref = weakref.ref(writer)
+        del writer
+        self.assertIsNone(writer_ref())
+        for i, path in enumerate(paths):
+            np.testing.assert_array_equal(rt.raster_to_array(path), self.mtspcs_arr + i)
+            band = gdal.Open(path).GetRasterBand(1)
+            self.assertEqual(band.GetBlockSize(), [256, 256])
+
+        self.assertIn('PREDICTOR=3', rt.geotiff_options(gdal.GDT_Float32))
+        self.assertIn('PREDICTOR=2', rt.geotiff_options(gdal.GDT_UInt16, compress='ZSTD'))
+        self.assertNotIn('TILED=YES', rt.geotiff_options(tiled=False, compress=None))
+
+    def test_compressed_grid(self):
+        dn = np.array([[0, 5, 7], [9, 0, 3]], dtype=np.uint16)
+        qa = np.array([[0, 16, 0], [0, 0, 1]])
+        grid = rt.CompressedGrid.from_bands([dn, dn + 1], qa, mask_bits=16)
+        np.testing.assert_array_equal(grid.index, [2, 3, 5])
+
+        cube = np.arange(12.).reshape(2, 2, 3)
+        np.testing.assert_array_equal(grid.compress(cube), [[2., 3., 5.], [8., 9., 11.]])
+        np.testing.assert_array_equal(grid.expand(grid.compress(cube))[:, [0, 1], [2, 0]], cube[:, [0, 1], [2, 0]])
+        self.assertTrue(np.isnan(grid.expand(grid.compress(dn))[0, :2]).all())
+        self.assertEqual(grid.expand(2.5), 2.5)
+
+        np.testing.assert_array_equal(grid.positions([1, 3, 5]), [1, 2])
+
     def test_get_polygon_from_raster(self):
         poly = rt.get_polygon_from_raster(self.wgs_file)
         self.assertIsInstance(poly, ogr.Geometry)
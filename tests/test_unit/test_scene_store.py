@@ -0,0 +1,102 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from metric.scene_store import SceneStore
+from utils import raster_tools as ras
+
+
+class SceneStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_folder, 'scene_store.mst')
+        self.geo = {'cols': 23, 'rows': 17, 'bands': 1, 'data_type': gdal.GDT_Float32,
+                    'geotransform': (300000., 30., 0., 4500000., 0., -30.), 'projection': ''}
+        rng = np.random.RandomState(0)
+        self.ndvi = rng.uniform(-1., 1., (17, 23)).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def test_windows(self):
+        store = SceneStore(self.path, self.geo, chunk=8)
+        store.write('ndvi', self.ndvi)
+        np.testing.assert_array_equal(store.read('ndvi'), self.ndvi)
+        np.testing.assert_array_equal(store.read('ndvi', (5, 3, 12, 9)), self.ndvi[3:12, 5:17])
+
+        # tiles written in any order, partly covering the chunks
+        for window in [(10, 9, 13, 8), (0, 0, 10, 9), (10, 0, 13, 9), (0, 9, 10, 8)]:
+            xoff, yoff, xsize, ysize = window
+            store.write('sfcTemp', 300. + self.ndvi[yoff:yoff + ysize, xoff:xoff + xsize], window)
+        store.close()
+
+        store = SceneStore(self.path, self.geo)
+        self.assertEqual(store.names(), ['ndvi', 'sfcTemp'])
+        np.testing.assert_array_equal(store.read('sfcTemp'), 300. + self.ndvi)
+
+    def test_fill_and_bands(self):
+        store = SceneStore(self.path, self.geo, chunk=8)
+        masked = np.where(self.ndvi > 0, self.ndvi, np.nan)
+        masked[:8, :8] = np.nan
+        store.write('ndvi', masked)
+        self.assertEqual(len(store.index['variables']['ndvi']['chunks']), 8)
+        np.testing.assert_array_equal(store.read('ndvi'), masked)
+
+        store.write_raster([self.ndvi, 2 * self.ndvi], 'rah_snapshots.tif', self.geo,
+                           descriptions=['iteration 0', 'iteration 1'])
+        self.assertEqual(store.read('rah_snapshots').shape, (2, 17, 23))
+        np.testing.assert_array_equal(store.read('rah_snapshots', (1, 1, 4, 4), band=1), 2 * self.ndvi[1:5, 1:5])
+        self.assertRaises(ValueError, store.write_raster, self.ndvi, 'ndvi.tif', ras.window_geo(self.geo, (1, 1, 22, 16)))
+
+    def test_crash_and_compaction(self):
+        store = SceneStore(self.path, self.geo)
+        store.write('ndvi', self.ndvi)
+        store.flush()
+
+        # written but never flushed, as if the run was killed
+        store.write('ndvi', 2 * self.ndvi)
+        np.testing.assert_array_equal(SceneStore(self.path).read('ndvi'), self.ndvi)
+
+        for i in range(4):
+            store.write('ndvi', i * self.ndvi)
+
+        # a compaction that fails half way leaves the store as it was
+        def fail(f, location):
+            raise IOError('disk full')
+        store._read_blob = fail
+        self.assertRaises(IOError, store.compact)
+        self.assertEqual(os.listdir(self.temp_folder), ['scene_store.mst'])
+        del store._read_blob
+        np.testing.assert_array_equal(store.read('ndvi'), 3 * self.ndvi)
+
+        store.close()
+        self.assertLess(os.path.getsize(self.path), 2 * store.live_bytes() + 4096)
+        np.testing.assert_array_equal(SceneStore(self.path).read('ndvi'), 3 * self.ndvi)
+        self.assertRaises(ValueError, SceneStore, self.path, dict(self.geo, cols=24))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,208 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+import unittest
+
+import numpy as np
+
+from metric import function_bank as fnbank
+from metric import sensible_heat as shf
+
+
+class SensibleHeatTestCase(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.shape = (20, 30)
+        self.u200 = 5.6
+        self.zom = rs.uniform(0.005, 0.08, self.shape)
+        self.pressure = rs.uniform(84., 88., self.shape)
+        self.surface_temp = rs.uniform(295., 318., self.shape)
+        self.net_rad = rs.uniform(420., 620., self.shape)
+        self.soil_hf = rs.uniform(40., 110., self.shape)
+
+        self.hot = np.zeros(self.shape, dtype=bool)
+        self.hot[2:4, 2:4] = True
+        self.cold = np.zeros(self.shape, dtype=bool)
+        self.cold[10:12, 20:23] = True
+        self.surface_temp[self.hot] = 318.
+        self.surface_temp[self.cold] = 296.
+
+        self.T_s_datum = self.surface_temp - 0.5
+        self.LE_cold = 480.
+
+    def tearDown(self):
+        pass
+
+    def reference_pixels(self, mask):
+        return {"u200": np.full(mask.sum(), self.u200), "zom": self.zom[mask], "pressure": self.pressure[mask],
+                "surface_temp": self.surface_temp[mask], "T_s_datum": self.T_s_datum[mask],
+                "net_rad": self.net_rad[mask], "soil_hf": self.soil_hf[mask]}
+
+    def scene_loop(self):
+        """ the scene wide iteration of MetricModel.get_sensible_heat_flux"""
+
+        hot, cold = self.hot, self.cold
+        Tsd, Ts = self.T_s_datum, self.surface_temp
+        Rn_hot, Rn_cold = self.net_rad[hot].mean(), self.net_rad[cold].mean()
+        G_hot, G_cold = self.soil_hf[hot].mean(), self.soil_hf[cold].mean()
+
+        ustar = fnbank.Num31(self.u200, self.zom)
+        rah = fnbank.Num30(ustar)
+        rho_air = fnbank.Num37(self.pressure, Ts, 0)
+        dT_hot = fnbank.Num46(Rn_hot, G_hot, rah[hot].mean(), rho_air[hot].mean())
+        dT_cold = fnbank.Num49(Rn_cold, G_cold, self.LE_cold, rah[cold].mean(), rho_air[cold].mean())
+        a = fnbank.Num50(dT_hot, dT_cold, Tsd[hot].mean(), Tsd[cold].mean())
+        b = fnbank.Num51(dT_hot, a, Tsd[hot].mean())
+        dT = fnbank.Num29(a, b, Tsd)
+        H = fnbank.Num28(rho_air, dT, rah)
+        L = fnbank.Num40(rho_air, ustar, Ts, H)
+
+        i = 1
+        converged = False
+        while not converged and i < 1000:
+            unstable = L < 0
+            psi200 = np.where(unstable, fnbank.Num41(L), fnbank.Num44(L))
+            psi2 = np.where(unstable, fnbank.Num42a(L), fnbank.Num45a(L))
+            psi01 = np.where(unstable, fnbank.Num42b(L), fnbank.Num45b(L))
+            ustar = fnbank.Num38(self.u200, self.zom, psi200)
+            rah = fnbank.Num39(psi2, psi01, ustar)
+            rho_air = fnbank.Num37(self.pressure, Ts, dT)
+
+            dT_hot = fnbank.Num46(Rn_hot, G_hot, rah[hot].mean(), rho_air[hot].mean())
+            dT_cold = fnbank.Num49(Rn_cold, G_cold, self.LE_cold, rah[cold].mean(), rho_air[cold].mean())
+            a_new = fnbank.Num50(dT_hot, dT_cold, Tsd[hot].mean(), Tsd[cold].mean())
+            b_new = fnbank.Num51(dT_hot, a, Tsd[hot].mean())
+            if round(a_new / a, 4) == 1.0000 and round(b_new / b, 4) == 1.0000:
+                converged = True
+            a = 0.6 * a + 0.4 * a_new
+            b = 0.6 * b + 0.4 * b_new
+
+            dT = fnbank.Num29(a, b, Tsd)
+            H = fnbank.Num28(rho_air, dT, rah)
+            L = fnbank.Num40(rho_air, ustar, Ts, H)
+            i += 1
+
+        return a, b, H
+
+    def test_stability_corrections(self):
+        L = np.array([-50., 100.])
+        psi200, psi2, psi01 = shf.stability_corrections(L)
+        np.testing.assert_allclose(psi200, [fnbank.Num41(L)[0], -10.])
+        np.testing.assert_allclose(psi2, [fnbank.Num42a(L)[0], -0.1])
+        np.testing.assert_allclose(psi01, [fnbank.Num42b(L)[0], -0.005])
+
+    def test_fused_stability_corrections(self):
+        L = np.random.RandomState(1).uniform(-500., 500., self.shape)
+        L[0, :3] = [0., np.nan, -1e-3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unstable = L < 0
+            expected = [np.where(unstable, fnbank.Num41(L), fnbank.Num44(L)),
+                        np.where(unstable, fnbank.Num42a(L), fnbank.Num45a(L)),
+                        np.where(unstable, fnbank.Num42b(L), fnbank.Num45b(L))]
+
+        out = np.empty(self.shape), np.empty(self.shape), np.empty(self.shape)
+        psi = shf.stability_corrections(L, out=out, use_numba=False)
+        for buf, value, reference in zip(out, psi, expected):
+            self.assertIs(value, buf)
+            np.testing.assert_allclose(value, reference, rtol=1e-12, atol=1e-14)
+
+        if shf.numba is not None:
+            for value, reference in zip(shf.stability_corrections(L, use_numba=True), expected):
+                np.testing.assert_allclose(value, reference, rtol=1e-12, atol=1e-14)
+
+        # a float32 L stays float32
+        L32 = L.astype(np.float32)
+        for use_numba in {False, shf.numba is not None}:
+            for value, reference in zip(shf.stability_corrections(L32, use_numba=use_numba), expected):
+                self.assertEqual(value.dtype, np.float32)
+                np.testing.assert_allclose(value, reference, rtol=1e-4, atol=1e-6)
+
+    def test_calibration_matches_scene_loop(self):
+        a, b, H = self.scene_loop()
+        history = shf.calibrate_coefficients(self.reference_pixels(self.hot), self.reference_pixels(self.cold),
+                                             self.LE_cold)
+        self.assertAlmostEqual(history[-1][0], a, places=10)
+        self.assertAlmostEqual(history[-1][1], b, places=10)
+
+        replayed = shf.replay_sensible_heat(history, self.u200, self.zom, self.pressure, self.surface_temp,
+                                            self.T_s_datum)
+        np.testing.assert_allclose(replayed, H, rtol=1e-10)
+
+    def test_replay_by_window(self):
+        history = shf.calibrate_coefficients(self.reference_pixels(self.hot), self.reference_pixels(self.cold),
+                                             self.LE_cold)
+        whole = shf.replay_sensible_heat(history, self.u200, self.zom, self.pressure, self.surface_temp,
+                                         self.T_s_datum)
+        top = shf.replay_sensible_heat(history, self.u200, self.zom[:7], self.pressure[:7],
+                                       self.surface_temp[:7], self.T_s_datum[:7])
+        np.testing.assert_array_equal(top, whole[:7])
+
+    def test_solve_with_fixed_coefficients(self):
+        history = shf.calibrate_coefficients(self.reference_pixels(self.hot), self.reference_pixels(self.cold),
+                                             self.LE_cold)
+        a, b = history[-1]
+        H, active = shf.solve_sensible_heat(a, b, self.u200, self.zom, self.pressure, self.surface_temp,
+                                            self.T_s_datum, tolerance=1e-8)
+        self.assertEqual(H.shape, self.shape)
+        self.assertEqual(active[0], H.size)
+        self.assertLess(len(active), 100)
+        self.assertTrue(all(n >= m for n, m in zip(active, active[1:])))
+
+        # the fixed point of replaying the converged pair forever
+        fixed = shf.replay_sensible_heat([(a, b)] * 200, self.u200, self.zom, self.pressure, self.surface_temp,
+                                         self.T_s_datum)
+        np.testing.assert_allclose(H, fixed, rtol=1e-6)
+
+        # and close to the scene wide loop, which reaches it through moving coefficients
+        np.testing.assert_allclose(H, self.scene_loop()[2], rtol=1e-3)
+
+    def test_solve_until_L_settles(self):
+        # H is the same on every pass while L halves its distance to 1, the pixels stay until L settles
+        functions = shf.initial_resistances, shf.corrected_resistances, shf.sensible_heat
+        shf.initial_resistances = lambda u200, zom, pressure, surface_temp: (9. * np.ones(u200.shape),
+                                                                             np.ones(u200.shape), np.ones(u200.shape))
+        shf.corrected_resistances = lambda L, dT, *args: ((L + 1) / 2, np.ones(L.shape), np.ones(L.shape))
+        shf.sensible_heat = lambda a, b, T_s_datum, rho_air, rah, ustar, surface_temp: (0 * ustar, 100. + 0 * ustar,
+                                                                                         ustar)
+        try:
+            H, active = shf.solve_sensible_heat(0., 0., np.ones(4), 0.1, 85., 300., 290., tolerance=1e-4)
+        finally:
+            shf.initial_resistances, shf.corrected_resistances, shf.sensible_heat = functions
+        np.testing.assert_array_equal(H, 100.)
+        self.assertGreater(len(active), 10)
+        self.assertEqual(active, [4] * len(active))
+
+    def test_accelerated_solvers(self):
+        hot, cold = self.reference_pixels(self.hot), self.reference_pixels(self.cold)
+        damped = shf.get_solver("damped", tolerance=1e-8)
+        a, b = shf.calibrate_coefficients(hot, cold, self.LE_cold, solver=damped)[-1]
+
+        for name in ("secant", "anderson"):
+            solver = shf.get_solver(name, tolerance=1e-8)
+            history = shf.calibrate_coefficients(hot, cold, self.LE_cold, solver=solver)
+            self.assertAlmostEqual(history[-1][0] / a, 1., places=7)
+            self.assertAlmostEqual(history[-1][1] / b, 1., places=7)
+            self.assertLess(solver.iterations, damped.iterations)
+            self.assertEqual(len(solver.log), len(history) - 1)
+            self.assertLess(solver.log[-1]["residual"], 1e-8)
+
+        self.assertRaises(ValueError, shf.get_solver, "newton")
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
@@ -0,0 +1,82 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from metric.snapshots import THRESHOLD_LIMIT, IterationSnapshots, SnapshotPolicy
+
+
+class SnapshotsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.geo = {'cols': 4, 'rows': 3, 'bands': 1, 'data_type': gdal.GDT_Float32,
+                    'geotransform': (0., 30., 0., 0., 0., -30.), 'projection': ''}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def kept(self, policy, values):
+        kept, last = [], None
+        for i, value in enumerate(values):
+            if policy.keep(i, value, last):
+                kept.append(i)
+                last = value
+        return kept
+
+    def test_policy(self):
+        self.assertEqual(self.kept(SnapshotPolicy(every=4, first=2, last=0), [1.] * 10), [0, 1, 4, 8])
+        self.assertEqual(SnapshotPolicy(every=4, first=2).capacity(10), 5)
+
+        # only the moves of more than 10 % since the last iteration kept
+        policy = SnapshotPolicy(every=None, first=0, threshold=0.1)
+        self.assertEqual(self.kept(policy, [10., 10.5, 11.5, 11.6, 9., np.nan, 9.]), [0, 2, 4])
+        self.assertEqual(SnapshotPolicy(threshold=0.1, limit=3).capacity(10), 3)
+        self.assertEqual(SnapshotPolicy(threshold=0.1).capacity(1000), THRESHOLD_LIMIT)
+
+        # the statistic is only computed for a threshold
+        def statistic(array):
+            raise AssertionError('statistic computed without a threshold')
+        snapshots = IterationSnapshots(SnapshotPolicy(statistic=statistic), self.temp_folder, self.geo, 3)
+        for i in range(3):
+            snapshots.add('rah', i, np.zeros((3, 4)))
+        self.assertEqual(snapshots.close(), {'rah': [0, 1, 2]})
+
+    def test_iteration_snapshots(self):
+        snapshots = IterationSnapshots(SnapshotPolicy(every=5, first=1, last=2), self.temp_folder, self.geo, 12)
+        for i in range(12):
+            snapshots.add('rah', i, np.full((3, 4), i, dtype=np.float64))
+
+        self.assertEqual(snapshots.close(), {'rah': [0, 5, 10, 11]})
+        self.assertFalse(os.path.exists(snapshots.path('rah') + '.tmp'))
+
+        raster = gdal.Open(snapshots.path('rah'))
+        self.assertEqual(raster.RasterCount, 4)
+        for band, i in enumerate([0, 5, 10, 11]):
+            self.assertEqual(raster.GetRasterBand(band + 1).GetDescription(), 'iteration {0}'.format(i))
+            np.testing.assert_array_equal(raster.GetRasterBand(band + 1).ReadAsArray(), i)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
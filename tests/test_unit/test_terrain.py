@@ -0,0 +1,113 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from metric import function_bank as fnbank, terrain
+from utils import raster_tools as ras
+
+
+class TerrainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder)
+
+    def test_plane(self):
+        # rises 1 m per pixel to the east and 2 m per pixel to the south, 30 m pixels
+        y, x = np.mgrid[0:5, 0:6].astype(float)
+        slope, aspect = terrain.slope_aspect(x + 2. * y, 30., 30.)
+
+        self.assertEqual(slope.shape, (3, 4))
+        np.testing.assert_allclose(slope, np.degrees(np.arctan(np.hypot(1., 2.) / 30.)))
+        # faces down hill, to the north west
+        np.testing.assert_allclose(aspect, np.degrees(np.arctan2(-1., 2.)) % 360.)
+
+        slope, aspect = terrain.slope_aspect(np.ones((3, 3)), 30., 30.)
+        self.assertEqual(slope[0, 0], 0.)
+        self.assertEqual(aspect[0, 0], terrain.FLAT_ASPECT)
+        self.assertEqual(terrain.aspect_radians(aspect)[0, 0], 0.)
+
+    def test_tiles_match_scene(self):
+        y, x = np.mgrid[0:23, 0:17].astype(float)
+        dem = 1500. + 40. * np.sin(x / 3.) * np.cos(y / 5.)
+        path = os.path.join(self.temp_folder, 'dem.tif')
+        geo = {'cols': 17, 'rows': 23, 'bands': 1, 'data_type': gdal.GDT_Float32,
+               'geotransform': (0., 30., 0., 0., 0., -30.), 'projection': ''}
+        ras.array_to_raster(dem.astype(np.float32), path, geo)
+
+        res = terrain.resolution(geo)
+        whole = terrain.slope_aspect(terrain.read_with_halo(path), *res)
+        for xoff, yoff, xsize, ysize in [(0, 0, 8, 8), (8, 8, 9, 15), (5, 0, 7, 23), (16, 22, 1, 1)]:
+            tile = terrain.slope_aspect(terrain.read_with_halo(path, (xoff, yoff, xsize, ysize)), *res)
+            for derivative, scene in zip(tile, whole):
+                np.testing.assert_array_equal(derivative, scene[yoff:yoff + ysize, xoff:xoff + xsize])
+
+    def test_cos_incidence(self):
+        rng = np.random.RandomState(0)
+        dem = 1500. + 200. * rng.uniform(size=(9, 8))
+        planes = terrain.terrain_planes(dem, 30., 30., np.float64)
+        slope, aspect = terrain.slope_aspect(dem, 30., 30.)
+        slope, aspect = terrain.slope_radians(slope), terrain.aspect_radians(aspect)
+        np.testing.assert_array_equal(planes[0], slope)
+
+        delta, phi, omega = 0.38, 0.79, -0.42
+        cos_theta = terrain.cos_incidence(planes, terrain.incidence_coefficients(delta, phi, omega))
+        np.testing.assert_allclose(cos_theta, fnbank.Num7(delta, phi, slope, aspect, omega)[0], rtol=1e-12)
+
+    def test_terrain_cache(self):
+        y, x = np.mgrid[0:7, 0:5].astype(float)
+        dem = 1500. + 40. * np.sin(x / 2.) * np.cos(y / 3.)
+        path = os.path.join(self.temp_folder, 'dem.tif')
+        geo = {'cols': 5, 'rows': 7, 'bands': 1, 'data_type': gdal.GDT_Float32,
+               'geotransform': (0., 30., 0., 0., 0., -30.), 'projection': ''}
+        ras.array_to_raster(dem.astype(np.float32), path, geo)
+
+        cache = terrain.TerrainCache(os.path.join(self.temp_folder, 'terrain'))
+        terrain.PLANE_BLOCK_ROWS, block_rows = 3, terrain.PLANE_BLOCK_ROWS
+        try:
+            planes = cache.planes(path, 'sha1 of the dem', geo)
+        finally:
+            terrain.PLANE_BLOCK_ROWS = block_rows
+        np.testing.assert_array_equal(planes, terrain.terrain_planes(terrain.read_with_halo(path, dtype=np.float32),
+                                                                     30., 30.))
+
+        # built once per DEM and grid
+        self.assertEqual(os.listdir(cache.cache_dir), [os.path.basename(cache.path('sha1 of the dem', geo,
+                                                                                   np.float32))])
+        self.assertNotEqual(cache.path('sha1 of another dem', geo, np.float32),
+                            cache.path('sha1 of the dem', geo, np.float32))
+
+        # without a cache the same planes are computed in memory
+        np.testing.assert_array_equal(terrain.scene_planes(path, geo), planes)
+        window = (1, 2, 3, 4)
+        np.testing.assert_array_equal(terrain.scene_planes(path, ras.window_geo(geo, window), window=window),
+                                      terrain.terrain_planes(terrain.read_with_halo(path, window, dtype=np.float32),
+                                                             30., 30.))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
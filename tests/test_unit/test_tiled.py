@@ -0,0 +1,62 @@
+# ===============================================================================
+# Copyright 2017 dgketchum
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ===============================================================================
+
+
+import os
+import unittest
+
+import numpy as np
+
+from metric.profiler import RunProfiler
+from metric.tiled import map_tiles
+
+
+class Model:
+    def __init__(self, workers, executor):
+        self.workers = workers
+        self.executor = executor
+        self.profiler = RunProfiler()
+
+
+def tile_job(value, window):
+    xoff, yoff, xsize, ysize = window
+    return {"value": np.full((ysize, xsize), value), "pid": os.getpid()}
+
+
+class TiledTestCase(unittest.TestCase):
+    def setUp(self):
+        self.windows = [(0, 0, 4, 2), (0, 2, 4, 2), (0, 4, 4, 1)]
+
+    def test_map_tiles(self):
+        for workers, executor in [(None, "thread"), (2, "thread"), (2, "process")]:
+            model = Model(workers, executor)
+            tiles = sorted(map_tiles(model, tile_job, (3.,), self.windows))
+            self.assertEqual([(i, window) for i, window, products in tiles], list(enumerate(self.windows)))
+            for i, window, products in tiles:
+                np.testing.assert_array_equal(products["value"], np.full((window[3], window[2]), 3.))
+
+            # one span per tile, the spans of the worker processes are sent back to the run
+            self.assertEqual([span["name"] for span in model.profiler.spans], ["tile_job"] * 3)
+            self.assertEqual(sorted(span["process"] for span in model.profiler.spans),
+                             sorted(products["pid"] for i, window, products in tiles))
+            self.assertEqual(executor == "process", os.getpid() not in [span["process"] for span in
+                                                                        model.profiler.spans])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# ===============================================================================
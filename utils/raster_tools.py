@@ -18,22 +18,28 @@ The purpose of this module is to provide some simple tools needed for raster pro
 
 
 """
+import Queue
+import atexit
 import os
+import threading
+import time
+import weakref
 
-from numpy import array, asarray
-from numpy.ma import masked_where, nomask
+from numpy import asarray, ceil, flatnonzero, floor, full, nan, ndim, searchsorted
 from osgeo import gdal, ogr
 
 import spatial_reference_tools as srt
 
 
-def raster_to_array(input_raster_path, raster=None, band=1):
+def raster_to_array(input_raster_path, raster=None, band=1, window=None, dtype=float):
     """
     Convert .tif raster into a numpy numerical array.
 
     :param input_raster_path: Path to raster.
     :param raster: Raster name with *.tif
     :param band: Band of raster sought.
+    :param window: Optional (xoff, yoff, xsize, ysize) pixel window, reads the whole band if None.
+    :param dtype: Type of the returned array, None keeps the data type of the band.
     :return: Numpy array.
     """
     try:
@@ -42,10 +48,271 @@ def raster_to_array(input_raster_path, raster=None, band=1):
         raster_open = gdal.Open(input_raster_path)
     except AttributeError:
         raster_open = gdal.Open(input_raster_path)
-    ras = array(raster_open.GetRasterBand(band).ReadAsArray(), dtype=float)
+    if window is None:
+        ras = asarray(raster_open.GetRasterBand(band).ReadAsArray(), dtype=dtype)
+    else:
+        xoff, yoff, xsize, ysize = window
+        ras = asarray(raster_open.GetRasterBand(band).ReadAsArray(xoff, yoff, xsize, ysize), dtype=dtype)
     return ras
 
 
+def get_block_windows(input_raster_path, tile_size=None, band=1, window=None):
+    """
+    Split a raster into pixel windows aligned with its internal GDAL blocks.
+
+    The tile size is rounded to a whole number of blocks in each direction so that
+    no block is read twice, tiles on the right and bottom edges are clipped to the raster.
+
+    :param input_raster_path: Path to raster.
+    :param tile_size: Approximate tile edge in pixels, one block per tile if None.
+    :param band: Band whose block layout is used.
+    :param window: Optional (xoff, yoff, xsize, ysize) window to split instead of the whole
+        raster, the tiles are clipped to it and relative to its upper left corner.
+    :return: List of (xoff, yoff, xsize, ysize) windows in row-major order.
+    """
+    dataset = gdal.Open(input_raster_path)
+    cols, rows = dataset.RasterXSize, dataset.RasterYSize
+    block_x, block_y = dataset.GetRasterBand(band).GetBlockSize()
+    x0, y0, xsize, ysize = window if window is not None else (0, 0, cols, rows)
+
+    if tile_size is None:
+        tile_x, tile_y = block_x, block_y
+    else:
+        tile_x = max(1, int(round(float(tile_size) / block_x))) * block_x
+        tile_y = max(1, int(round(float(tile_size) / block_y))) * block_y
+
+    windows = []
+    for yoff in range(y0 - y0 % tile_y, y0 + ysize, tile_y):
+        top, bottom = max(yoff, y0), min(yoff + tile_y, y0 + ysize)
+        for xoff in range(x0 - x0 % tile_x, x0 + xsize, tile_x):
+            left, right = max(xoff, x0), min(xoff + tile_x, x0 + xsize)
+            windows.append((left - x0, top - y0, right - left, bottom - top))
+    return windows
+
+
+def offset_window(window, outer):
+    """
+    The pixel window of a raster corresponding to a window of one of its windows.
+
+    :param window: (xoff, yoff, xsize, ysize) relative to outer, all of outer if None.
+    :param outer: (xoff, yoff, xsize, ysize) window of the raster, the whole raster if None.
+    :return: (xoff, yoff, xsize, ysize) window of the raster, None for the whole raster.
+    """
+    if outer is None:
+        return window
+    if window is None:
+        return outer
+    return outer[0] + window[0], outer[1] + window[1], window[2], window[3]
+
+
+def window_geo(geo, window):
+    """
+    Geographic attributes of a pixel window of a grid.
+
+    :param geo: dict of geographic attributes from get_raster_geo_attributes.
+    :param window: (xoff, yoff, xsize, ysize) pixel window of that grid.
+    :return: dict of geographic attributes of the window.
+    """
+    xoff, yoff, xsize, ysize = window
+    x, dx, rx, y, ry, dy = geo['geotransform']
+    geotransform = (x + xoff * dx + yoff * rx, dx, rx, y + xoff * ry + yoff * dy, ry, dy)
+    return dict(geo, cols=xsize, rows=ysize, geotransform=geotransform)
+
+
+def shapefile_window(shapefile, geo):
+    """
+    The pixel window of a grid covering the extent of the polygons of a shapefile.
+
+    :param shapefile: Path to an ESRI .shp in the same reference system as the grid.
+    :param geo: dict of geographic attributes from get_raster_geo_attributes, of a north up grid.
+    :return: (xoff, yoff, xsize, ysize) window, clipped to the grid.
+    """
+    shape_open = ogr.Open(shapefile)
+    min_x, max_x, min_y, max_y = shape_open.GetLayer().GetExtent()
+    x, dx, _, y, _, dy = geo['geotransform']
+
+    left = max(0, int(floor((min_x - x) / dx)))
+    right = min(geo['cols'], int(ceil((max_x - x) / dx)))
+    top = max(0, int(floor((max_y - y) / dy)))
+    bottom = min(geo['rows'], int(ceil((min_y - y) / dy)))
+    if right <= left or bottom <= top:
+        raise ValueError("{0} does not overlap the grid".format(shapefile))
+    return left, top, right - left, bottom - top
+
+
+class RasterProxy(object):
+    """
+    Lazy handle on one band of a raster file.
+
+    Nothing is read when the proxy is created. read() returns the band, or a window of it,
+    as a view of a memory map of the file when GDAL can map it directly (an uncompressed
+    GeoTIFF for instance) and through a regular read otherwise. release() drops the map,
+    the proxy maps the file again if it is read later.
+    """
+
+    def __init__(self, path, band=1, dtype=None, window=None):
+        """
+        :param path: Path to the raster.
+        :param band: Band of the raster.
+        :param dtype: Type of the arrays returned by read, None keeps the data type of the band.
+        :param window: Optional (xoff, yoff, xsize, ysize) window of the raster the proxy stands
+            for, windows given to read are then relative to it.
+        """
+        self.path = path
+        self.band = band
+        self.dtype = dtype
+        self.window = window
+        self._dataset = None
+        self._mapped = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _map(self):
+        """ the band mapped in memory, None if GDAL can not map this file"""
+        with self._lock:
+            # a map made by the parent of a forked worker is not reused
+            if self._pid != os.getpid():
+                self._dataset, self._mapped = None, None
+                self._pid = os.getpid()
+                dataset = gdal.Open(self.path)
+                try:
+                    self._mapped = dataset.GetRasterBand(self.band).GetVirtualMemAutoArray(
+                        gdal.GF_Read, ['USE_DEFAULT_IMPLEMENTATION=NO'])
+                    self._dataset = dataset
+                except (AttributeError, RuntimeError, TypeError, ValueError):
+                    self._mapped = None
+            return self._mapped
+
+    def read(self, window=None):
+        """
+        Reads the band.
+
+        :param window: Optional (xoff, yoff, xsize, ysize) pixel window, reads the whole band if None.
+        :return: Numpy array, read only when it is a view of the memory map.
+        """
+        window = offset_window(window, self.window)
+        mapped = self._map()
+        if mapped is None:
+            return raster_to_array(self.path, band=self.band, window=window, dtype=self.dtype)
+
+        if window is not None:
+            xoff, yoff, xsize, ysize = window
+            mapped = mapped[yoff:yoff + ysize, xoff:xoff + xsize]
+        return asarray(mapped, dtype=self.dtype)
+
+    def release(self):
+        """ drops the memory map and the open dataset, arrays already read stay valid"""
+        with self._lock:
+            self._dataset, self._mapped, self._pid = None, None, None
+
+
+class CompressedGrid(object):
+    """
+    The valid pixels of a raster grid, as a 1-D vector.
+
+    compress() gathers the valid pixels of a grid shaped array into a vector, in row major
+    order, and expand() scatters such a vector back onto the grid. Arrays with leading
+    axes, (band, row, col) for instance, are compressed to (band, pixel). Element wise
+    computations on compressed arrays only touch the valid pixels.
+    """
+
+    def __init__(self, valid):
+        """
+        :param valid: 2-D boolean array, True at the pixels to keep.
+        """
+        self.shape = valid.shape
+        self.index = flatnonzero(valid)
+        self.size = self.index.size
+
+    @classmethod
+    def from_bands(cls, bands, mask=None, mask_bits=None):
+        """
+        Valid pixels of a set of integer bands, those where no band holds the fill value 0.
+
+        :param bands: Sequence of 2-D DN arrays on the same grid.
+        :param mask: Optional 2-D array, pixels where it is 0 are dropped.
+        :param mask_bits: Treat mask as a bit field, e.g. a landsat QA band, pixels where
+            any of these bits is set are dropped instead.
+        :return: CompressedGrid.
+        """
+        valid = None
+        for band in bands:
+            valid = band >= 1 if valid is None else valid & (band >= 1)
+        if mask is not None:
+            mask = asarray(mask)
+            if mask_bits is None:
+                valid &= mask != 0
+            else:
+                valid &= (mask.astype(int) & mask_bits) == 0
+        return cls(valid)
+
+    def compress(self, array):
+        """ the valid pixels of a grid shaped array, scalars are returned as they are"""
+        if ndim(array) < 2:
+            return array
+        array = asarray(array)
+        return array.reshape(array.shape[:-2] + (-1,)).take(self.index, axis=-1)
+
+    def expand(self, array, fill=nan):
+        """ a compressed array scattered back onto the grid, fill at the dropped pixels, scalars are left as they are"""
+        if ndim(array) < 1:
+            return array
+        array = asarray(array)
+        out = full(array.shape[:-1] + (self.shape[0] * self.shape[1],), fill,
+                   dtype=array.dtype if array.dtype.kind == 'f' else float)
+        out[..., self.index] = array
+        return out.reshape(array.shape[:-1] + self.shape)
+
+    def positions(self, flat_index):
+        """ positions in the compressed vector of grid pixels given by flat index, dropped pixels are skipped"""
+        flat_index = asarray(flat_index)
+        if not self.size:
+            return flat_index[:0]
+        found = searchsorted(self.index, flat_index).clip(0, self.size - 1)
+        return found[self.index[found] == flat_index]
+
+
+def create_raster(out_path, geo, data_type=gdal.GDT_Float32):
+    """
+    Create an empty single band GeoTIFF on the grid described by geo, for writing by window.
+
+    :param out_path: Path of the new raster.
+    :param geo: dict of geographic attributes from get_raster_geo_attributes.
+    :param data_type: GDAL data type of the band.
+    :return: Open gdal.Dataset, set it to None to flush it to disk.
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    out_data_set = driver.Create(out_path, geo['cols'], geo['rows'], 1, data_type)
+    out_data_set.SetGeoTransform(geo['geotransform'])
+    out_data_set.SetProjection(geo['projection'])
+    return out_data_set
+
+
+def write_window(out_data_set, save_array, window):
+    """ writes save_array into an open dataset at the (xoff, yoff, xsize, ysize) window"""
+    xoff, yoff = window[0], window[1]
+    out_data_set.GetRasterBand(1).WriteArray(save_array, xoff, yoff)
+    return None
+
+
+def rasterize_shapefile(shapefile, geo):
+    """
+    Burns the polygons of a shapefile onto the grid described by geo.
+
+    :param shapefile: Path to an ESRI .shp in the same reference system as the grid.
+    :param geo: dict of geographic attributes from get_raster_geo_attributes.
+    :return: Numpy uint8 array, 1 inside the polygons and 0 elsewhere.
+    """
+    shape_open = ogr.Open(shapefile)
+    layer = shape_open.GetLayer()
+    mem_data_set = gdal.GetDriverByName('MEM').Create('', geo['cols'], geo['rows'], 1, gdal.GDT_Byte)
+    mem_data_set.SetGeoTransform(geo['geotransform'])
+    mem_data_set.SetProjection(geo['projection'])
+    gdal.RasterizeLayer(mem_data_set, [1], layer, burn_values=[1])
+    mask = mem_data_set.GetRasterBand(1).ReadAsArray()
+    return mask
+
+
 def get_polygon_from_raster(raster):
     tile_id = os.path.basename(raster)
     # print 'tile number: {}'.format(tile_id)
@@ -117,8 +384,7 @@ def apply_mask(mask_path, arr):
     file_name = next((fn for fn in os.listdir(mask_path) if fn.endswith('.tif')), None)
     if file_name is not None:
         mask = raster_to_array(mask_path, file_name)
-        idxs = asarray(mask, dtype=bool)
-        out = arr[idxs].flatten()
+        out = CompressedGrid(asarray(mask, dtype=bool)).compress(arr)
     return out
 
 
@@ -127,28 +393,167 @@ def remake_array(mask_path, arr):
     file_name = next((filename for filename in os.listdir(mask_path) if filename.endswith('.tif')), None)
     if file_name is not None:
         mask_array = raster_to_array(mask_path, file_name)
-        masked_arr = masked_where(mask_array == 0, mask_array)
-        masked_arr[~masked_arr.mask] = arr.ravel()
-        masked_arr.mask = nomask
-        arr = masked_arr.filled(0)
-        out = arr
+        out = CompressedGrid(mask_array != 0).expand(arr.ravel(), fill=0)
 
     return out
 
 
-def array_to_raster(save_array, out_path, geo):
-    key = None
-    pass
+def geotiff_options(data_type=gdal.GDT_Float32, compress='DEFLATE', tiled=True, block_size=256):
+    """
+    GTiff creation options for an internally tiled, compressed raster.
+
+    :param data_type: GDAL data type of the raster, chooses the predictor.
+    :param compress: GDAL compression, e.g. 'DEFLATE', 'ZSTD' or 'LZW', None writes uncompressed.
+    :param tiled: Write square tiles of block_size pixels instead of strips.
+    :param block_size: Tile edge in pixels, a multiple of 16.
+    :return: List of creation options, BigTIFF is used whenever the file could pass 4 GB.
+    """
+    options = ['BIGTIFF=IF_SAFER']
+    if tiled:
+        options += ['TILED=YES', 'BLOCKXSIZE={0}'.format(block_size), 'BLOCKYSIZE={0}'.format(block_size)]
+    if compress:
+        # floating point predictor for float rasters, horizontal differencing for integers
+        predictor = 3 if data_type in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+        options += ['COMPRESS={0}'.format(compress), 'PREDICTOR={0}'.format(predictor)]
+    return options
+
+
+def array_to_raster(save_array, out_path, geo, compress='DEFLATE', tiled=True, block_size=256, descriptions=None):
+    """
+    Write a 2-D array to a GeoTIFF on the grid described by geo.
+
+    :param save_array: Numpy array, rows by cols of geo, or a sequence of them (or a
+        (band, row, col) array) written as the bands of one raster.
+    :param out_path: Path of the new raster.
+    :param geo: dict of geographic attributes from get_raster_geo_attributes.
+    :param compress: Compression, see geotiff_options.
+    :param tiled: Internally tiled, see geotiff_options.
+    :param block_size: Tile edge in pixels.
+    :param descriptions: Optional description of each band.
+    :return: Size in bytes of the written file.
+    """
+    if isinstance(save_array, (list, tuple)) or save_array.ndim == 3:
+        bands, band_count = save_array, len(save_array)
+    else:
+        bands, band_count = [save_array], geo['bands']
+
     driver = gdal.GetDriverByName('GTiff')
+    options = geotiff_options(geo['data_type'], compress, tiled, block_size)
     out_data_set = driver.Create(out_path, geo['cols'], geo['rows'],
-                                 geo['bands'], geo['data_type'])
+                                 band_count, geo['data_type'], options)
     out_data_set.SetGeoTransform(geo['geotransform'])
     out_data_set.SetProjection(geo['projection'])
-    output_band = out_data_set.GetRasterBand(1)
-    output_band.WriteArray(save_array, 0, 0)
-    print 'written array {} mean value: {}'.format(key, save_array.mean())
+    for i, band in enumerate(bands):
+        output_band = out_data_set.GetRasterBand(i + 1)
+        output_band.WriteArray(band, 0, 0)
+        if descriptions is not None:
+            output_band.SetDescription(descriptions[i])
+    out_data_set.FlushCache()
+    out_data_set = None
 
-    return None
+    return os.path.getsize(out_path)
+
+
+# writers still alive, closed at exit so that queued arrays are written. Held weakly, an
+# owner dropping its writer lets it go
+_WRITERS = weakref.WeakSet()
+
+
+def _close_writers():
+    for writer in list(_WRITERS):
+        writer.close()
+
+
+atexit.register(_close_writers)
+
+
+class RasterWriter(object):
+    """
+    Writes arrays to GeoTIFF with array_to_raster on a background thread.
+
+    write() queues an array and returns, the caller only blocks when max_queue arrays
+    are already waiting to be written, so encoding and I/O overlap with computation.
+    An error on the writer thread is raised again by the next call to write, flush or
+    close. Queued arrays are written as they are when their turn comes, pass copy=True
+    for an array the caller goes on modifying.
+    """
+
+    def __init__(self, max_queue=4, write_function=array_to_raster, **options):
+        """
+        :param max_queue: Number of arrays waiting to be written before write() blocks.
+        :param write_function: Called as array_to_raster is, returns the bytes written.
+        :param options: compress, tiled and block_size passed on to array_to_raster.
+        """
+        self.write_function = write_function
+        self.options = options
+        self._queue = Queue.Queue(max_queue)
+        self._thread = None
+        self._error = None
+        self._lock = threading.Lock()
+        self.files = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.
+        self.wait_seconds = 0.
+        _WRITERS.add(self)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                save_array, out_path, geo = job
+                start = time.time()
+                size = self.write_function(save_array, out_path, geo, **self.options)
+                with self._lock:
+                    self.files += 1
+                    self.bytes_written += size
+                    self.write_seconds += time.time() - start
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def write(self, save_array, out_path, geo, copy=False):
+        """ queues save_array to be written to out_path, blocks while the queue is full"""
+        self._raise()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='RasterWriter')
+            self._thread.daemon = True
+            self._thread.start()
+
+        start = time.time()
+        self._queue.put((save_array.copy() if copy else save_array, out_path, geo))
+        self.wait_seconds += time.time() - start
+        return out_path
+
+    def flush(self):
+        """ waits until every queued array is on disk"""
+        start = time.time()
+        self._queue.join()
+        self.wait_seconds += time.time() - start
+        self._raise()
+
+    def close(self):
+        """ flushes the queue and stops the writer thread, a later write starts a new one"""
+        if self._thread is not None:
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise()
+
+    def summary(self):
+        """ dict of the rasters written so far, their bytes and the seconds spent writing and waiting"""
+        with self._lock:
+            return {'files': self.files, 'bytes': self.bytes_written, 'write_seconds': self.write_seconds,
+                    'wait_seconds': self.wait_seconds}
 
 
 if __name__ == '__main__':